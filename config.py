@@ -9,7 +9,84 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432'),
     'database': os.getenv('DB_NAME', 'firma'),
     'user': os.getenv('DB_USER', 'postgres'),
-    'password': os.getenv('DB_PASSWORD', 'postgres')
+    'password': os.getenv('DB_PASSWORD', 'postgres'),
+    # Réplica de leitura opcional (ex: 'host=replica1 dbname=firma user=... password=...')
+    'replica_dsn': os.getenv('DB_REPLICA_DSN') or None,
+}
+
+# Encaminhamento de leituras para a réplica (só se DB_REPLICA_DSN estiver definido)
+DB_REPLICA_CONFIG = {
+    'max_lag_s': float(os.getenv('DB_REPLICA_MAX_LAG_S', '30')),
+    'check_interval_s': float(os.getenv('DB_REPLICA_CHECK_S', '10')),
+    'read_your_writes_s': float(os.getenv('DB_REPLICA_RYW_S', '5')),
+    'max_size': int(os.getenv('DB_REPLICA_POOL_MAX', '5')),
+}
+
+# Pool de ligações (partilhado por todo o processo)
+DB_POOL_CONFIG = {
+    'min_size': int(os.getenv('DB_POOL_MIN', '1')),
+    'max_size': int(os.getenv('DB_POOL_MAX', '10')),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'health_check_after': float(os.getenv('DB_POOL_HEALTHCHECK_S', '30')),
+    'idle_timeout': float(os.getenv('DB_POOL_IDLE_TIMEOUT_S', '300')),
+}
+
+# Timeouts: por query (0 = sem limite) e orçamento total por página do dashboard
+DB_TIMEOUT_CONFIG = {
+    'statement_timeout_ms': int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0')),
+    'page_budget_s': float(os.getenv('PAGE_QUERY_BUDGET_S', '20')),
+}
+
+# Linhas/instruções por round-trip nas escritas em lote (execute_values / execute_many)
+DB_BATCH_PAGE_SIZE = int(os.getenv('DB_BATCH_PAGE_SIZE', '500'))
+
+# Instrumentação de queries / log de queries lentas
+QUERY_LOG_CONFIG = {
+    'slow_ms': float(os.getenv('DB_SLOW_QUERY_MS', '500')),
+    'path': os.getenv('DB_SLOW_QUERY_LOG', 'logs/slow_queries.log'),
+    'max_bytes': int(os.getenv('DB_SLOW_QUERY_LOG_MAX_BYTES', str(5 * 1024 * 1024))),
+    'backup_count': int(os.getenv('DB_SLOW_QUERY_LOG_BACKUPS', '5')),
+    'samples_per_query': int(os.getenv('DB_QUERY_STATS_SAMPLES', '500')),
+}
+
+# Cache dos relatórios (por processo; invalidado pelas escritas feitas via Database)
+CACHE_CONFIG = {
+    'enabled': os.getenv('REPORT_CACHE_ENABLED', '1').lower() not in ('0', 'false', 'no'),
+    'max_entries': int(os.getenv('REPORT_CACHE_MAX_ENTRIES', '256')),
+    # LISTEN/NOTIFY: invalidação entre processos; com o listener ligado os TTL são multiplicados
+    'listen': os.getenv('REPORT_CACHE_LISTEN', '1').lower() not in ('0', 'false', 'no'),
+    'listen_ttl_multiplier': float(os.getenv('REPORT_CACHE_LISTEN_TTL_MULTIPLIER', '10')),
+}
+
+# Jobs periódicos (src/scheduler.py): intervalos em segundos
+SCHEDULER_CONFIG = {
+    # Corre o agendador numa thread de cada processo da app (desligar se usar scripts/run_scheduler.py)
+    'in_app': os.getenv('SCHEDULER_IN_APP', '1').lower() not in ('0', 'false', 'no'),
+    'poll_s': float(os.getenv('SCHEDULER_POLL_S', '15')),
+    'faturas_vencidas_s': int(os.getenv('JOB_FATURAS_VENCIDAS_S', '900')),
+    'cache_warmup_s': int(os.getenv('JOB_CACHE_WARMUP_S', '30')),
+    # Verificação das vistas materializadas devidas (a política de cada uma está em mv_refresh_policy)
+    'mv_refresh_s': int(os.getenv('JOB_MV_REFRESH_S', '30')),
+    'kpi_snapshot_s': int(os.getenv('JOB_KPI_SNAPSHOT_S', '60')),
+    'movimentos_particoes_s': int(os.getenv('JOB_MOVIMENTOS_PARTICOES_S', '86400')),
+    # Snapshot diário do stock de cada material (base do stock à data)
+    'stock_snapshot_s': int(os.getenv('JOB_STOCK_SNAPSHOT_S', '86400')),
+}
+
+# Partições mensais de movimentos_stock (src/partitions.py)
+MOVIMENTOS_CONFIG = {
+    # Partições criadas com antecedência (além do mês atual)
+    'meses_a_frente': int(os.getenv('MOVIMENTOS_PARTICOES_A_FRENTE', '3')),
+    # Meses mantidos na tabela; os anteriores são arquivados no schema `arquivo` (0 = nunca)
+    'retencao_meses': int(os.getenv('MOVIMENTOS_RETENCAO_MESES', '0')),
+}
+
+# Previsão de consumo de materiais (src/forecasting.py)
+FORECAST_CONFIG = {
+    # Pelo menos 1 dia: sem histórico não há nada a que ajustar os modelos
+    'historico_dias': max(1, int(os.getenv('FORECAST_HISTORICO_DIAS', '365'))),
+    # Nível de serviço do stock de segurança (probabilidade de não faltar durante o lead time)
+    'nivel_servico': float(os.getenv('FORECAST_NIVEL_SERVICO', '0.95')),
 }
 
 # Configurações da Aplicação
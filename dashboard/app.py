@@ -6,12 +6,29 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
 
-from database import get_database
+from database import (
+    WriteSession,
+    get_database,
+    get_pool_stats,
+    get_replica_stats,
+    run_concurrently,
+    set_page_budget,
+    set_write_session,
+)
 
-from config import APP_TITLE, APP_ICON
+from config import APP_TITLE, APP_ICON, QUERY_LOG_CONFIG
 from src import pricing, inventory, delivery, visualizations, forms
-from src import production, material_tracking, invoicing
+from src import production, material_tracking, invoicing, encomendas, forecasting
+import cache
+import cache_listener
+import query_stats
+import reference_data
+import scheduler
+import materialized_views
+import kpi
+import partitions
 from datetime import date, timedelta
+import pandas as pd
 
 # Configuração da página
 st.set_page_config(
@@ -21,9 +38,76 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Invalidação do cache entre processos (thread única por processo)
+cache_listener.start_listener()
+# Jobs periódicos (faturas vencidas, aquecimento do cache), fora do render das páginas
+scheduler.start_scheduler()
+
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def _lista_referencia(nome: str, versao: tuple) -> reference_data.ListaReferencia:
+    return reference_data.carregar(nome)
+
+
+def referencia(nome: str) -> reference_data.ListaReferencia:
+    """Lista de um dropdown (clientes, materiais, ...), só relida da BD quando a tabela muda."""
+    lista = _lista_referencia(nome, reference_data.versao(nome))
+    if lista.vazia:
+        # Pode ser uma falha de ligação: não fica guardada até à próxima escrita.
+        _lista_referencia.clear()
+    return lista
+
+
+def cursor_paginacao(chave: str, filtros: tuple):
+    """Cursor da página atual da lista `chave`; volta à 1.ª página quando os filtros mudam."""
+    estado = st.session_state.get(chave)
+    if estado is None or estado["filtros"] != filtros:
+        estado = st.session_state[chave] = {"filtros": filtros, "cursores": [None]}
+    return estado["cursores"][-1]
+
+
+def controlos_paginacao(chave: str, pagina, total_estimado, por_pagina: int) -> None:
+    """Anterior/Seguinte: guarda-se o cursor de cada página vista para poder voltar atrás."""
+    cursores = st.session_state[chave]["cursores"]
+    col_ant, col_info, col_seg = st.columns([1, 3, 1])
+    if col_ant.button("◀ Anterior", key=f"{chave}_anterior", disabled=len(cursores) == 1):
+        cursores.pop()
+        st.rerun()
+    info = f"Página {len(cursores)}"
+    if total_estimado:
+        info += f" de ~{max(1, (total_estimado + por_pagina - 1) // por_pagina)} (~{total_estimado:,} registos, estimativa)"
+    col_info.caption(info)
+    if col_seg.button("Seguinte ▶", key=f"{chave}_seguinte", disabled=pagina.next_cursor is None):
+        cursores.append(pagina.next_cursor)
+        st.rerun()
+
+
+def frescura(mv_nome: str) -> None:
+    """Legenda com a hora da última atualização de um relatório lido de uma vista materializada."""
+    info = materialized_views.get_frescura(mv_nome)
+    if info["atualizada_em"] is None:
+        st.caption("🕒 Ainda não atualizado")
+        return
+    texto = f"🕒 Atualizado em {info['atualizada_em']:%d/%m %H:%M}"
+    if info["suja"]:
+        texto += " · há alterações ainda por refletir"
+    st.caption(texto)
+
+
 # Título principal
 st.title(f"{APP_ICON} {APP_TITLE}")
 
+# Orçamento de tempo para todas as queries deste render: queries lentas são canceladas
+# e a página mostra o que conseguiu obter, com um aviso.
+page_budget = set_page_budget()
+budget_notice = st.empty()
+
+# Depois de uma escrita desta sessão, as suas leituras ficam no primário uns segundos
+# (read-your-writes); as outras sessões continuam a ler da réplica.
+if "db_write_session" not in st.session_state:
+    st.session_state.db_write_session = WriteSession()
+set_write_session(st.session_state.db_write_session)
+
 # Sidebar com navegação
 st.sidebar.title("📈 Navegação")
 
@@ -38,6 +122,7 @@ page = st.sidebar.radio(
         "⏱️ Controlo Produção",
         "💶 Faturação",
         "📋 Encomendas",
+        "🩺 Diagnóstico BD",
     ],
     key="reports"
 )
@@ -63,34 +148,46 @@ insert_page = st.sidebar.radio(
 if page == "🏠 Dashboard":
     st.header("🏠 Dashboard Geral")
     
-    # Métricas principais
-    col1, col2, col3, col4 = st.columns(4)
-    
     try:
-        # Rentabilidade
-        df_rent = pricing.get_rentabilidade_produtos()
-        if not df_rent.empty:
-            total_receita = df_rent['receita_total'].sum()
-            col1.metric("Receita Total", f"€{total_receita:,.2f}")
-        
-        # Stock crítico
-        df_stock = inventory.get_stock_critico()
-        if not df_stock.empty:
-            num_criticos = len(df_stock)
-            col2.metric("Materiais Críticos", num_criticos)
-        
-        # Entregas pendentes
-        df_entregas = delivery.get_entregas_pendentes()
-        if not df_entregas.empty:
-            num_pendentes = len(df_entregas)
-            col3.metric("Entregas Pendentes", num_pendentes)
-        
-        # Margem média
-        if not df_rent.empty:
-            margem_media = df_rent['margem_media_pct'].mean()
-            col4.metric("Margem Média", f"{margem_media:.1f}%")
+        # Queries independentes: pedidas em paralelo
+        dados = run_concurrently({
+            "kpis": kpi.get_kpi_historico,
+            "rent": pricing.get_rentabilidade_produtos,
+            "stock": inventory.get_stock_critico,
+            "timeline": lambda: delivery.get_timeline_entregas(30),
+        })
+
+        # Métricas principais: registo pré-calculado (kpi_snapshot), com a tendência dos últimos 30 dias
+        df_kpis = dados["kpis"]
+        if df_kpis.empty:
+            st.info("KPIs ainda não calculados (o job kpi.snapshot corre em segundo plano).")
+        else:
+            atual = df_kpis.iloc[-1]
+            anterior = df_kpis.iloc[-2] if len(df_kpis) > 1 else None
+            metricas = [
+                ("Receita Total", "receita_total", "€{:,.2f}"),
+                ("Materiais Críticos", "materiais_criticos", "{:.0f}"),
+                ("Entregas Pendentes", "entregas_pendentes", "{:.0f}"),
+                ("Margem Média", "margem_media_pct", "{:.1f}%"),
+                ("Saldo a Receber", "saldo_receber", "€{:,.2f}"),
+            ]
+            for col, (titulo, coluna, formato) in zip(st.columns(len(metricas)), metricas):
+                valor = atual[coluna]
+                delta = None
+                if anterior is not None and pd.notna(valor) and pd.notna(anterior[coluna]):
+                    delta = f"{valor - anterior[coluna]:+,.1f}"
+                col.metric(titulo, formato.format(valor) if pd.notna(valor) else "-", delta)
+                if len(df_kpis) > 1:
+                    col.plotly_chart(
+                        visualizations.create_sparkline(df_kpis, "dia", coluna),
+                        use_container_width=True,
+                        config={"displayModeBar": False},
+                    )
+            st.caption(f"🕒 KPIs calculados em {atual['atualizado_em']:%d/%m %H:%M}")
         
         st.markdown("---")
+        df_rent = dados["rent"]
+        df_stock = dados["stock"]
         
         # Gráficos
         col1, col2 = st.columns(2)
@@ -119,7 +216,7 @@ if page == "🏠 Dashboard":
         
         # Entregas próximas
         st.subheader("📅 Entregas Próximas (30 dias)")
-        df_timeline = delivery.get_timeline_entregas(30)
+        df_timeline = dados["timeline"]
         if not df_timeline.empty:
             st.dataframe(df_timeline, use_container_width=True)
         else:
@@ -136,9 +233,16 @@ elif page == "💰 Análise de Preços":
     st.header("💰 Análise de Preços e Rentabilidade")
     
     try:
+        dados = run_concurrently({
+            "rent": pricing.get_rentabilidade_produtos,
+            "mercado": pricing.get_precos_vs_mercado,
+            "clientes": lambda: pricing.get_top_clientes(10),
+            "categorias": pricing.get_margem_por_categoria,
+        })
+
         # Rentabilidade por produto
         st.subheader("📈 Rentabilidade por Produto")
-        df_rent = pricing.get_rentabilidade_produtos()
+        df_rent = dados["rent"]
         if not df_rent.empty:
             st.dataframe(df_rent, use_container_width=True)
             
@@ -168,7 +272,7 @@ elif page == "💰 Análise de Preços":
         
         # Preços vs Mercado
         st.subheader("🔄 Comparação com Mercado")
-        df_mercado = pricing.get_precos_vs_mercado()
+        df_mercado = dados["mercado"]
         if not df_mercado.empty:
             st.dataframe(df_mercado, use_container_width=True)
             
@@ -184,7 +288,7 @@ elif page == "💰 Análise de Preços":
         
         # Top Clientes
         st.subheader("👥 Top Clientes")
-        df_clientes = pricing.get_top_clientes(10)
+        df_clientes = dados["clientes"]
         if not df_clientes.empty:
             st.dataframe(df_clientes, use_container_width=True)
             
@@ -200,7 +304,7 @@ elif page == "💰 Análise de Preços":
         
         # Margem por Categoria
         st.subheader("🏷️ Margem por Categoria")
-        df_cat = pricing.get_margem_por_categoria()
+        df_cat = dados["categorias"]
         if not df_cat.empty:
             st.dataframe(df_cat, use_container_width=True)
             
@@ -222,9 +326,19 @@ elif page == "📦 Gestão de Stock":
     st.header("📦 Gestão de Stock e Inventário")
     
     try:
+        dados = run_concurrently({
+            "critico": inventory.get_stock_critico,
+            "valor": inventory.get_valor_stock,
+            "rotatividade": inventory.get_rotatividade_materiais,
+            "consumo": lambda: inventory.get_consumo_materiais(60),
+            "previsao": lambda: inventory.get_previsao_necessidades(30),
+            "previsao_consumo": lambda: forecasting.get_previsao_consumo(30),
+            "fornecedores": inventory.get_fornecedores_performance,
+        })
+
         # Stock Crítico
         st.subheader("⚠️ Stock Crítico - Ação Necessária")
-        df_critico = inventory.get_stock_critico()
+        df_critico = dados["critico"]
         if not df_critico.empty:
             st.error(f"🔴 {len(df_critico)} materiais precisam de reposição!")
             st.dataframe(df_critico, use_container_width=True)
@@ -243,7 +357,18 @@ elif page == "📦 Gestão de Stock":
         
         # Valor do Stock
         st.subheader("💵 Valor do Stock")
-        df_valor = inventory.get_valor_stock()
+        data_valor = st.date_input("Valor à data (fim do dia)", value=date.today(), max_value=date.today())
+        if data_valor < date.today():
+            df_valor = inventory.get_valor_stock(data_valor)
+            st.caption("Stock reconstruído a partir dos snapshots e movimentos; valor ao preço atual.")
+        else:
+            df_valor = dados["valor"]
+        # Só consulta quando pedido: a reconstrução por material é pesada para datas passadas
+        if st.checkbox("Mostrar stock por material", key="stock_por_material"):
+            st.dataframe(
+                inventory.get_stock_materiais(data_valor if data_valor < date.today() else None),
+                use_container_width=True,
+            )
         if not df_valor.empty:
             st.dataframe(df_valor, use_container_width=True)
             
@@ -271,15 +396,25 @@ elif page == "📦 Gestão de Stock":
         
         # Rotatividade
         st.subheader("🔄 Rotatividade de Materiais (3 meses)")
-        df_rot = inventory.get_rotatividade_materiais()
+        df_rot = dados["rotatividade"]
         if not df_rot.empty:
             st.dataframe(df_rot, use_container_width=True)
         
         st.markdown("---")
         
+        # Consumo e cobertura
+        st.subheader("📉 Consumo Médio e Dias de Cobertura (60 dias)")
+        df_consumo = dados["consumo"]
+        if not df_consumo.empty:
+            st.dataframe(df_consumo, use_container_width=True)
+        else:
+            st.info("Sem saídas de stock nos últimos 60 dias.")
+        
+        st.markdown("---")
+        
         # Previsão de Necessidades
         st.subheader("🔮 Previsão de Necessidades (30 dias)")
-        df_prev = inventory.get_previsao_necessidades(30)
+        df_prev = dados["previsao"]
         if not df_prev.empty:
             st.dataframe(df_prev, use_container_width=True)
             
@@ -290,9 +425,24 @@ elif page == "📦 Gestão de Stock":
         
         st.markdown("---")
         
+        # Previsão de consumo (histórico de saídas)
+        st.subheader("📈 Previsão de Consumo e Ponto de Encomenda (30 dias)")
+        df_pc = dados["previsao_consumo"]
+        if not df_pc.empty:
+            st.caption(
+                "SES ou Croston (consumo intermitente) ajustado ao histórico diário de saídas; "
+                "ponto de encomenda = consumo previsto no lead time + stock de segurança."
+            )
+            st.dataframe(df_pc, use_container_width=True)
+            n_repor = int((df_pc["status"] == "REPOR").sum())
+            if n_repor:
+                st.warning(f"⚠️ {n_repor} materiais estão no ponto de encomenda ou abaixo!")
+        
+        st.markdown("---")
+        
         # Performance Fornecedores
         st.subheader("🚢 Performance dos Fornecedores")
-        df_forn = inventory.get_fornecedores_performance()
+        df_forn = dados["fornecedores"]
         if not df_forn.empty:
             st.dataframe(df_forn, use_container_width=True)
             
@@ -357,32 +507,7 @@ elif page == "🚚 Entregas":
         # Entregas por Cidade
         st.subheader("🏙️ Entregas por Cidade")
 
-        if hasattr(delivery, "get_entregas_por_cidade"):
-            df_cid = delivery.get_entregas_por_cidade()
-        else:
-            # Fallback para quando o Streamlit ainda está com um módulo antigo em cache.
-            df_reg = delivery.get_entregas_por_regiao()
-            if not df_reg.empty and "regiao" in df_reg.columns:
-                s = df_reg["regiao"].fillna("").astype(str)
-                s = s.str.replace("\n", ",", regex=False)
-                cidade = s.str.split(",").str[-1].str.strip()
-                cidade = cidade.str.replace(r"^\s*\d{4}-\d{3}\s*", "", regex=True).str.strip()
-                cidade = cidade.where(cidade.ne(""), "Sem cidade")
-
-                df_cid = df_reg.copy()
-                df_cid["cidade"] = cidade
-                df_cid = (
-                    df_cid.groupby("cidade", as_index=False)
-                    .agg(
-                        num_entregas=("num_entregas", "sum"),
-                        concluidas=("concluidas", "sum"),
-                        atraso_medio_dias=("atraso_medio_dias", "mean"),
-                        custo_medio_entrega=("custo_medio_entrega", "mean"),
-                    )
-                    .sort_values("num_entregas", ascending=False)
-                )
-            else:
-                df_cid = df_reg
+        df_cid = delivery.get_entregas_por_cidade()
 
         if not df_cid.empty:
             st.dataframe(df_cid, use_container_width=True)
@@ -482,10 +607,12 @@ elif page == "⏱️ Controlo Produção":
             df_eff_etapas = production.get_tempo_medio_real_vs_estimado()
             if not df_eff_etapas.empty:
                 st.dataframe(df_eff_etapas, use_container_width=True)
+            frescura("mv_tempo_medio_real_vs_estimado")
         with col2:
             df_eff_op = production.get_produtividade_operario()
             if not df_eff_op.empty:
                 st.dataframe(df_eff_op, use_container_width=True)
+            frescura("mv_produtividade_operario")
 
     except Exception as e:
         st.error(f"❌ Erro na produção: {e}")
@@ -497,7 +624,6 @@ elif page == "💶 Faturação":
     st.header("💶 Faturação")
 
     try:
-        invoicing.refresh_vencidas()
         tab1, tab2, tab3 = st.tabs(["➕ Criar/Emitir", "📄 Lista", "📊 Contas a receber"])
 
         with tab1:
@@ -528,11 +654,14 @@ elif page == "💶 Faturação":
                     st.error(f"Falha ao gerar PDF: {e}")
 
         with tab2:
-            df = invoicing.list_faturas()
-            if df.empty:
+            por_pagina = st.selectbox("Por página", [25, 50, 100, 200], index=1, key="fat_por_pagina")
+            cursor = cursor_paginacao("fat_lista_pag", (por_pagina,))
+            pagina = invoicing.pagina_faturas(cursor=cursor, por_pagina=por_pagina)
+            if pagina.rows.empty and cursor is None:
                 st.info("Sem faturas")
             else:
-                st.dataframe(df, use_container_width=True)
+                st.dataframe(pagina.rows, use_container_width=True)
+                controlos_paginacao("fat_lista_pag", pagina, invoicing.estimar_faturas(), por_pagina)
                 st.markdown("---")
                 st.subheader("Registar pagamento")
                 fatura_id = st.number_input("Fatura ID", min_value=0, step=1, value=0, key="fat_pag_fatura")
@@ -582,17 +711,20 @@ elif page == "💶 Faturação":
                     st.dataframe(df_aging, use_container_width=True)
                 else:
                     st.success("Sem faturas em aberto")
+                frescura("mv_aging_report")
             with col2:
                 st.subheader("Receita faturada vs recebida")
                 df_rev = invoicing.get_receita_faturada_vs_recebida()
                 if not df_rev.empty:
                     st.dataframe(df_rev, use_container_width=True)
+                frescura("mv_receita_faturada_vs_recebida")
 
             st.markdown("---")
             st.subheader("Cash flow (recebimentos)")
             df_cf = invoicing.get_cash_flow()
             if not df_cf.empty:
                 st.dataframe(df_cf, use_container_width=True)
+            frescura("mv_cash_flow")
 
     except Exception as e:
         st.error(f"❌ Erro na faturação: {e}")
@@ -611,23 +743,6 @@ elif page == "📋 Encomendas":
         db = get_database()
         tab_lista, tab_cal, tab_kanban = st.tabs(["Lista", "Calendário", "Kanban"])
 
-        base_q = """
-        SELECT
-            e.id,
-            c.nome AS cliente,
-            tp.nome AS produto,
-            e.data_pedido,
-            e.data_entrega_prometida,
-            e.status,
-            e.prioridade,
-            e.valor_total
-        FROM encomendas e
-        JOIN clientes c ON e.cliente_id = c.id
-        JOIN produtos p ON e.produto_id = p.id
-        JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
-        WHERE 1=1
-        """
-
         with tab_lista:
             st.subheader("Lista")
             col1, col2, col3 = st.columns(3)
@@ -641,51 +756,30 @@ elif page == "📋 Encomendas":
                 periodo = st.date_input("Período (pedido)", value=(date.today() - timedelta(days=180), date.today()))
             with col3:
                 busca = st.text_input("Busca (cliente/produto)", "")
+            por_pagina = st.selectbox("Por página", [25, 50, 100, 200], index=1, key="enc_por_pagina")
 
-            q = base_q
-            params = []
-
-            if status_f:
-                q += " AND e.status = ANY(%s)"
-                params.append(status_f)
-
+            data_de = data_ate = None
             if isinstance(periodo, tuple) and len(periodo) == 2:
-                q += " AND e.data_pedido BETWEEN %s AND %s"
-                params.extend([periodo[0], periodo[1]])
-
-            if busca:
-                q += " AND (c.nome ILIKE %s OR tp.nome ILIKE %s)"
-                params.extend([f"%{busca}%", f"%{busca}%"])
+                data_de, data_ate = periodo
 
-            q += " ORDER BY e.data_pedido DESC, e.id DESC"
-
-            df = db.execute_query(q, tuple(params) if params else None)
-            if df.empty:
+            filtros = (tuple(status_f), data_de, data_ate, busca or None)
+            cursor = cursor_paginacao("enc_lista_pag", filtros + (por_pagina,))
+            pagina = encomendas.pagina_encomendas(*filtros, cursor=cursor, por_pagina=por_pagina)
+            if pagina.rows.empty and cursor is None:
                 st.info("Sem encomendas com estes filtros")
             else:
-                st.dataframe(df, use_container_width=True)
+                st.dataframe(pagina.rows, use_container_width=True)
+                controlos_paginacao("enc_lista_pag", pagina, encomendas.estimar_encomendas(*filtros), por_pagina)
 
             st.markdown("---")
             st.subheader("Detalhe")
             encomenda_id = st.number_input("Selecionar Encomenda ID", min_value=0, step=1, value=0)
             if encomenda_id > 0:
-                enc = db.execute_query(
-                    """
-                    SELECT
-                        e.*, c.nome AS cliente_nome, c.email AS cliente_email, c.contacto AS cliente_contacto,
-                        tp.nome AS produto_tipo, p.codigo AS produto_codigo
-                    FROM encomendas e
-                    JOIN clientes c ON e.cliente_id = c.id
-                    JOIN produtos p ON e.produto_id = p.id
-                    JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
-                    WHERE e.id = %s
-                    """,
-                    (int(encomenda_id),),
-                )
-                if enc.empty:
+                detalhe = encomendas.get_encomenda_detail(int(encomenda_id))
+                if detalhe is None:
                     st.error("Encomenda não encontrada")
                 else:
-                    r = enc.iloc[0]
+                    r = detalhe.cabecalho
 
                     # Sec 1: info geral
                     st.markdown("### Sec 1: Info geral")
@@ -697,8 +791,8 @@ elif page == "📋 Encomendas":
 
                     novo_status = st.selectbox(
                         "Alterar status",
-                        ['pendente', 'em_producao', 'aguarda_material', 'concluido', 'entregue', 'cancelado'],
-                        index=['pendente', 'em_producao', 'aguarda_material', 'concluido', 'entregue', 'cancelado'].index(r['status']),
+                        list(encomendas.ESTADOS),
+                        index=encomendas.ESTADOS.index(detalhe.status),
                         key="enc_status",
                     )
                     if st.button("Guardar status"):
@@ -709,7 +803,7 @@ elif page == "📋 Encomendas":
 
                     # Sec 2: materiais
                     st.markdown("### Sec 2: Materiais usados")
-                    df_mat = material_tracking.get_desperdicio_por_encomenda(int(encomenda_id))
+                    df_mat = detalhe.materiais
                     if not df_mat.empty:
                         st.dataframe(df_mat, use_container_width=True)
                         fig = visualizations.create_bar_chart(df_mat, "material", "custo_real", "Custo real por material")
@@ -718,8 +812,7 @@ elif page == "📋 Encomendas":
                         st.info("Sem consumos registados ainda")
 
                     st.markdown("#### Registar consumo real")
-                    df_materiais = forms.get_lista_materiais()
-                    mat_opts = {f"{row['id']} - {row['nome']} ({row['unidade']})": int(row["id"]) for _, row in df_materiais.iterrows()} if not df_materiais.empty else {}
+                    mat_opts = referencia("materiais").opcoes
                     if mat_opts:
                         mat_label = st.selectbox("Material", list(mat_opts.keys()))
                         qtd_real = st.number_input("Qtd real", min_value=0.0, step=0.1, value=0.0)
@@ -732,10 +825,10 @@ elif page == "📋 Encomendas":
 
                     # Sec 3: produção
                     st.markdown("### Sec 3: Etapas produção")
-                    df_etapas = production.get_etapas_por_encomenda(int(encomenda_id))
+                    df_etapas = detalhe.etapas
                     if not df_etapas.empty:
                         st.dataframe(df_etapas, use_container_width=True)
-                        df_gantt = production.get_gantt_encomenda(int(encomenda_id))
+                        df_gantt = detalhe.gantt
                         if not df_gantt.empty:
                             fig = visualizations.create_timeline(
                                 df_gantt,
@@ -763,7 +856,7 @@ elif page == "📋 Encomendas":
 
                     # Sec 4: faturação
                     st.markdown("### Sec 4: Faturação")
-                    df_fat = db.execute_query("SELECT id, num_fatura, status, valor_total, valor_pago, saldo FROM faturas WHERE encomenda_id=%s ORDER BY id DESC", (int(encomenda_id),))
+                    df_fat = detalhe.faturas
                     if not df_fat.empty:
                         st.dataframe(df_fat, use_container_width=True)
                     else:
@@ -792,10 +885,7 @@ elif page == "📋 Encomendas":
                         )
                         st.success("Documento guardado")
 
-                    df_docs = db.execute_query(
-                        "SELECT id, tipo, nome_arquivo, caminho_arquivo, criado_em FROM encomenda_documentos WHERE encomenda_id=%s ORDER BY criado_em DESC",
-                        (int(encomenda_id),),
-                    )
+                    df_docs = detalhe.documentos
                     if not df_docs.empty:
                         st.dataframe(df_docs, use_container_width=True)
 
@@ -803,10 +893,7 @@ elif page == "📋 Encomendas":
 
                     # Sec 6: histórico
                     st.markdown("### Sec 6: Histórico")
-                    df_hist = db.execute_query(
-                        "SELECT criado_em, tipo_evento, descricao, usuario FROM encomenda_eventos WHERE encomenda_id=%s ORDER BY criado_em DESC",
-                        (int(encomenda_id),),
-                    )
+                    df_hist = detalhe.eventos
                     if not df_hist.empty:
                         st.dataframe(df_hist, use_container_width=True)
                     nota = st.text_area("Nota interna", "", key="enc_nota")
@@ -864,22 +951,164 @@ elif page == "📋 Encomendas":
 
         with tab_kanban:
             st.subheader("Kanban")
-            df = db.execute_query(base_q, None)
+            df = encomendas.get_kanban()
             if df.empty:
                 st.info("Sem encomendas")
             else:
-                cols = st.columns(5)
-                estados = ["pendente", "aguarda_material", "em_producao", "concluido", "entregue"]
-                for i, estado in enumerate(estados):
-                    with cols[i]:
-                        st.markdown(f"#### {estado}")
-                        sub = df[df["status"] == estado]
-                        for _, row in sub.head(25).iterrows():
-                            st.caption(f"#{int(row['id'])} • {row['cliente']} • €{float(row['valor_total']):,.0f}")
+                df["cartao"] = (
+                    "#" + df["id"].astype(str) + " • " + df["cliente"].astype(str)
+                    + " • €" + df["valor_total"].map("{:,.0f}".format)
+                )
+                totais = df.groupby("status", observed=True)["total"].first()
+                cols = st.columns(len(encomendas.KANBAN_ESTADOS))
+                for col, estado in zip(cols, encomendas.KANBAN_ESTADOS):
+                    with col:
+                        total = int(totais.get(estado, 0))
+                        st.markdown(f"#### {estado} ({total})")
+                        cartoes = df.loc[df["status"] == estado, "cartao"]
+                        if len(cartoes):
+                            st.caption("  \n".join(cartoes))
+                        if total > len(cartoes):
+                            st.caption(f"… e mais {total - len(cartoes)} (ver Lista)")
+
+                st.markdown("---")
+                st.markdown("#### Mover encomendas")
+                opcoes_mover = dict(zip(df["cartao"], df["id"].astype(int).tolist()))
+                selecionadas = st.multiselect("Encomendas", list(opcoes_mover.keys()), key="kanban_mover_sel")
+                destino = st.selectbox("Novo status", list(encomendas.ESTADOS), key="kanban_mover_destino")
+                if st.button("Mover", disabled=not selecionadas):
+                    ok = encomendas.mover_encomendas([opcoes_mover[s] for s in selecionadas], destino)
+                    if ok:
+                        st.rerun()
+                    else:
+                        st.error("Falha ao mover encomendas")
 
     except Exception as e:
         st.error(f"❌ Erro nas encomendas: {e}")
 
+# ====================
+# PÁGINA: DIAGNÓSTICO BD
+# ====================
+
+elif page == "🩺 Diagnóstico BD":
+    st.header("🩺 Diagnóstico da Base de Dados")
+    st.caption(
+        f"Estatísticas deste processo desde o arranque. Queries acima de "
+        f"{QUERY_LOG_CONFIG['slow_ms']:.0f} ms (ou com erro) são registadas em `{QUERY_LOG_CONFIG['path']}`."
+    )
+
+    pool = get_pool_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Ligações (em uso/livres)", f"{pool['in_use']}/{pool['idle']}", help=f"Máximo: {pool['max_size']}")
+    with col2:
+        st.metric("Checkouts", pool["checkouts"])
+    with col3:
+        st.metric("Espera média", f"{pool['wait_avg_ms']:.1f} ms", help=f"Máx: {pool['wait_max_ms']:.1f} ms")
+    with col4:
+        st.metric("Timeouts", pool["timeouts"])
+
+    replica = get_replica_stats()
+    if replica is not None:
+        if replica["healthy"]:
+            st.caption(
+                f"🟢 Réplica de leitura: atraso {replica['lag_s'] or 0:.1f}s "
+                f"(máx. {replica['max_lag_s']:.0f}s); {replica['routed']} queries servidas, "
+                f"{replica['fallbacks']} fallbacks para o primário."
+            )
+        else:
+            st.warning(
+                f"Réplica de leitura indisponível ou atrasada (atraso: {replica['lag_s']}); "
+                f"relatórios a ler do primário. {replica['last_error'] or ''}"
+            )
+
+    df_stats = query_stats.stats.snapshot()
+    if df_stats.empty:
+        st.info("Ainda não foram executadas queries neste processo.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Execuções", int(df_stats["execucoes"].sum()))
+        with col2:
+            st.metric("Erros", int(df_stats["erros"].sum()))
+        with col3:
+            st.metric("Tempo total em BD", f"{df_stats['total_ms'].sum() / 1000:,.2f} s")
+
+        st.subheader("Por instrução (fingerprint)")
+        st.dataframe(df_stats, use_container_width=True, hide_index=True)
+
+    st.subheader("Cache de relatórios")
+    cache_stats = cache.get_cache_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Entradas", f"{cache_stats['entries']}/{cache_stats['max_entries']}")
+    with col2:
+        st.metric("Hit rate", f"{cache_stats['hit_rate_pct']:.1f}%")
+    with col3:
+        st.metric("Invalidações", cache_stats["invalidations"])
+    with col4:
+        st.metric("Evictions (LRU)", cache_stats["evictions"])
+
+    listener = cache_listener.get_listener_status()
+    if not listener["ativo"]:
+        st.caption("Invalidação entre processos (LISTEN/NOTIFY) desativada.")
+    elif listener["ligado"]:
+        st.caption(
+            f"🟢 LISTEN ativo: {listener['notificacoes']} notificações recebidas; "
+            f"TTL × {cache_stats['ttl_multiplier']:g}."
+        )
+    else:
+        st.warning(
+            f"LISTEN desligado (a religar, {listener['reconexoes']} tentativas): {listener['ultimo_erro'] or '-'}"
+        )
+
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("Limpar estatísticas"):
+            query_stats.stats.reset()
+            st.rerun()
+    with c2:
+        if st.button("Limpar cache"):
+            cache.clear()
+            st.rerun()
+
+    st.subheader("Jobs agendados")
+    df_jobs = scheduler.get_jobs_status()
+    if df_jobs.empty:
+        st.info("Sem jobs registados (o agendador ainda não correu, ou falta aplicar sql/schema.sql).")
+    else:
+        st.dataframe(df_jobs, use_container_width=True)
+        if (df_jobs["ultimo_estado"] == "erro").any():
+            st.warning("Há jobs cuja última execução falhou (ver coluna ultimo_erro).")
+
+    st.subheader("Vistas materializadas")
+    df_mv = materialized_views.get_refresh_status()
+    if df_mv.empty:
+        st.info("Sem vistas materializadas (falta aplicar sql/schema.sql?).")
+    else:
+        st.dataframe(df_mv, use_container_width=True)
+        if st.button("Atualizar todas agora"):
+            falhas = [nome for nome in materialized_views.MVIEWS if not materialized_views.refresh(nome)]
+            if falhas:
+                st.error(f"Falha no refresh de: {', '.join(falhas)}")
+            else:
+                st.rerun()
+
+    st.subheader("Partições de movimentos de stock")
+    df_part = partitions.get_particoes()
+    if df_part.empty:
+        st.info("Sem partições (falta aplicar sql/schema.sql?).")
+    else:
+        st.dataframe(df_part, use_container_width=True)
+        default = df_part[df_part["particao"] == "movimentos_stock_default"]
+        if not default.empty and int(default["linhas_estimadas"].iloc[0]) > 0:
+            st.warning("Há movimentos na partição default: o job movimentos.particoes cria as partições em falta.")
+        if st.button("Criar partições em falta agora"):
+            if partitions.criar_particoes() is None:
+                st.error(f"Falha ao criar partições: {get_database().last_error}")
+            else:
+                st.rerun()
+
 # ====================
 # SECÇÃO: INSERÇÃO DE DADOS
 # ====================
@@ -917,18 +1146,12 @@ if insert_page != "Nenhuma":
     elif insert_page == "📝 Novo Orçamento":
         st.markdown("#### 📝 Registar Novo Orçamento")
 
-        df_clientes = forms.get_lista_clientes()
-        df_produtos = forms.get_lista_produtos()
+        clientes_options = referencia("clientes").opcoes
+        produtos_options = referencia("produtos").opcoes
 
-        if df_clientes.empty or df_produtos.empty:
+        if not clientes_options or not produtos_options:
             st.warning("É necessário ter clientes e produtos registados para criar orçamentos.")
         else:
-            clientes_options = {
-                f"{row['id']} - {row['nome']}": int(row["id"]) for _, row in df_clientes.iterrows()
-            }
-            produtos_options = {
-                f"{row['id']} - {row['nome']}": int(row["id"]) for _, row in df_produtos.iterrows()
-            }
 
             with st.form("form_novo_orcamento"):
                 cliente_label = st.selectbox("Cliente", list(clientes_options.keys()))
@@ -970,14 +1193,10 @@ if insert_page != "Nenhuma":
     elif insert_page == "📦 Movimento Stock":
         st.markdown("#### 📦 Registar Movimento de Stock")
 
-        df_materiais = forms.get_lista_materiais()
-        if df_materiais.empty:
+        materiais_options = referencia("materiais").opcoes
+        if not materiais_options:
             st.warning("Não existem materiais registados na base de dados.")
         else:
-            materiais_options = {
-                f"{row['id']} - {row['nome']} ({row['unidade']})": int(row["id"])
-                for _, row in df_materiais.iterrows()
-            }
 
             with st.form("form_movimento_stock"):
                 material_label = st.selectbox("Material", list(materiais_options.keys()))
@@ -1012,13 +1231,10 @@ if insert_page != "Nenhuma":
     elif insert_page == "📧 Novo Material":
         st.markdown("#### 📧 Registar Novo Material")
 
-        df_fornecedores = forms.get_lista_fornecedores()
-        if df_fornecedores.empty:
+        fornecedores_options = referencia("fornecedores").opcoes
+        if not fornecedores_options:
             st.warning("Não existem fornecedores registados na base de dados.")
         else:
-            fornecedores_options = {
-                f"{row['id']} - {row['nome']}": int(row["id"]) for _, row in df_fornecedores.iterrows()
-            }
 
             with st.form("form_novo_material"):
                 nome = st.text_input("Nome do material")
@@ -1080,10 +1296,7 @@ if insert_page != "Nenhuma":
             # Step 1: Cliente
             if step == 1:
                 st.subheader("Step 1: Dados cliente")
-                df_clientes = forms.get_lista_clientes()
-                clientes_options = {
-                    f"{row['id']} - {row['nome']}": int(row["id"]) for _, row in df_clientes.iterrows()
-                } if not df_clientes.empty else {}
+                clientes_options = referencia("clientes").opcoes
 
                 modo = st.radio("Cliente", ["Existente", "Novo"], horizontal=True)
 
@@ -1118,11 +1331,10 @@ if insert_page != "Nenhuma":
             # Step 2: Produto
             elif step == 2:
                 st.subheader("Step 2: Especificações produto")
-                df_tipos = forms.get_lista_tipos_produto()
-                if df_tipos.empty:
+                tipos_options = referencia("tipos_produto").opcoes
+                if not tipos_options:
                     st.error("Sem tipos de produto registados")
                 else:
-                    tipos_options = {f"{r['id']} - {r['nome']}": int(r["id"]) for _, r in df_tipos.iterrows()}
                     tipo_label = st.selectbox("Tipo produto", list(tipos_options.keys()))
                     tipo_id = tipos_options[tipo_label]
                     st.session_state.wizard_tipo_produto_id = tipo_id
@@ -1259,69 +1471,79 @@ if insert_page != "Nenhuma":
                         st.experimental_rerun()
                 with c2:
                     if st.button("✅ Criar encomenda"):
-                        orc_id = forms.inserir_orcamento_returning_id(
-                            st.session_state.wizard_cliente_id,
-                            st.session_state.wizard_produto_id,
-                            st.session_state.wizard_custo_material,
-                            st.session_state.wizard_custo_mao_obra,
-                            st.session_state.wizard_outros,
-                            st.session_state.wizard_margem,
-                            st.session_state.wizard_preco,
-                            observacoes=st.session_state.wizard_obs or None,
-                        )
-                        if not orc_id:
-                            st.error("Falha ao criar orçamento")
-                        else:
-                            enc_id = forms.inserir_encomenda_returning_id(
-                                int(orc_id),
-                                st.session_state.wizard_cliente_id,
-                                st.session_state.wizard_produto_id,
-                                st.session_state.wizard_prazo,
-                                st.session_state.wizard_preco,
-                                prioridade=st.session_state.wizard_prioridade,
-                                status="pendente",
-                                metodo_pagamento=st.session_state.wizard_metodo_pagamento,
-                                observacoes=st.session_state.wizard_obs or None,
-                            )
-                            if not enc_id:
-                                st.error("Falha ao criar encomenda")
-                            else:
+                        total_min = int(round(float(st.session_state.wizard_horas) * 60.0))
+                        etapas_default = [
+                            ("Corte & Preparação", int(total_min * 0.25)),
+                            ("Soldadura", int(total_min * 0.35)),
+                            ("Acabamentos", int(total_min * 0.25)),
+                            ("Montagem", max(0, total_min - int(total_min * 0.25) - int(total_min * 0.35) - int(total_min * 0.25))),
+                        ]
+
+                        # Orçamento, encomenda, consumos planeados e etapas: uma só transação.
+                        orc_id = enc_id = None
+                        try:
+                            with get_database().transaction():
+                                orc_id = forms.inserir_orcamento_returning_id(
+                                    st.session_state.wizard_cliente_id,
+                                    st.session_state.wizard_produto_id,
+                                    st.session_state.wizard_custo_material,
+                                    st.session_state.wizard_custo_mao_obra,
+                                    st.session_state.wizard_outros,
+                                    st.session_state.wizard_margem,
+                                    st.session_state.wizard_preco,
+                                    observacoes=st.session_state.wizard_obs or None,
+                                )
+                                enc_id = forms.inserir_encomenda_returning_id(
+                                    int(orc_id),
+                                    st.session_state.wizard_cliente_id,
+                                    st.session_state.wizard_produto_id,
+                                    st.session_state.wizard_prazo,
+                                    st.session_state.wizard_preco,
+                                    prioridade=st.session_state.wizard_prioridade,
+                                    status="pendente",
+                                    metodo_pagamento=st.session_state.wizard_metodo_pagamento,
+                                    observacoes=st.session_state.wizard_obs or None,
+                                )
                                 material_tracking.initialize_planeado_for_encomenda(int(enc_id))
-
-                                total_min = int(round(float(st.session_state.wizard_horas) * 60.0))
-                                etapas_default = [
-                                    ("Corte & Preparação", int(total_min * 0.25)),
-                                    ("Soldadura", int(total_min * 0.35)),
-                                    ("Acabamentos", int(total_min * 0.25)),
-                                    ("Montagem", max(0, total_min - int(total_min * 0.25) - int(total_min * 0.35) - int(total_min * 0.25))),
-                                ]
-                                for nome_etapa, mins in etapas_default:
-                                    production.create_etapa(int(enc_id), nome_etapa, max(0, int(mins)), None)
-
-                                st.success(f"Encomenda criada (ID={enc_id})")
-
-                                if gerar_pdf:
-                                    try:
-                                        from src import pdf_generator  # lazy import
-
-                                        pdf_path = pdf_generator.generate_orcamento_pdf(int(orc_id))
-                                        with open(pdf_path, "rb") as f:
-                                            st.download_button(
-                                                "⬇️ Download Orçamento PDF",
-                                                data=f.read(),
-                                                file_name=os.path.basename(pdf_path),
-                                                mime="application/pdf",
-                                            )
-                                    except ModuleNotFoundError as e:
-                                        st.error(
-                                            f"Dependências de PDF em falta ({e}). Instala com: pip install -r requirements.txt"
+                                production.create_etapas(
+                                    int(enc_id),
+                                    [(nome_etapa, max(0, int(mins)), None) for nome_etapa, mins in etapas_default],
+                                )
+                        except Exception as e:
+                            orc_id = enc_id = None
+                            st.error(f"Falha ao criar encomenda (nada foi gravado): {e}")
+
+                        if enc_id:
+                            st.success(f"Encomenda criada (ID={enc_id})")
+
+                            if gerar_pdf:
+                                try:
+                                    from src import pdf_generator  # lazy import
+
+                                    pdf_path = pdf_generator.generate_orcamento_pdf(int(orc_id))
+                                    with open(pdf_path, "rb") as f:
+                                        st.download_button(
+                                            "⬇️ Download Orçamento PDF",
+                                            data=f.read(),
+                                            file_name=os.path.basename(pdf_path),
+                                            mime="application/pdf",
                                         )
+                                except ModuleNotFoundError as e:
+                                    st.error(
+                                        f"Dependências de PDF em falta ({e}). Instala com: pip install -r requirements.txt"
+                                    )
 
-                                st.session_state.wizard_step = 1
+                            st.session_state.wizard_step = 1
 
         except Exception as e:
             st.error(f"❌ Erro no wizard: {e}")
 
+if page_budget.exceeded:
+    budget_notice.warning(
+        f"⏱️ Resultados parciais: {len(page_budget.timed_out)} consulta(s) excederam o tempo limite "
+        f"({page_budget.seconds:.0f}s por página) e foram canceladas. Afine os filtros ou tente novamente."
+    )
+
 # Footer
 st.sidebar.markdown("---")
 st.sidebar.info("📊 Dashboard de Business Intelligence\n\nSistema de gestão para ferragens e serralharia")
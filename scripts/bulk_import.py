@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+
+
+def main() -> int:
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(repo_root)
+    sys.path.append(os.path.join(repo_root, "src"))
+
+    from bulk_import import DESTINOS, importar_ficheiro
+
+    parser = argparse.ArgumentParser(
+        description="Importação em massa (COPY) de CSV/Parquet para a BD.",
+    )
+    parser.add_argument("tabela", choices=sorted(DESTINOS))
+    parser.add_argument("ficheiros", nargs="+", help="Ficheiros CSV ou Parquet (importados por ordem)")
+    parser.add_argument("--formato", choices=["csv", "parquet"], help="Por omissão, deduzido da extensão")
+    parser.add_argument("--separador", default=",", help="Separador do CSV (ex: ';')")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Linhas por lote (Parquet)")
+    parser.add_argument(
+        "--atualizar-stock",
+        action="store_true",
+        help="(movimentos_stock) aplicar o saldo dos movimentos a materiais.stock_atual",
+    )
+    args = parser.parse_args()
+
+    total_linhas = 0
+    total_segundos = 0.0
+    for caminho in args.ficheiros:
+        try:
+            resultado = importar_ficheiro(
+                args.tabela,
+                caminho,
+                formato=args.formato,
+                separador=args.separador,
+                chunk_size=args.chunk_size,
+                atualizar_stock=args.atualizar_stock,
+            )
+        except Exception as e:
+            print(f"❌ {caminho}: {e}")
+            return 1
+
+        if not resultado.ok:
+            print(f"❌ {caminho}")
+            print(resultado.resumo())
+            return 1
+
+        print(f"✅ {caminho}")
+        print(resultado.resumo())
+        fases = ", ".join(f"{nome} {seg:.2f}s" for nome, seg in resultado.fases.items())
+        print(f"   ({fases})")
+        total_linhas += resultado.linhas_lidas
+        total_segundos += resultado.segundos
+
+    if len(args.ficheiros) > 1 and total_segundos > 0:
+        print(f"Total: {total_linhas} linhas em {total_segundos:.2f}s ({total_linhas / total_segundos:,.0f} linhas/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
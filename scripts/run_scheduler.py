@@ -0,0 +1,59 @@
+import argparse
+import os
+import sys
+
+
+def main() -> int:
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(repo_root)
+    sys.path.append(os.path.join(repo_root, "src"))
+
+    from config import SCHEDULER_CONFIG
+    from scheduler import Scheduler, default_jobs
+
+    parser = argparse.ArgumentParser(
+        description="Corre os jobs periódicos (faturas vencidas, ...) fora da app.",
+    )
+    parser.add_argument("--once", action="store_true", help="Corre os jobs devidos uma vez e termina (ex: cron)")
+    parser.add_argument("--job", action="append", help="Corre já este job (ignora o intervalo); pode repetir")
+    parser.add_argument("--poll", type=float, default=SCHEDULER_CONFIG["poll_s"], help="Segundos entre verificações")
+    args = parser.parse_args()
+
+    # Os jobs por processo (cache em memória) só fazem sentido dentro da app.
+    jobs = [j for j in default_jobs() if not j.por_processo]
+    scheduler = Scheduler(jobs, args.poll)
+
+    if args.job:
+        por_nome = {j.nome: j for j in jobs}
+        desconhecidos = [n for n in args.job if n not in por_nome]
+        if desconhecidos:
+            print(f"❌ Jobs desconhecidos: {', '.join(desconhecidos)} (disponíveis: {', '.join(por_nome)})")
+            return 1
+        if not scheduler.register():
+            print(f"❌ Não foi possível registar os jobs: {scheduler.last_error}")
+            return 1
+        falhas = 0
+        for nome in args.job:
+            erro = scheduler.run_job(por_nome[nome])
+            print(f"❌ {nome}: {erro}" if erro else f"✅ {nome}")
+            falhas += bool(erro)
+        return 1 if falhas else 0
+
+    if args.once:
+        ran = scheduler.run_pending()
+        if not scheduler.registered:
+            print(f"❌ Não foi possível registar os jobs: {scheduler.last_error}")
+            return 1
+        print(f"✅ {ran} job(s) executado(s)")
+        return 0
+
+    print(f"Agendador a correr ({', '.join(j.nome for j in jobs)}); Ctrl+C para terminar")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
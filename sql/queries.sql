@@ -39,21 +39,21 @@ ORDER BY (m.stock_minimo - m.stock_atual) * m.preco_por_unidade DESC;
 
 -- 3. CONSUMO MDIO DE MATERIAIS (ltimos 60 dias)
 -- Calcula consumo dirio para previso
+-- L o resumo dirio: num_movimentos conta movimentos de todos os tipos (antes s
+-- sadas) e deixa de haver media_por_movimento.
 SELECT 
     m.nome,
     m.tipo,
-    COUNT(ms.id) AS num_movimentos,
-    ROUND(SUM(ms.quantidade), 2) AS total_consumido,
-    ROUND(AVG(ms.quantidade), 2) AS media_por_movimento,
-    ROUND(SUM(ms.quantidade) / 60.0, 2) AS consumo_medio_diario,
+    SUM(d.num_movimentos) AS num_movimentos,
+    ROUND(SUM(d.saidas), 2) AS total_consumido,
+    ROUND(SUM(d.saidas) / 60.0, 2) AS consumo_medio_diario,
     m.stock_atual,
-    ROUND(m.stock_atual / NULLIF(SUM(ms.quantidade) / 60.0, 0), 1) AS dias_cobertura
+    ROUND(m.stock_atual / NULLIF(SUM(d.saidas) / 60.0, 0), 1) AS dias_cobertura
 FROM materiais m
-LEFT JOIN movimentos_stock ms ON m.material_id = ms.id
-WHERE ms.tipo_movimento = 'saida'
-  AND ms.data_movimento >= CURRENT_DATE - INTERVAL '60 days'
+JOIN movimentos_stock_diario d ON d.material_id = m.id
+WHERE d.dia >= CURRENT_DATE - 60
 GROUP BY m.id, m.nome, m.tipo, m.stock_atual
-HAVING SUM(ms.quantidade) > 0
+HAVING SUM(d.saidas) > 0
 ORDER BY dias_cobertura ASC;
 
 -- 4. PERFORMANCE DE ENTREGA
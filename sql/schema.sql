@@ -108,15 +108,65 @@ CREATE TABLE IF NOT EXISTS encomendas (
 );
 
 -- Tabela de Movimenta��o de Stock
+-- Particionada por mês de data_movimento (partições mensais criadas pelo job
+-- `movimentos.particoes`, ver secção 11); por isso a chave primária inclui a data.
 CREATE TABLE IF NOT EXISTS movimentos_stock (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     material_id INTEGER REFERENCES materiais(id),
     tipo_movimento VARCHAR(20) NOT NULL CHECK (tipo_movimento IN ('entrada', 'saida', 'ajuste')),
     quantidade DECIMAL(10,2) NOT NULL,
     motivo VARCHAR(100), -- 'compra', 'producao', 'correcao', 'encomenda_X'
     encomenda_id INTEGER REFERENCES encomendas(id),
-    data_movimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    usuario VARCHAR(50)
+    data_movimento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    usuario VARCHAR(50),
+    PRIMARY KEY (id, data_movimento)
+) PARTITION BY RANGE (data_movimento);
+
+-- Bases criadas antes do particionamento: converter a tabela existente (mantendo a
+-- sequência dos ids). As linhas vão para a partição default e
+-- `fn_movimentos_criar_particoes` (secção 11) passa-as para as partições mensais.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('movimentos_stock')) = 'r' THEN
+        DROP VIEW IF EXISTS vw_stock_critico;  -- recriada abaixo
+        ALTER TABLE movimentos_stock RENAME TO movimentos_stock_antiga;
+        ALTER TABLE movimentos_stock_antiga DROP CONSTRAINT IF EXISTS movimentos_stock_pkey;
+        DROP INDEX IF EXISTS idx_movimentos_material;
+        DROP INDEX IF EXISTS idx_movimentos_data;
+
+        CREATE TABLE movimentos_stock (
+            LIKE movimentos_stock_antiga INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+            FOREIGN KEY (material_id) REFERENCES materiais(id),
+            FOREIGN KEY (encomenda_id) REFERENCES encomendas(id),
+            PRIMARY KEY (id, data_movimento)
+        ) PARTITION BY RANGE (data_movimento);
+        ALTER SEQUENCE movimentos_stock_id_seq OWNED BY movimentos_stock.id;
+
+        CREATE TABLE movimentos_stock_default PARTITION OF movimentos_stock DEFAULT;
+        -- Sem data não há partição: conta como registado agora
+        INSERT INTO movimentos_stock (id, material_id, tipo_movimento, quantidade, motivo, encomenda_id, data_movimento, usuario)
+        SELECT id, material_id, tipo_movimento, quantidade, motivo, encomenda_id,
+               COALESCE(data_movimento, CURRENT_TIMESTAMP), usuario
+        FROM movimentos_stock_antiga;
+        DROP TABLE movimentos_stock_antiga;
+    END IF;
+END;
+$$;
+
+-- Movimentos de meses sem partição (a manutenção cria-as e move-os)
+CREATE TABLE IF NOT EXISTS movimentos_stock_default PARTITION OF movimentos_stock DEFAULT;
+
+-- Resumo diário dos movimentos por material, mantido pelos triggers da secção 12.
+-- Quantidades positivas, como em movimentos_stock: entradas somam ao stock, saídas e
+-- ajustes subtraem.
+CREATE TABLE IF NOT EXISTS movimentos_stock_diario (
+    material_id INTEGER NOT NULL,
+    dia DATE NOT NULL,
+    entradas DECIMAL(14,2) NOT NULL DEFAULT 0,
+    saidas DECIMAL(14,2) NOT NULL DEFAULT 0,
+    ajustes DECIMAL(14,2) NOT NULL DEFAULT 0,
+    num_movimentos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (material_id, dia)
 );
 
 -- ============================================
@@ -133,12 +183,12 @@ SELECT
     m.stock_minimo,
     m.lead_time_dias,
     f.nome AS fornecedor,
+    -- Stock / consumo médio diário dos últimos 30 dias (do resumo diário)
     ROUND(m.stock_atual / NULLIF(
-        (SELECT AVG(ABS(quantidade)) 
-         FROM movimentos_stock ms 
-         WHERE ms.material_id = m.id 
-           AND ms.tipo_movimento = 'saida'
-           AND ms.data_movimento >= CURRENT_DATE - INTERVAL '30 days'), 0
+        (SELECT SUM(d.saidas) / 30.0
+         FROM movimentos_stock_diario d
+         WHERE d.material_id = m.id
+           AND d.dia > CURRENT_DATE - 30), 0
     ), 1) AS dias_cobertura,
     CASE 
         WHEN m.stock_atual < m.stock_minimo THEN 'CR�TICO'
@@ -228,9 +278,18 @@ CREATE INDEX IF NOT EXISTS idx_materiais_tipo ON materiais(tipo);
 CREATE INDEX IF NOT EXISTS idx_orcamentos_status ON orcamentos(status);
 CREATE INDEX IF NOT EXISTS idx_orcamentos_data ON orcamentos(data_orcamento);
 CREATE INDEX IF NOT EXISTS idx_encomendas_status ON encomendas(status);
-CREATE INDEX IF NOT EXISTS idx_encomendas_data ON encomendas(data_pedido);
-CREATE INDEX IF NOT EXISTS idx_movimentos_material ON movimentos_stock(material_id);
-CREATE INDEX IF NOT EXISTS idx_movimentos_data ON movimentos_stock(data_movimento);
+-- Kanban: encomendas mais recentes de cada estado (encomendas.get_kanban)
+CREATE INDEX IF NOT EXISTS idx_encomendas_status_data ON encomendas(status, data_pedido DESC, id DESC);
+-- (data_pedido, id): paginação por chave da lista de encomendas; serve também os filtros por data
+DROP INDEX IF EXISTS idx_encomendas_data;
+CREATE INDEX IF NOT EXISTS idx_encomendas_data_id ON encomendas(data_pedido, id);
+-- (material_id, data_movimento): movimentos de um material num intervalo (stock à data)
+DROP INDEX IF EXISTS idx_movimentos_material;
+CREATE INDEX IF NOT EXISTS idx_movimentos_material_data ON movimentos_stock(material_id, data_movimento);
+-- Movimentos são inseridos por ordem de data: BRIN (poucos KB por partição) chega para
+-- os intervalos de datas, dentro das partições que o planner não elimina.
+DROP INDEX IF EXISTS idx_movimentos_data;
+CREATE INDEX IF NOT EXISTS idx_movimentos_data_brin ON movimentos_stock USING BRIN (data_movimento);
 
 -- ============================================
 -- COMENT�RIOS NAS TABELAS
@@ -243,6 +302,9 @@ COMMENT ON TABLE encomendas IS 'Encomendas confirmadas em produ��o/entrega';
 COMMENT ON COLUMN materiais.lead_time_dias IS 'Tempo de entrega do fornecedor em dias';
 COMMENT ON COLUMN orcamentos.margem_percentual IS 'Margem de lucro em percentual';
 COMMENT ON COLUMN encomendas.prazo_prometido_dias IS 'Prazo prometido ao cliente em dias';
+COMMENT ON TABLE movimentos_stock_diario IS 'Resumo diário de movimentos por material (mantido por triggers)';
+COMMENT ON COLUMN vw_stock_critico.dias_cobertura IS
+    'Stock atual / consumo médio diário (saídas dos últimos 30 dias, do resumo diário).';
 
 -- ============================================
 -- EXPANSÃO 2026: Produção, Consumos, Faturação, Encomendas (Wizard/Detalhe)
@@ -548,6 +610,8 @@ CREATE TABLE IF NOT EXISTS faturas (
 CREATE INDEX IF NOT EXISTS idx_faturas_cliente ON faturas(cliente_id);
 CREATE INDEX IF NOT EXISTS idx_faturas_status ON faturas(status);
 CREATE INDEX IF NOT EXISTS idx_faturas_vencimento ON faturas(vencimento);
+-- paginação por chave da lista de faturas (invoicing.pagina_faturas)
+CREATE INDEX IF NOT EXISTS idx_faturas_emissao_id ON faturas(data_emissao, id);
 
 CREATE TABLE IF NOT EXISTS itens_fatura (
     id SERIAL PRIMARY KEY,
@@ -774,3 +838,707 @@ CREATE TRIGGER tr_encomendas_log_status
 AFTER UPDATE ON encomendas
 FOR EACH ROW
 EXECUTE FUNCTION trg_encomendas_log_status();
+
+-- --------------------------------------------
+-- 6) INVALIDAÇÃO DE CACHE ENTRE PROCESSOS (LISTEN/NOTIFY)
+-- --------------------------------------------
+
+-- Cada instrução que altere linhas de uma tabela principal notifica o canal
+-- 'firma_cache' com o nome da tabela; os processos da app (src/cache_listener.py)
+-- invalidam os relatórios em cache que dependem dela. Notificações iguais na mesma
+-- transação são agrupadas pelo PostgreSQL e só são entregues após o commit. Um trigger
+-- por operação, com as linhas em tabelas de transição: instruções que não alteraram
+-- nenhuma linha (ex: UPDATE periódico sem correspondências) não notificam.
+CREATE OR REPLACE FUNCTION fn_notify_cache()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NOT EXISTS (SELECT 1 FROM novos) THEN
+            RETURN NULL;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM antigos) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    PERFORM pg_notify('firma_cache', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cria os triggers por instrução `tr_<tabela>_<nome>_{insert,update,delete,truncate}`
+-- de p_funcao em p_tabela (novos/antigos como tabelas de transição; o TRUNCATE não as tem).
+CREATE OR REPLACE FUNCTION fn_criar_triggers_instrucao(p_tabela TEXT, p_nome TEXT, p_funcao TEXT)
+RETURNS VOID AS $$
+DECLARE
+    op TEXT;
+    trigger_nome TEXT;
+BEGIN
+    -- Trigger único da versão anterior (todas as operações, sem tabelas de transição)
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', 'tr_' || p_tabela || '_' || p_nome, p_tabela);
+    FOREACH op IN ARRAY ARRAY['insert', 'update', 'delete', 'truncate']
+    LOOP
+        trigger_nome := 'tr_' || p_tabela || '_' || p_nome || '_' || op;
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', trigger_nome, p_tabela);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER %s ON %I %s FOR EACH STATEMENT EXECUTE FUNCTION %I()',
+            trigger_nome,
+            upper(op),
+            p_tabela,
+            CASE op
+                WHEN 'insert' THEN 'REFERENCING NEW TABLE AS novos'
+                WHEN 'update' THEN 'REFERENCING NEW TABLE AS novos'
+                WHEN 'delete' THEN 'REFERENCING OLD TABLE AS antigos'
+                ELSE ''
+            END,
+            p_funcao
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'materiais', 'movimentos_stock', 'orcamentos', 'encomendas', 'faturas',
+        'pagamentos', 'consumo_materiais', 'etapas_producao',
+        'clientes', 'produtos', 'tipos_produto', 'fornecedores'
+    ]
+    LOOP
+        PERFORM fn_criar_triggers_instrucao(t, 'notify_cache', 'fn_notify_cache');
+    END LOOP;
+END;
+$$;
+
+-- --------------------------------------------
+-- 7) JOBS AGENDADOS (src/scheduler.py)
+-- --------------------------------------------
+
+-- Uma linha por job: intervalo, próxima execução (usada para um só processo reclamar
+-- cada execução) e resultado da última.
+CREATE TABLE IF NOT EXISTS jobs_agendados (
+    nome VARCHAR(80) PRIMARY KEY,
+    intervalo_s INTEGER NOT NULL CHECK (intervalo_s > 0),
+    por_processo BOOLEAN NOT NULL DEFAULT FALSE,
+    proxima_execucao TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultima_execucao TIMESTAMP,
+    ultimo_fim TIMESTAMP,
+    ultimo_estado VARCHAR(10) CHECK (ultimo_estado IN ('ok', 'erro')),
+    ultimo_erro TEXT,
+    duracao_ms NUMERIC(12,1),
+    execucoes INTEGER NOT NULL DEFAULT 0
+);
+
+-- --------------------------------------------
+-- 8) VISTAS MATERIALIZADAS DE ANÁLISE (src/materialized_views.py)
+-- --------------------------------------------
+
+-- Cópias materializadas das vistas de agregação lidas pelo dashboard. Cada uma tem um
+-- índice único (necessário para REFRESH ... CONCURRENTLY, que não bloqueia leituras).
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_desperdicio_mensal AS SELECT * FROM vw_desperdicio_mensal;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_desperdicio_mensal ON mv_desperdicio_mensal(mes, tipo, material);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_eficiencia_material AS SELECT * FROM vw_eficiencia_material;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_eficiencia_material ON mv_eficiencia_material(material_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_aging_report AS SELECT * FROM vw_aging_report;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_aging_report ON mv_aging_report(fatura_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_receita_faturada_vs_recebida AS SELECT * FROM vw_receita_faturada_vs_recebida;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_receita_faturada_vs_recebida ON mv_receita_faturada_vs_recebida(mes);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_cash_flow AS SELECT * FROM vw_cash_flow;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_cash_flow ON mv_cash_flow(mes);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_tempo_medio_real_vs_estimado AS SELECT * FROM tempo_medio_real_vs_estimado;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_tempo_medio_real_vs_estimado ON mv_tempo_medio_real_vs_estimado(tipo_etapa);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_produtividade_operario AS SELECT * FROM produtividade_operario;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_mv_produtividade_operario ON mv_produtividade_operario(responsavel);
+
+-- Política de refresh por vista:
+--   'alteracao': refresh quando `suja` (marcada pelos triggers abaixo), no máximo a cada intervalo_s;
+--                 também uma vez por dia, porque algumas vistas dependem de CURRENT_DATE
+--   'agendado':   refresh a cada intervalo_s
+CREATE TABLE IF NOT EXISTS mv_refresh_policy (
+    mv_nome VARCHAR(80) PRIMARY KEY,
+    modo VARCHAR(12) NOT NULL CHECK (modo IN ('alteracao', 'agendado')),
+    intervalo_s INTEGER NOT NULL CHECK (intervalo_s > 0),
+    tabelas TEXT[] NOT NULL,
+    suja BOOLEAN NOT NULL DEFAULT TRUE,
+    atualizada_em TIMESTAMP,
+    duracao_ms NUMERIC(12,1),
+    ultimo_erro TEXT
+);
+
+INSERT INTO mv_refresh_policy (mv_nome, modo, intervalo_s, tabelas) VALUES
+    ('mv_desperdicio_mensal', 'alteracao', 300, ARRAY['consumo_materiais', 'materiais']),
+    ('mv_eficiencia_material', 'alteracao', 300, ARRAY['consumo_materiais', 'materiais']),
+    ('mv_aging_report', 'alteracao', 60, ARRAY['faturas', 'clientes']),
+    ('mv_receita_faturada_vs_recebida', 'alteracao', 120, ARRAY['faturas']),
+    ('mv_cash_flow', 'alteracao', 120, ARRAY['pagamentos']),
+    ('mv_tempo_medio_real_vs_estimado', 'agendado', 900, ARRAY['etapas_producao']),
+    ('mv_produtividade_operario', 'agendado', 900, ARRAY['etapas_producao'])
+ON CONFLICT (mv_nome) DO NOTHING;
+
+-- Alterações às tabelas das vistas 'alteracao' ainda por refletir em `suja`. Só se
+-- insere (nunca se atualiza) a partir dos triggers, pelo que escritores concorrentes não
+-- esperam uns pelos outros; o job `mv.refresh` passa-as para `suja` e apaga-as
+-- (`fn_mv_aplicar_alteracoes`). Linhas de transações por confirmar ficam para a vez seguinte.
+CREATE TABLE IF NOT EXISTS mv_alteracoes (
+    tabela TEXT NOT NULL,
+    alterada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Regista a alteração de uma tabela de que dependem vistas (uma vez por instrução que
+-- altere linhas; nada se todas essas vistas já estiverem sujas).
+CREATE OR REPLACE FUNCTION fn_mv_marcar_suja()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NOT EXISTS (SELECT 1 FROM novos) THEN
+            RETURN NULL;
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM antigos) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    IF EXISTS (SELECT 1 FROM mv_refresh_policy WHERE NOT suja AND TG_TABLE_NAME = ANY(tabelas)) THEN
+        INSERT INTO mv_alteracoes (tabela) VALUES (TG_TABLE_NAME);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Passa as alterações registadas para `suja` (job `mv.refresh`, antes de escolher as
+-- vistas a atualizar). Devolve quantas vistas marcou.
+CREATE OR REPLACE FUNCTION fn_mv_aplicar_alteracoes()
+RETURNS INTEGER AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    WITH apagadas AS (
+        DELETE FROM mv_alteracoes RETURNING tabela
+    )
+    UPDATE mv_refresh_policy
+    SET suja = TRUE
+    WHERE NOT suja
+      AND tabelas && ARRAY(SELECT DISTINCT tabela FROM apagadas);
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'consumo_materiais', 'materiais', 'faturas', 'clientes', 'pagamentos', 'etapas_producao'
+    ]
+    LOOP
+        PERFORM fn_criar_triggers_instrucao(t, 'mv_suja', 'fn_mv_marcar_suja');
+    END LOOP;
+END;
+$$;
+
+-- --------------------------------------------
+-- 9) KPIs DO DASHBOARD (src/kpi.py)
+-- --------------------------------------------
+
+-- Um registo por dia com os KPIs da página inicial; o do dia é atualizado pelo job
+-- `kpi.snapshot` e os anteriores ficam como histórico (tendências).
+CREATE TABLE IF NOT EXISTS kpi_snapshot (
+    dia DATE PRIMARY KEY,
+    receita_total NUMERIC(14,2) NOT NULL DEFAULT 0,     -- orçamentos aprovados, últimos 6 meses
+    margem_media_pct NUMERIC(7,2),                      -- média das margens médias por produto
+    materiais_criticos INTEGER NOT NULL DEFAULT 0,
+    entregas_pendentes INTEGER NOT NULL DEFAULT 0,
+    saldo_receber NUMERIC(14,2) NOT NULL DEFAULT 0,     -- faturas em aberto
+    atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION fn_kpi_snapshot_atualizar()
+RETURNS DATE AS $$
+BEGIN
+    INSERT INTO kpi_snapshot (
+        dia, receita_total, margem_media_pct, materiais_criticos, entregas_pendentes, saldo_receber, atualizado_em
+    )
+    SELECT
+        CURRENT_DATE,
+        COALESCE(r.receita_total, 0),
+        r.margem_media_pct,
+        (SELECT COUNT(*) FROM materiais m WHERE m.stock_atual < m.stock_minimo),
+        (SELECT COUNT(*)
+         FROM encomendas e
+         JOIN orcamentos o ON e.orcamento_id = o.id
+         WHERE e.status IN ('pendente', 'em_producao')),
+        (SELECT COALESCE(SUM(f.saldo), 0)
+         FROM faturas f
+         WHERE f.status IN ('emitida', 'parcial', 'vencida') AND f.saldo > 0),
+        CURRENT_TIMESTAMP
+    FROM (
+        -- Mesmas regras de pricing.get_rentabilidade_produtos (6 meses)
+        SELECT
+            SUM(receita) AS receita_total,
+            ROUND(AVG(margem_pct), 2) AS margem_media_pct
+        FROM (
+            SELECT
+                SUM(CASE WHEN o.status = 'aprovado' THEN o.preco_venda ELSE 0 END) AS receita,
+                AVG(o.margem_percentual) AS margem_pct
+            FROM orcamentos o
+            JOIN produtos p ON o.produto_id = p.id
+            JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
+            WHERE o.data_orcamento >= CURRENT_DATE - INTERVAL '6 months'
+            GROUP BY tp.nome
+        ) por_produto
+    ) r
+    ON CONFLICT (dia) DO UPDATE SET
+        receita_total = EXCLUDED.receita_total,
+        margem_media_pct = EXCLUDED.margem_media_pct,
+        materiais_criticos = EXCLUDED.materiais_criticos,
+        entregas_pendentes = EXCLUDED.entregas_pendentes,
+        saldo_receber = EXCLUDED.saldo_receber,
+        atualizado_em = EXCLUDED.atualizado_em;
+
+    PERFORM pg_notify('firma_cache', 'kpi_snapshot');
+    RETURN CURRENT_DATE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- --------------------------------------------
+-- 10) CIDADE / CÓDIGO POSTAL DOS CLIENTES
+-- --------------------------------------------
+
+-- Extraídos da morada na escrita (colunas geradas; o ADD COLUMN preenche os clientes
+-- existentes). Cidade = último segmento da morada (separado por vírgula/linha), sem o
+-- código postal inicial e com espaços normalizados (ex: '..., 4800-000  Guimarães' ->
+-- 'Guimarães'); NULL se não houver.
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS cidade TEXT GENERATED ALWAYS AS (
+    NULLIF(
+        btrim(regexp_replace(
+            regexp_replace(regexp_replace(COALESCE(morada, ''), '^.*[,\n]', ''), '^\s*[0-9]{4}-[0-9]{3}', ''),
+            '\s+', ' ', 'g'
+        )),
+        ''
+    )
+) STORED;
+
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS codigo_postal TEXT GENERATED ALWAYS AS (
+    substring(morada FROM '[0-9]{4}-[0-9]{3}')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_clientes_cidade ON clientes(cidade);
+CREATE INDEX IF NOT EXISTS idx_clientes_codigo_postal ON clientes(codigo_postal);
+
+-- --------------------------------------------
+-- 11) PARTIÇÕES MENSAIS DE movimentos_stock (src/partitions.py)
+-- --------------------------------------------
+
+-- Partições `movimentos_stock_pAAAAMM`, uma por mês. O job `movimentos.particoes` cria
+-- as dos próximos meses antes de serem precisas (a default fica vazia) e, se houver
+-- retenção configurada, arquiva as antigas.
+
+-- Cria a partição do mês de p_mes (idempotente). Linhas desse mês que estejam na
+-- partição default passam para a nova antes de a ligar à tabela.
+CREATE OR REPLACE FUNCTION fn_movimentos_criar_particao(p_mes DATE)
+RETURNS TEXT AS $$
+DECLARE
+    inicio DATE := date_trunc('month', p_mes)::date;
+    fim DATE := (date_trunc('month', p_mes) + INTERVAL '1 month')::date;
+    nome TEXT := 'movimentos_stock_p' || to_char(p_mes, 'YYYYMM');
+BEGIN
+    IF to_regclass(nome) IS NOT NULL THEN
+        RETURN nome;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE movimentos_stock INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nome);
+    EXECUTE format(
+        'WITH mov AS ('
+        '  DELETE FROM movimentos_stock_default WHERE data_movimento >= %L AND data_movimento < %L RETURNING *'
+        ') INSERT INTO %I SELECT * FROM mov',
+        inicio, fim, nome
+    );
+    EXECUTE format(
+        'ALTER TABLE movimentos_stock ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        nome, inicio, fim
+    );
+    RETURN nome;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Cria as partições em falta: meses com linhas na default, mês atual e os
+-- p_meses_a_frente seguintes. Devolve quantas criou.
+CREATE OR REPLACE FUNCTION fn_movimentos_criar_particoes(p_meses_a_frente INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    mes DATE;
+    criadas INTEGER := 0;
+BEGIN
+    FOR mes IN
+        SELECT DISTINCT date_trunc('month', data_movimento)::date FROM movimentos_stock_default
+        UNION
+        SELECT (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date
+        FROM generate_series(0, p_meses_a_frente) AS i
+        ORDER BY 1
+    LOOP
+        IF to_regclass('movimentos_stock_p' || to_char(mes, 'YYYYMM')) IS NULL THEN
+            PERFORM fn_movimentos_criar_particao(mes);
+            criadas := criadas + 1;
+        END IF;
+    END LOOP;
+    RETURN criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE SCHEMA IF NOT EXISTS arquivo;
+
+-- Desliga as partições de meses anteriores a p_antes_de e move-as para o schema
+-- `arquivo` (continuam consultáveis, ex: arquivo.movimentos_stock_p202401, mas saem
+-- dos relatórios, do vacuum e dos backups da tabela). Devolve as partições arquivadas.
+CREATE OR REPLACE FUNCTION fn_movimentos_arquivar(p_antes_de DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    p TEXT;
+BEGIN
+    FOR p IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'movimentos_stock'::regclass
+          AND c.relname ~ '^movimentos_stock_p[0-9]{6}$'
+          AND to_date(substr(c.relname, 19), 'YYYYMM') + INTERVAL '1 month' <= p_antes_de
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE movimentos_stock DETACH PARTITION %I', p);
+        EXECUTE format('ALTER TABLE %I SET SCHEMA arquivo', p);
+        RETURN NEXT p;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT fn_movimentos_criar_particoes();
+
+-- --------------------------------------------
+-- 12) RESUMO DIÁRIO DE MOVIMENTOS (movimentos_stock_diario)
+-- --------------------------------------------
+
+-- Triggers por instrução (com as linhas da instrução em tabelas de transição): cada
+-- INSERT/UPDATE/DELETE em movimentos_stock soma ou subtrai os seus movimentos ao
+-- resumo com um único upsert, também nas importações em lote. A passagem de linhas da
+-- partição default para uma partição mensal escreve diretamente nas partições e não
+-- dispara estes triggers (o total não muda); desligar/arquivar partições também não,
+-- pelo que o resumo mantém o histórico arquivado.
+CREATE OR REPLACE FUNCTION fn_movimentos_diario_aplicar()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO movimentos_stock_diario AS d (material_id, dia, entradas, saidas, ajustes, num_movimentos)
+        SELECT
+            material_id,
+            data_movimento::date,
+            -COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'entrada'), 0),
+            -COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'saida'), 0),
+            -COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'ajuste'), 0),
+            -COUNT(*)
+        FROM antigos
+        WHERE material_id IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (material_id, dia) DO UPDATE SET
+            entradas = d.entradas + EXCLUDED.entradas,
+            saidas = d.saidas + EXCLUDED.saidas,
+            ajustes = d.ajustes + EXCLUDED.ajustes,
+            num_movimentos = d.num_movimentos + EXCLUDED.num_movimentos;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO movimentos_stock_diario AS d (material_id, dia, entradas, saidas, ajustes, num_movimentos)
+        SELECT
+            material_id,
+            data_movimento::date,
+            COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'entrada'), 0),
+            COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'saida'), 0),
+            COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'ajuste'), 0),
+            COUNT(*)
+        FROM novos
+        WHERE material_id IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (material_id, dia) DO UPDATE SET
+            entradas = d.entradas + EXCLUDED.entradas,
+            saidas = d.saidas + EXCLUDED.saidas,
+            ajustes = d.ajustes + EXCLUDED.ajustes,
+            num_movimentos = d.num_movimentos + EXCLUDED.num_movimentos;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_movimentos_diario_insert ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_diario_insert
+AFTER INSERT ON movimentos_stock
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_movimentos_diario_aplicar();
+
+DROP TRIGGER IF EXISTS tr_movimentos_diario_update ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_diario_update
+AFTER UPDATE ON movimentos_stock
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_movimentos_diario_aplicar();
+
+DROP TRIGGER IF EXISTS tr_movimentos_diario_delete ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_diario_delete
+AFTER DELETE ON movimentos_stock
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_movimentos_diario_aplicar();
+
+-- Reconstrói o resumo a partir dos movimentos (preenchimento inicial, ou depois de um
+-- TRUNCATE, que os triggers não cobrem). Devolve o número de linhas do resumo.
+CREATE OR REPLACE FUNCTION fn_movimentos_diario_reconstruir()
+RETURNS INTEGER AS $$
+DECLARE
+    linhas INTEGER;
+BEGIN
+    LOCK TABLE movimentos_stock IN SHARE MODE;
+    DELETE FROM movimentos_stock_diario;
+    INSERT INTO movimentos_stock_diario (material_id, dia, entradas, saidas, ajustes, num_movimentos)
+    SELECT
+        material_id,
+        data_movimento::date,
+        COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'entrada'), 0),
+        COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'saida'), 0),
+        COALESCE(SUM(quantidade) FILTER (WHERE tipo_movimento = 'ajuste'), 0),
+        COUNT(*)
+    FROM movimentos_stock
+    WHERE material_id IS NOT NULL
+    GROUP BY 1, 2;
+    GET DIAGNOSTICS linhas = ROW_COUNT;
+    RETURN linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bases existentes: preencher o resumo na primeira aplicação
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM movimentos_stock_diario)
+       AND EXISTS (SELECT 1 FROM movimentos_stock) THEN
+        PERFORM fn_movimentos_diario_reconstruir();
+    END IF;
+END;
+$$;
+
+-- --------------------------------------------
+-- 13) STOCK À DATA (snapshots + movimentos)
+-- --------------------------------------------
+
+-- Stock de cada material no início de um dia (`tirado_em`, sempre à meia-noite),
+-- contando os movimentos com data anterior. O job `stock.snapshot` regista um por dia a
+-- partir do snapshot anterior e do resumo diário (não de `stock_atual`); o histórico
+-- anterior é reconstruído (um por mês) na primeira aplicação. Os movimentos com data
+-- anterior a snapshots já tirados (importações, datas passadas) corrigem esses
+-- snapshots no mesmo commit (`fn_stock_snapshots_corrigir`).
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    material_id INTEGER NOT NULL REFERENCES materiais(id) ON DELETE CASCADE,
+    tirado_em TIMESTAMP NOT NULL CHECK (tirado_em = date_trunc('day', tirado_em)),
+    stock DECIMAL(14,2) NOT NULL,
+    PRIMARY KEY (material_id, tirado_em)
+);
+
+-- Stock de todos os materiais em p_em (movimentos com data anterior a p_em). Parte do
+-- snapshot mais próximo antes de p_em e soma os movimentos seguintes; sem snapshot
+-- anterior, parte do seguinte (ou do stock atual) e desconta os movimentos para trás.
+-- Os dias inteiros vêm do resumo diário (que guarda também as partições arquivadas);
+-- só as frações de dia nos extremos leem `movimentos_stock`.
+CREATE OR REPLACE FUNCTION fn_stock_em(p_em TIMESTAMP)
+RETURNS TABLE (material_id INTEGER, stock NUMERIC) AS $$
+    WITH base AS (
+        SELECT
+            m.id AS material_id,
+            COALESCE(ant.tirado_em, seg.tirado_em, LOCALTIMESTAMP) AS base_em,
+            COALESCE(ant.stock, seg.stock, m.stock_atual) AS base_stock
+        FROM materiais m
+        LEFT JOIN LATERAL (
+            SELECT s.tirado_em, s.stock
+            FROM stock_snapshots s
+            WHERE s.material_id = m.id AND s.tirado_em <= p_em
+            ORDER BY s.tirado_em DESC
+            LIMIT 1
+        ) ant ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT s.tirado_em, s.stock
+            FROM stock_snapshots s
+            WHERE s.material_id = m.id AND s.tirado_em > p_em
+            ORDER BY s.tirado_em
+            LIMIT 1
+        ) seg ON ant.tirado_em IS NULL
+    ),
+    -- Intervalo [de, ate) a repor; [dia_de, dia_ate) são os dias inteiros dentro dele
+    intervalo AS (
+        SELECT
+            b.*,
+            LEAST(b.base_em, p_em) AS de,
+            GREATEST(b.base_em, p_em) AS ate,
+            date_trunc('day', LEAST(b.base_em, p_em) + INTERVAL '1 day' - INTERVAL '1 microsecond') AS dia_de,
+            date_trunc('day', GREATEST(b.base_em, p_em)) AS dia_ate
+        FROM base b
+    )
+    SELECT
+        i.material_id,
+        i.base_stock + CASE WHEN i.base_em <= p_em THEN 1 ELSE -1 END * (
+            COALESCE((
+                SELECT SUM(d.entradas - d.saidas - d.ajustes)
+                FROM movimentos_stock_diario d
+                WHERE d.material_id = i.material_id
+                  AND d.dia >= i.dia_de::date
+                  AND d.dia < i.dia_ate::date
+            ), 0)
+            + COALESCE((
+                SELECT SUM(CASE WHEN ms.tipo_movimento = 'entrada' THEN ms.quantidade ELSE -ms.quantidade END)
+                FROM movimentos_stock ms
+                WHERE ms.material_id = i.material_id
+                  AND (
+                      (ms.data_movimento >= i.de AND ms.data_movimento < LEAST(i.dia_de, i.ate))
+                      OR (ms.data_movimento >= GREATEST(i.dia_ate, i.de) AND ms.data_movimento < i.ate)
+                  )
+            ), 0)
+        )
+    FROM intervalo i;
+$$ LANGUAGE sql STABLE;
+
+-- Snapshot do início do dia de hoje: stock do snapshot anterior mais os movimentos do
+-- resumo diário desde então (`fn_stock_em`). O lock espera pelas transações com
+-- movimentos em curso e trava novas até ao commit, para que nenhum movimento com data
+-- anterior a hoje fique de fora do snapshot e da correção pelo trigger.
+CREATE OR REPLACE FUNCTION fn_stock_snapshot()
+RETURNS INTEGER AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    LOCK TABLE movimentos_stock IN SHARE MODE;
+    INSERT INTO stock_snapshots (material_id, tirado_em, stock)
+    SELECT material_id, CURRENT_DATE::timestamp, stock
+    FROM fn_stock_em(CURRENT_DATE::timestamp)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Snapshots no início de cada mês desde o primeiro movimento, calculados para trás a
+-- partir do stock atual com o resumo diário (assume que o stock só mudou por movimentos).
+CREATE OR REPLACE FUNCTION fn_stock_snapshots_historico()
+RETURNS INTEGER AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    INSERT INTO stock_snapshots (material_id, tirado_em, stock)
+    SELECT
+        m.id,
+        meses.inicio,
+        m.stock_atual - COALESCE((
+            SELECT SUM(d.entradas - d.saidas - d.ajustes)
+            FROM movimentos_stock_diario d
+            WHERE d.material_id = m.id AND d.dia >= meses.inicio::date
+        ), 0)
+    FROM materiais m
+    CROSS JOIN generate_series(
+        (SELECT date_trunc('month', MIN(dia)) FROM movimentos_stock_diario),
+        date_trunc('month', CURRENT_DATE),
+        INTERVAL '1 month'
+    ) AS meses(inicio)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Apaga e volta a calcular todos os snapshots (ex: depois de um TRUNCATE de
+-- movimentos_stock, que o trigger não cobre). Devolve o número de snapshots.
+CREATE OR REPLACE FUNCTION fn_stock_snapshots_reconstruir()
+RETURNS INTEGER AS $$
+DECLARE
+    n INTEGER;
+BEGIN
+    LOCK TABLE movimentos_stock IN SHARE MODE;
+    DELETE FROM stock_snapshots;
+    n := fn_stock_snapshots_historico();
+    RETURN n + fn_stock_snapshot();
+END;
+$$ LANGUAGE plpgsql;
+
+-- Movimentos inseridos, alterados ou apagados com data anterior a snapshots já tirados
+-- (importações com datas passadas, correções): soma ou subtrai a quantidade a esses
+-- snapshots, na mesma transação. Os movimentos do dia não tocam em nenhum snapshot.
+CREATE OR REPLACE FUNCTION fn_stock_snapshots_corrigir()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE stock_snapshots s
+        SET stock = s.stock - c.delta
+        FROM (
+            SELECT sn.material_id, sn.tirado_em,
+                   SUM(CASE WHEN a.tipo_movimento = 'entrada' THEN a.quantidade ELSE -a.quantidade END) AS delta
+            FROM antigos a
+            JOIN stock_snapshots sn ON sn.material_id = a.material_id AND sn.tirado_em > a.data_movimento
+            GROUP BY 1, 2
+        ) c
+        WHERE s.material_id = c.material_id AND s.tirado_em = c.tirado_em;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE stock_snapshots s
+        SET stock = s.stock + c.delta
+        FROM (
+            SELECT sn.material_id, sn.tirado_em,
+                   SUM(CASE WHEN n.tipo_movimento = 'entrada' THEN n.quantidade ELSE -n.quantidade END) AS delta
+            FROM novos n
+            JOIN stock_snapshots sn ON sn.material_id = n.material_id AND sn.tirado_em > n.data_movimento
+            GROUP BY 1, 2
+        ) c
+        WHERE s.material_id = c.material_id AND s.tirado_em = c.tirado_em;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_movimentos_snapshots_insert ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_snapshots_insert
+AFTER INSERT ON movimentos_stock
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_corrigir();
+
+DROP TRIGGER IF EXISTS tr_movimentos_snapshots_update ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_snapshots_update
+AFTER UPDATE ON movimentos_stock
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_corrigir();
+
+DROP TRIGGER IF EXISTS tr_movimentos_snapshots_delete ON movimentos_stock;
+CREATE TRIGGER tr_movimentos_snapshots_delete
+AFTER DELETE ON movimentos_stock
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT EXECUTE FUNCTION fn_stock_snapshots_corrigir();
+
+-- Bases existentes: reconstruir o histórico na primeira aplicação, e também se ainda
+-- houver snapshots da versão anterior (tirados a meio do dia a partir de stock_atual,
+-- sem correção dos movimentos com data passada)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM stock_snapshots)
+       OR EXISTS (SELECT 1 FROM stock_snapshots WHERE tirado_em <> date_trunc('day', tirado_em)) THEN
+        PERFORM fn_stock_snapshots_reconstruir();
+    END IF;
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'stock_snapshots'::regclass AND conname = 'stock_snapshots_tirado_em_check'
+    ) THEN
+        ALTER TABLE stock_snapshots
+            ADD CONSTRAINT stock_snapshots_tirado_em_check CHECK (tirado_em = date_trunc('day', tirado_em));
+    END IF;
+END;
+$$;
@@ -0,0 +1,406 @@
+"""Importação em massa (CSV/Parquet) via `COPY FROM STDIN`.
+
+Fluxo por ficheiro, numa única transação:
+
+1. `COPY` do ficheiro para uma tabela temporária de staging (todas as colunas TEXT);
+2. validações em SQL sobre o staging (obrigatórios, tipos, domínios, chaves estrangeiras);
+3. `INSERT ... SELECT` para a tabela real.
+
+Se alguma validação falhar, nada é escrito e o resultado traz as linhas problemáticas.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import cache
+from database import get_database
+
+
+@dataclass(frozen=True)
+class _Coluna:
+    nome: str
+    tipo: str  # tipo PostgreSQL de destino
+    obrigatoria: bool = False
+    # Expressão SQL usada quando o valor vem vazio (ex: coluna NOT NULL com DEFAULT)
+    omissao: str = ""
+
+
+@dataclass(frozen=True)
+class _Destino:
+    tabela: str
+    colunas: tuple[_Coluna, ...]
+    # (mensagem, condição SQL sobre o staging `s` que identifica linhas inválidas)
+    validacoes: tuple[tuple[str, str], ...] = ()
+    on_conflict: str = ""
+
+
+_TIPOS_INTEIROS = {"integer", "bigint"}
+_TIPOS_DECIMAIS = {"numeric"}
+_TIPOS_DATA = {"timestamp", "date"}
+
+# Função temporária (só desta sessão) para validar datas sem abortar a transação
+_FN_DATA_VALIDA = """
+CREATE OR REPLACE FUNCTION pg_temp.data_valida(valor TEXT, tipo TEXT) RETURNS BOOLEAN AS $$
+BEGIN
+    IF NULLIF(btrim(valor), '') IS NULL THEN
+        RETURN TRUE;
+    END IF;
+    IF tipo = 'date' THEN
+        PERFORM btrim(valor)::date;
+    ELSE
+        PERFORM btrim(valor)::timestamp;
+    END IF;
+    RETURN TRUE;
+EXCEPTION WHEN others THEN
+    RETURN FALSE;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+DESTINOS: dict[str, _Destino] = {
+    "clientes": _Destino(
+        tabela="clientes",
+        colunas=(
+            _Coluna("id", "integer"),
+            _Coluna("nome", "text", obrigatoria=True),
+            _Coluna("tipo", "text"),
+            _Coluna("nif", "text"),
+            _Coluna("contacto", "text"),
+            _Coluna("email", "text"),
+            _Coluna("morada", "text"),
+        ),
+        validacoes=(
+            ("tipo inválido (particular/empresa)", "NULLIF(btrim(s.tipo), '') NOT IN ('particular', 'empresa')"),
+        ),
+    ),
+    "materiais": _Destino(
+        tabela="materiais",
+        colunas=(
+            _Coluna("id", "integer"),
+            _Coluna("nome", "text", obrigatoria=True),
+            _Coluna("tipo", "text", obrigatoria=True),
+            _Coluna("unidade", "text", obrigatoria=True),
+            _Coluna("preco_por_unidade", "numeric", obrigatoria=True),
+            _Coluna("fornecedor_id", "integer"),
+            _Coluna("lead_time_dias", "integer", obrigatoria=True),
+            _Coluna("stock_atual", "numeric"),
+            _Coluna("stock_minimo", "numeric", obrigatoria=True),
+            _Coluna("stock_maximo", "numeric"),
+        ),
+        validacoes=(
+            (
+                "fornecedor_id inexistente",
+                "NULLIF(btrim(s.fornecedor_id), '') IS NOT NULL AND NOT EXISTS "
+                "(SELECT 1 FROM fornecedores f WHERE f.id = btrim(s.fornecedor_id)::integer)",
+            ),
+        ),
+    ),
+    "produtos": _Destino(
+        tabela="produtos",
+        colunas=(
+            _Coluna("id", "integer"),
+            _Coluna("tipo_produto_id", "integer", obrigatoria=True),
+            _Coluna("codigo", "text"),
+            _Coluna("descricao", "text"),
+            _Coluna("largura_metros", "numeric"),
+            _Coluna("altura_metros", "numeric"),
+            _Coluna("horas_mao_obra", "numeric", obrigatoria=True),
+            _Coluna("complexidade", "text"),
+        ),
+        validacoes=(
+            (
+                "tipo_produto_id inexistente",
+                "NOT EXISTS (SELECT 1 FROM tipos_produto tp WHERE tp.id = btrim(s.tipo_produto_id)::integer)",
+            ),
+            ("complexidade inválida (baixa/media/alta)", "NULLIF(btrim(s.complexidade), '') NOT IN ('baixa', 'media', 'alta')"),
+            (
+                "codigo repetido no ficheiro",
+                "NULLIF(btrim(s.codigo), '') IS NOT NULL AND EXISTS "
+                "(SELECT 1 FROM {staging} s2 WHERE btrim(s2.codigo) = btrim(s.codigo) AND s2._linha < s._linha)",
+            ),
+        ),
+        # Produtos já existentes (mesmo código) são ignorados.
+        on_conflict="ON CONFLICT (codigo) DO NOTHING",
+    ),
+    "movimentos_stock": _Destino(
+        tabela="movimentos_stock",
+        colunas=(
+            _Coluna("material_id", "integer", obrigatoria=True),
+            _Coluna("tipo_movimento", "text", obrigatoria=True),
+            _Coluna("quantidade", "numeric", obrigatoria=True),
+            _Coluna("motivo", "text"),
+            _Coluna("encomenda_id", "integer"),
+            _Coluna("data_movimento", "timestamp", omissao="CURRENT_TIMESTAMP"),
+            _Coluna("usuario", "text"),
+        ),
+        validacoes=(
+            ("tipo_movimento inválido (entrada/saida/ajuste)", "btrim(s.tipo_movimento) NOT IN ('entrada', 'saida', 'ajuste')"),
+            (
+                "material_id inexistente",
+                "NOT EXISTS (SELECT 1 FROM materiais m WHERE m.id = btrim(s.material_id)::integer)",
+            ),
+            (
+                "encomenda_id inexistente",
+                "NULLIF(btrim(s.encomenda_id), '') IS NOT NULL AND NOT EXISTS "
+                "(SELECT 1 FROM encomendas e WHERE e.id = btrim(s.encomenda_id)::integer)",
+            ),
+        ),
+    ),
+}
+
+
+@dataclass
+class ResultadoImportacao:
+    tabela: str
+    linhas_lidas: int = 0
+    linhas_inseridas: int = 0
+    segundos: float = 0.0
+    fases: dict = field(default_factory=dict)
+    erros: list = field(default_factory=list)  # [(mensagem, total, [linhas...])]
+
+    @property
+    def ok(self) -> bool:
+        return not self.erros
+
+    @property
+    def linhas_por_segundo(self) -> float:
+        return self.linhas_lidas / self.segundos if self.segundos > 0 else 0.0
+
+    def resumo(self) -> str:
+        if not self.ok:
+            partes = [f"{msg}: {total} linha(s), ex. {linhas}" for msg, total, linhas in self.erros]
+            return f"{self.tabela}: importação rejeitada ({self.linhas_lidas} linhas lidas)\n  - " + "\n  - ".join(partes)
+        return (
+            f"{self.tabela}: {self.linhas_inseridas}/{self.linhas_lidas} linhas inseridas em "
+            f"{self.segundos:.2f}s ({self.linhas_por_segundo:,.0f} linhas/s)"
+        )
+
+
+class _Rejeitado(Exception):
+    """Ficheiro com erros de validação: desfaz a transação sem propagar."""
+
+
+def _detetar_formato(caminho: str, formato: Optional[str]) -> str:
+    if formato:
+        return formato.lower()
+    ext = os.path.splitext(caminho)[1].lower()
+    return "parquet" if ext in (".parquet", ".pq") else "csv"
+
+
+def _ler_cabecalho_csv(caminho: str, separador: str) -> list[str]:
+    with open(caminho, "r", encoding="utf-8-sig", newline="") as f:
+        return [c.strip() for c in next(csv.reader(f, delimiter=separador), [])]
+
+
+def _validar_colunas(destino: _Destino, colunas: list[str]) -> list[tuple[str, int, list]]:
+    conhecidas = {c.nome for c in destino.colunas}
+    erros = []
+    desconhecidas = [c for c in colunas if c not in conhecidas]
+    if desconhecidas:
+        erros.append((f"colunas desconhecidas: {', '.join(desconhecidas)}", 0, []))
+    em_falta = [c.nome for c in destino.colunas if c.obrigatoria and c.nome not in colunas]
+    if em_falta:
+        erros.append((f"colunas obrigatórias em falta: {', '.join(em_falta)}", 0, []))
+    return erros
+
+
+def _cast(coluna: _Coluna, expr: str) -> str:
+    valor = f"NULLIF(btrim({expr}), '')"
+    if coluna.tipo in _TIPOS_DECIMAIS:
+        return f"replace({valor}, ',', '.')::{coluna.tipo}"
+    if coluna.tipo == "text":
+        return expr
+    return f"{valor}::{coluna.tipo}"
+
+
+def _copy_csv(cursor, staging: str, colunas: list[str], caminho: str, separador: str) -> None:
+    sql = (
+        f"COPY {staging} ({', '.join(colunas)}) FROM STDIN "
+        f"WITH (FORMAT csv, HEADER true, DELIMITER '{separador}')"
+    )
+    with open(caminho, "r", encoding="utf-8-sig", newline="") as f:
+        cursor.copy_expert(sql, f)
+
+
+def _abrir_parquet(caminho: str):
+    try:
+        import pyarrow.parquet as pq
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError("Importar Parquet requer pyarrow. Instala com: pip install pyarrow") from e
+    return pq.ParquetFile(caminho)
+
+
+def _copy_parquet(cursor, staging: str, colunas: list[str], ficheiro, chunk_size: int) -> None:
+    import pyarrow.csv as pacsv
+
+    # Escrito diretamente pelo Arrow: inteiros com nulos continuam inteiros ('3', não '3.0')
+    opcoes = pacsv.WriteOptions(include_header=False)
+    sql = f"COPY {staging} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)"
+    for lote in ficheiro.iter_batches(batch_size=chunk_size):
+        buf = io.BytesIO()
+        pacsv.write_csv(lote, buf, opcoes)
+        buf.seek(0)
+        cursor.copy_expert(sql, buf)
+
+
+def importar_ficheiro(
+    tabela: str,
+    caminho: str,
+    formato: Optional[str] = None,
+    separador: str = ",",
+    chunk_size: int = 50_000,
+    atualizar_stock: bool = False,
+) -> ResultadoImportacao:
+    """Importa um ficheiro CSV/Parquet para `tabela` (clientes, materiais, produtos, movimentos_stock).
+
+    A primeira linha do CSV tem de ter os nomes das colunas. `atualizar_stock` (só para
+    movimentos) aplica o saldo dos movimentos importados a `materiais.stock_atual`,
+    tal como `forms.registar_movimento_stock` faz para um movimento isolado.
+    """
+    if tabela not in DESTINOS:
+        raise ValueError(f"Tabela não suportada: {tabela}. Opções: {', '.join(DESTINOS)}")
+    if len(separador) != 1 or separador in ("'", "\\"):
+        raise ValueError("Separador inválido")
+
+    destino = DESTINOS[tabela]
+    formato = _detetar_formato(caminho, formato)
+    resultado = ResultadoImportacao(tabela=tabela)
+    staging = f"_stg_{tabela}"
+    inicio = time.perf_counter()
+
+    db = get_database()
+    try:
+        with db.transaction() as conn:
+            cursor = conn.cursor()
+            colunas_stg = ", ".join(f"{c.nome} TEXT" for c in destino.colunas)
+            cursor.execute(
+                f"CREATE TEMP TABLE {staging} (_linha BIGSERIAL, {colunas_stg}) ON COMMIT DROP"
+            )
+
+            # 1) COPY para staging
+            t = time.perf_counter()
+            if formato == "csv":
+                colunas = _ler_cabecalho_csv(caminho, separador)
+            elif formato == "parquet":
+                parquet = _abrir_parquet(caminho)
+                colunas = list(parquet.schema_arrow.names)
+            else:
+                raise ValueError(f"Formato não suportado: {formato}")
+
+            resultado.erros = _validar_colunas(destino, colunas)
+            if resultado.erros:
+                raise _Rejeitado
+
+            if formato == "csv":
+                _copy_csv(cursor, staging, colunas, caminho, separador)
+            else:
+                _copy_parquet(cursor, staging, colunas, parquet, chunk_size)
+            cursor.execute(f"SELECT COUNT(*) FROM {staging}")
+            resultado.linhas_lidas = int(cursor.fetchone()[0])
+            resultado.fases["copy"] = time.perf_counter() - t
+
+            # 2) Validações (tipos primeiro: as restantes fazem casts)
+            t = time.perf_counter()
+            presentes = [c for c in destino.colunas if c.nome in colunas]
+            checks_tipo = []
+            for c in presentes:
+                if c.obrigatoria:
+                    checks_tipo.append((f"{c.nome} em falta", f"NULLIF(btrim(s.{c.nome}), '') IS NULL"))
+                if c.tipo in _TIPOS_INTEIROS:
+                    checks_tipo.append((f"{c.nome} não é inteiro", f"btrim(s.{c.nome}) !~ '^(-?[0-9]+)?$'"))
+                elif c.tipo in _TIPOS_DECIMAIS:
+                    checks_tipo.append((f"{c.nome} não é numérico", f"btrim(s.{c.nome}) !~ '^(-?[0-9]+([.,][0-9]+)?)?$'"))
+                elif c.tipo in _TIPOS_DATA:
+                    checks_tipo.append((f"{c.nome} não é uma data válida", f"NOT pg_temp.data_valida(s.{c.nome}, '{c.tipo}')"))
+            if any(c.tipo in _TIPOS_DATA for c in presentes):
+                cursor.execute(_FN_DATA_VALIDA)
+
+            for grupo in (checks_tipo, destino.validacoes):
+                # Colunas ausentes do ficheiro ficam NULL no staging e não disparam validações.
+                for mensagem, condicao in grupo:
+                    cursor.execute(
+                        f"""
+                        SELECT COUNT(*) OVER (), _linha
+                        FROM {staging} s
+                        WHERE {condicao.format(staging=staging)}
+                        ORDER BY _linha
+                        LIMIT 10
+                        """
+                    )
+                    rows = cursor.fetchall()
+                    if rows:
+                        # +1 para a linha do cabeçalho, como num editor de texto
+                        resultado.erros.append((mensagem, int(rows[0][0]), [int(r[1]) + 1 for r in rows]))
+                if resultado.erros:
+                    break
+            resultado.fases["validacao"] = time.perf_counter() - t
+
+            if resultado.erros:
+                raise _Rejeitado
+
+            # 3) Merge para a tabela real
+            t = time.perf_counter()
+            alvo = [c.nome for c in presentes]
+            exprs = [
+                f"COALESCE({_cast(c, f's.{c.nome}')}, {c.omissao})" if c.omissao else _cast(c, f"s.{c.nome}")
+                for c in presentes
+            ]
+            if "id" in alvo:
+                i = alvo.index("id")
+                exprs[i] = f"COALESCE({exprs[i]}, nextval(pg_get_serial_sequence('{destino.tabela}', 'id')))"
+            cursor.execute(
+                f"""
+                INSERT INTO {destino.tabela} ({', '.join(alvo)})
+                SELECT {', '.join(exprs)}
+                FROM {staging} s
+                ORDER BY s._linha
+                {destino.on_conflict}
+                """
+            )
+            resultado.linhas_inseridas = cursor.rowcount
+
+            if "id" in alvo:
+                # IDs explícitos: avançar a sequência para não colidir com inserts futuros
+                cursor.execute(
+                    f"""
+                    SELECT setval(
+                        pg_get_serial_sequence('{destino.tabela}', 'id'),
+                        GREATEST((SELECT MAX(id) FROM {destino.tabela}), 1)
+                    )
+                    """
+                )
+
+            if atualizar_stock and tabela == "movimentos_stock":
+                cursor.execute(
+                    f"""
+                    UPDATE materiais m
+                    SET stock_atual = m.stock_atual + d.delta,
+                        ultima_atualizacao = CURRENT_TIMESTAMP
+                    FROM (
+                        SELECT
+                            btrim(material_id)::integer AS material_id,
+                            SUM(CASE WHEN btrim(tipo_movimento) = 'entrada' THEN 1 ELSE -1 END
+                                * replace(btrim(quantidade), ',', '.')::numeric) AS delta
+                        FROM {staging}
+                        GROUP BY 1
+                    ) d
+                    WHERE m.id = d.material_id
+                    """
+                )
+            resultado.fases["merge"] = time.perf_counter() - t
+
+            cursor.close()
+    except _Rejeitado:
+        return resultado
+
+    # O COPY/merge não passa pelos métodos de escrita de `Database`.
+    cache.invalidate([destino.tabela, "materiais"] if atualizar_stock else [destino.tabela])
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
@@ -0,0 +1,276 @@
+"""Cache em memória (por processo) dos resultados das funções de relatório.
+
+`@cached_report(ttl, tables)` guarda o resultado por função + argumentos durante
+`ttl` segundos, com um máximo de `CACHE_CONFIG['max_entries']` entradas (LRU).
+As escritas feitas através de `Database` invalidam as entradas que dependem das
+tabelas alteradas (incluindo as alteradas por triggers, ver `TRIGGER_DEPENDENCIES`),
+pelo que quem grava vê logo os números atualizados.
+"""
+
+from __future__ import annotations
+
+import copy
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CACHE_CONFIG
+
+
+# Tabelas escritas por triggers quando se escreve na tabela da chave (sql/schema.sql).
+TRIGGER_DEPENDENCIES: dict[str, set[str]] = {
+    "consumo_materiais": {"movimentos_stock", "materiais"},
+    "movimentos_stock": {"movimentos_stock_diario", "stock_snapshots"},
+    "registro_tempo": {"etapas_producao"},
+    "itens_fatura": {"faturas"},
+    "pagamentos": {"faturas"},
+    "encomendas": {"encomenda_eventos"},
+}
+
+# Tabelas de controlo do agendador: as suas escritas não mudam nenhum relatório nem
+# são escritas de utilizador (não invalidam o cache nem abrem o read-your-writes).
+BOOKKEEPING_TABLES = {"jobs_agendados"}
+
+_RE_WRITE_TARGET = re.compile(
+    # `DO UPDATE SET` / `FOR UPDATE OF|SKIP LOCKED|NOWAIT` não são escritas noutra tabela
+    r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|COPY)\s+(?:ONLY\s+)?"
+    r"(?!(?:SET|OF|SKIP|NOWAIT)\b)(?:\w+\.)?(\w+)",
+    re.I,
+)
+
+
+def tables_written(sql: str) -> set[str]:
+    """Tabelas alteradas por uma instrução, incluindo as que os triggers alteram (sem `BOOKKEEPING_TABLES`)."""
+    tables = {t.lower() for t in _RE_WRITE_TARGET.findall(sql)}
+    pending = list(tables)
+    while pending:
+        for dep in TRIGGER_DEPENDENCIES.get(pending.pop(), ()):
+            if dep not in tables:
+                tables.add(dep)
+                pending.append(dep)
+    return tables - BOOKKEEPING_TABLES
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "tables", "call", "hits")
+
+    def __init__(self, value, expires_at: float, tables: frozenset, call: tuple = None):
+        self.value = value
+        self.expires_at = expires_at
+        self.tables = tables
+        # (função, args, kwargs, ttl) para recalcular a entrada (ver `warm_up`)
+        self.call = call
+        self.hits = 0
+
+
+class ReportCache:
+    """LRU com TTL por entrada e invalidação por tabela. Thread-safe."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = int(max_entries)
+        # >1 enquanto há invalidação entre processos (ver `cache_listener`)
+        self.ttl_multiplier = 1.0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        # Versão por tabela (e época global, avançada por `clear`): um resultado calculado
+        # enquanto a tabela mudou não é guardado.
+        self._versions: dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _versions_of(self, tables: Iterable[str]) -> tuple:
+        return (self._epoch, *(self._versions.get(t, 0) for t in tables))
+
+    def versions(self, tables: Iterable[str]) -> tuple:
+        with self._lock:
+            return self._versions_of(tables)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+            return entry
+
+    def put(self, key: tuple, value, ttl: float, tables: tuple, versions: tuple, call: tuple = None) -> None:
+        with self._lock:
+            if self._versions_of(tables) != versions:
+                return
+            expires_at = time.monotonic() + ttl * self.ttl_multiplier
+            self._entries[key] = _Entry(value, expires_at, frozenset(tables), call)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def expiring(self, within_s: float) -> list:
+        """Entradas usadas desde que foram calculadas e que expiram nos próximos `within_s` segundos."""
+        limit = time.monotonic() + within_s
+        with self._lock:
+            return [
+                (k, e) for k, e in self._entries.items()
+                if e.hits and e.call is not None and e.expires_at <= limit
+            ]
+
+    def invalidate(self, tables: Iterable[str]) -> int:
+        """Remove as entradas que dependem de alguma das tabelas. Devolve quantas."""
+        tables = {t.lower() for t in tables}
+        if not tables:
+            return 0
+        with self._lock:
+            for t in tables:
+                self._versions[t] = self._versions.get(t, 0) + 1
+            stale = [k for k, e in self._entries.items() if e.tables & tables]
+            for k in stale:
+                del self._entries[k]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate_pct": round(self.hits / total * 100.0, 1) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "ttl_multiplier": self.ttl_multiplier,
+            }
+
+
+report_cache = ReportCache(CACHE_CONFIG["max_entries"])
+
+# Estado por thread: erros de BD vistos e transações em curso (ver `database.py`).
+_local = threading.local()
+
+
+def note_error() -> None:
+    """Chamado pela camada de BD quando uma instrução falha (o resultado não deve ser guardado)."""
+    _local.errors = getattr(_local, "errors", 0) + 1
+
+
+@contextmanager
+def suspended():
+    """Desliga o cache nesta thread (ex: dentro de uma transação, com escritas por confirmar)."""
+    _local.suspended = getattr(_local, "suspended", 0) + 1
+    try:
+        yield
+    finally:
+        _local.suspended -= 1
+
+
+def _copy(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, (list, dict)):
+        return copy.deepcopy(value)
+    return value
+
+
+def cached_report(ttl: float, tables: Iterable[str]) -> Callable:
+    """Decorator: guarda o resultado durante `ttl` segundos; invalidado por escritas em `tables`.
+
+    `tables` são as tabelas base lidas pela função (as views contam pelas tabelas
+    que usam). Quem chama recebe sempre uma cópia, pode alterá-la à vontade.
+    """
+    tables = tuple(sorted({t.lower() for t in tables}))
+
+    def decorator(fn: Callable) -> Callable:
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not CACHE_CONFIG["enabled"] or getattr(_local, "suspended", 0):
+                return fn(*args, **kwargs)
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                entry = report_cache.get(key)
+            except TypeError:  # argumentos não hashable
+                return fn(*args, **kwargs)
+            if entry is not None:
+                return _copy(entry.value)
+
+            versions = report_cache.versions(tables)
+            errors_before = getattr(_local, "errors", 0)
+            value = fn(*args, **kwargs)
+            if getattr(_local, "errors", 0) == errors_before:
+                report_cache.put(key, _copy(value), ttl, tables, versions, (fn, args, kwargs, ttl))
+            return value
+
+        wrapper.cache_tables = tables
+        return wrapper
+
+    return decorator
+
+
+def invalidate(tables: Iterable[str]) -> int:
+    """Invalida as entradas que dependem de `tables` (e das tabelas escritas pelos seus triggers)."""
+    expanded = set()
+    for t in tables:
+        expanded |= tables_written(f"INSERT INTO {t}")
+    return report_cache.invalidate(expanded)
+
+
+def invalidate_sql(sql: str) -> int:
+    return report_cache.invalidate(tables_written(sql))
+
+
+def clear() -> None:
+    report_cache.clear()
+
+
+def warm_up(within_s: float = 60.0) -> int:
+    """Recalcula antes de expirar as entradas que foram usadas (refresh-ahead). Devolve quantas.
+
+    Entradas que ninguém leu desde o último cálculo são deixadas expirar, para o
+    aquecimento não manter vivo o cache inteiro.
+    """
+    if not CACHE_CONFIG["enabled"]:
+        return 0
+    refreshed = 0
+    for key, entry in report_cache.expiring(within_s):
+        fn, args, kwargs, ttl = entry.call
+        versions = report_cache.versions(sorted(entry.tables))
+        errors_before = getattr(_local, "errors", 0)
+        value = fn(*args, **kwargs)
+        if getattr(_local, "errors", 0) == errors_before:
+            report_cache.put(key, value, ttl, tuple(sorted(entry.tables)), versions, entry.call)
+            refreshed += 1
+    return refreshed
+
+
+def table_versions(tables: Iterable[str]) -> tuple:
+    """Versão atual dos dados de `tables` (muda a cada escrita/invalidação); serve de chave de cache."""
+    return report_cache.versions(sorted(t.lower() for t in tables))
+
+
+def get_cache_stats() -> dict:
+    return report_cache.stats()
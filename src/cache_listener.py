@@ -0,0 +1,139 @@
+"""Invalidação do cache de relatórios entre processos (LISTEN/NOTIFY).
+
+Os triggers `tr_*_notify_cache` (sql/schema.sql) notificam o canal `firma_cache`
+com o nome da tabela alterada. Uma thread por processo escuta o canal numa ligação
+dedicada (fora do pool) e invalida as entradas de `cache` que dependem da tabela.
+
+Enquanto o listener está ligado os TTL do cache são multiplicados por
+`CACHE_CONFIG['listen_ttl_multiplier']`; ao ligar e ao perder a ligação o cache é
+limpo, porque as notificações entretanto enviadas perderam-se.
+"""
+
+from __future__ import annotations
+
+import os
+import select
+import sys
+import threading
+from typing import Optional
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CACHE_CONFIG
+
+try:
+    import cache
+    from database import PRIMARY_PARAMS
+except ModuleNotFoundError:
+    from src import cache
+    from src.database import PRIMARY_PARAMS
+
+
+CHANNEL = "firma_cache"
+
+
+class CacheListener(threading.Thread):
+    """Thread que mantém o LISTEN ativo, com reconexão (backoff exponencial)."""
+
+    def __init__(self, config: dict, poll_s: float = 10.0, reconnect_max_s: float = 60.0):
+        super().__init__(name="firma_cache_listener", daemon=True)
+        self.config = config
+        self.poll_s = poll_s
+        self.reconnect_max_s = reconnect_max_s
+        self._stop_event = threading.Event()
+        self.connected = False
+        self.notifications = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _set_connected(self, connected: bool) -> None:
+        if connected == self.connected:
+            return
+        self.connected = connected
+        cache.report_cache.ttl_multiplier = CACHE_CONFIG["listen_ttl_multiplier"] if connected else 1.0
+        cache.clear()
+
+    def _listen(self) -> None:
+        conn = psycopg2.connect(**self.config, keepalives=1, keepalives_idle=30)
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {CHANNEL}")
+            self._set_connected(True)
+
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([conn], [], [], self.poll_s)
+                if not ready:
+                    # Sem tráfego: confirma que a ligação continua viva.
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+                conn.poll()
+                tables = set()
+                while conn.notifies:
+                    tables.add(conn.notifies.pop(0).payload)
+                if tables:
+                    self.notifications += len(tables)
+                    # Escritas de outros processos não afastam as leituras da réplica: o
+                    # atraso dela é limitado por `max_lag_s` (ver `database.ReplicaRouter`).
+                    cache.invalidate(tables)
+        finally:
+            self._set_connected(False)
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Listener do cache desligado: {e}")
+            if self._stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.reconnect_max_s)
+            self.reconnects += 1
+
+
+_listener: Optional[CacheListener] = None
+_listener_lock = threading.Lock()
+
+
+def start_listener() -> Optional[CacheListener]:
+    """Arranca o listener do processo (idempotente). Devolve None se estiver desativado."""
+    global _listener
+    if not CACHE_CONFIG["listen"] or not CACHE_CONFIG["enabled"]:
+        return None
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = CacheListener(PRIMARY_PARAMS)
+            _listener.start()
+    return _listener
+
+
+def stop_listener() -> None:
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_listener_status() -> dict:
+    listener = _listener
+    if listener is None:
+        return {"ativo": False, "ligado": False, "notificacoes": 0, "reconexoes": 0, "ultimo_erro": None}
+    return {
+        "ativo": listener.is_alive(),
+        "ligado": listener.connected,
+        "notificacoes": listener.notifications,
+        "reconexoes": listener.reconnects,
+        "ultimo_erro": listener.last_error,
+    }
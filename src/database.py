@@ -1,109 +1,1397 @@
+import atexit
+import contextvars
+import csv
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Tuple
+from typing import Any, Callable, Dict, Iterator, Optional, List, Tuple, Union
 import sys
 import os
 
 # Adicionar o diretório raiz ao path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DB_CONFIG
+from config import DB_BATCH_PAGE_SIZE, DB_CONFIG, DB_POOL_CONFIG, DB_REPLICA_CONFIG, DB_TIMEOUT_CONFIG
 
+try:
+    import cache
+    import query_stats
+except ModuleNotFoundError:
+    from src import cache, query_stats
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Não foi possível obter uma ligação do pool dentro do tempo limite."""
+
+
+class TransactionAborted(psycopg2.DatabaseError):
+    """Uma instrução falhou dentro de `Database.transaction()` e foi feito rollback."""
+
+
+class QueryTimeout(psycopg2.extensions.QueryCanceledError):
+    """O orçamento de tempo da página esgotou-se antes de a query ser enviada."""
+
+
+class _PooledConnection(psycopg2.extensions.connection):
+    """Ligação psycopg2 com os metadados de que o pool precisa."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = time.monotonic()
+        # Nomes das `NamedQuery` já preparadas nesta sessão
+        self.prepared: set = set()
+
+
+class ConnectionPool:
+    """Pool de ligações PostgreSQL partilhado por todo o processo.
+
+    - abre ligações a pedido, até `max_size`; mantém pelo menos `min_size` abertas;
+    - `getconn()` espera no máximo `timeout` segundos por uma ligação livre;
+    - ligações paradas há mais de `health_check_after` segundos são testadas
+      (`SELECT 1`) antes de serem entregues; as que falham são substituídas;
+    - `putconn()` faz rollback de transações esquecidas antes de devolver ao pool.
+
+    As ligações trabalham em autocommit: cada instrução isolada é a sua própria
+    transação (sem round-trip extra de COMMIT). Quem precisa de várias instruções
+    atómicas desliga o autocommit temporariamente.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        health_check_after: float = 30.0,
+        idle_timeout: float = 300.0,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Configuração do pool inválida (0 <= min_size <= max_size, max_size >= 1)")
+
+        self._config = dict(config)
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        self.timeout = float(timeout)
+        self.health_check_after = float(health_check_after)
+        self.idle_timeout = float(idle_timeout)
+
+        self._idle: deque = deque()
+        self._in_use: set = set()
+        self._opening = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Métricas
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._discarded = 0
+
+    def _size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self) -> _PooledConnection:
+        conn = psycopg2.connect(connection_factory=_PooledConnection, **self._config)
+        conn.autocommit = True
+        return conn
+
+    def _is_healthy(self, conn: _PooledConnection) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _trim_idle(self) -> list:
+        """Retira do pool ligações paradas há demasiado tempo (acima de `min_size`)."""
+        now = time.monotonic()
+        expired = []
+        while len(self._idle) + len(self._in_use) > self.min_size and self._idle:
+            oldest = self._idle[0]
+            if now - oldest.last_used < self.idle_timeout:
+                break
+            expired.append(self._idle.popleft())
+        return expired
+
+    def getconn(self, timeout: Optional[float] = None) -> _PooledConnection:
+        """Obtém uma ligação (espera até `timeout` se o pool estiver esgotado)."""
+        timeout = self.timeout if timeout is None else float(timeout)
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("O pool de ligações está fechado")
+                    if self._idle:
+                        conn = self._idle.pop()  # LIFO: reutiliza a ligação mais "quente"
+                        break
+                    if self._size() < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Sem ligações livres após {timeout:.1f}s (max_size={self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._opened += 1
+                    self._in_use.add(conn)
+            elif self._is_healthy(conn):
+                with self._cond:
+                    self._in_use.add(conn)
+            else:
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                    self._cond.notify()
+                continue
+
+            wait = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+            return conn
+
+    def putconn(self, conn: _PooledConnection, discard: bool = False) -> None:
+        """Devolve a ligação ao pool (ou fecha-a se estiver inutilizável)."""
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if discard or conn.closed or self._closed:
+                expired = [conn]
+                self._discarded += 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                expired = self._trim_idle()
+            self._cond.notify()
+
+        for c in expired:
+            self._close_quietly(c)
+
+    def closeall(self) -> None:
+        """Fecha o pool; ligações ainda emprestadas são fechadas quando devolvidas."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> dict:
+        """Métricas do pool: ligações em uso/livres e tempo de espera no checkout."""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "opening": self._opening,
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round((self._wait_total / checkouts) * 1000.0, 3) if checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000.0, 3),
+                "opened": self._opened,
+                "discarded": self._discarded,
+            }
+
+
+# --------------------------------------------
+# Materialização tipada de resultados
+# --------------------------------------------
+
+# NUMERIC chega já como float (o parser do psycopg2 nunca cria objetos Decimal)
+_NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "FIRMA_NUMERIC_AS_FLOAT",
+    lambda value, cursor: float(value) if value is not None else None,
+)
+
+# OIDs dos tipos PostgreSQL (pg_type) mapeados para dtypes numpy/pandas
+_PG_INT_OIDS = {20, 21, 23, 26}  # int8, int2, int4, oid
+_PG_FLOAT_OIDS = {700, 701, 1700}  # float4, float8, numeric
+_PG_BOOL_OIDS = {16}
+_PG_DATETIME_OIDS = {1082, 1114}  # date, timestamp
+_PG_DATETIMETZ_OIDS = {1184}  # timestamptz
+_PG_TEXT_OIDS = {18, 19, 25, 1042, 1043}  # char, name, text, bpchar, varchar
+
+# Colunas de texto com poucos valores distintos: guardadas como `category`
+CATEGORICAL_COLUMNS = frozenset({
+    "status",
+    "prioridade",
+    "tipo_movimento",
+    "tipo_etapa",
+    "evento",
+    "complexidade",
+    "categoria",
+    "aging_bucket",
+    "status_stock",
+    "situacao_prazo",
+})
+
+
+def _typed_column(values: tuple, type_code: int, name: str):
+    if type_code in _PG_FLOAT_OIDS:
+        return np.array(values, dtype=np.float64)
+    if type_code in _PG_INT_OIDS:
+        if any(v is None for v in values):
+            # Nullable (ex: chaves estrangeiras opcionais): continuam inteiros, com <NA>
+            return pd.array(values, dtype="Int64")
+        return np.array(values, dtype=np.int64)
+    if type_code in _PG_BOOL_OIDS:
+        if any(v is None for v in values):
+            return pd.array(values, dtype="boolean")
+        return np.array(values, dtype=bool)
+    if type_code in _PG_DATETIME_OIDS or type_code in _PG_DATETIMETZ_OIDS:
+        raw = pd.Series(values, dtype=object)
+        converted = pd.to_datetime(raw, errors="coerce", utc=type_code in _PG_DATETIMETZ_OIDS)
+        # Datas fora do intervalo do pandas (ex: 9999-12-31) dariam NaT, iguais a NULL:
+        # nesse caso a coluna fica como object, com os valores originais.
+        if (converted.isna() & raw.notna()).any():
+            return raw
+        return converted
+    if type_code in _PG_TEXT_OIDS and name in CATEGORICAL_COLUMNS:
+        return pd.Categorical(values)
+    return pd.Series(values, dtype=object)
+
+
+def typed_frame(description, rows: list) -> pd.DataFrame:
+    """Constrói um DataFrame com dtypes nativos a partir de `cursor.description`.
+
+    NUMERIC/float → float64, inteiros → int64 (Int64 se houver NULLs),
+    boolean → bool (boolean se houver NULLs),
+    date/timestamp → datetime64 (object se houver datas fora do intervalo do pandas),
+    colunas de estado (`CATEGORICAL_COLUMNS`) → category;
+    os restantes tipos ficam como object.
+    """
+    names = [d.name for d in description]
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    data = {
+        i: _typed_column(values, d.type_code, d.name)
+        for i, (d, values) in enumerate(zip(description, columns))
+    }
+    df = pd.DataFrame(data, index=pd.RangeIndex(len(rows)))
+    df.columns = names
+    return df
+
+
+# --------------------------------------------
+# Queries registadas (prepared statements)
+# --------------------------------------------
+
+_RE_PLACEHOLDER = re.compile(r"%%|%s|%\((\w+)\)s")
+
+
+class NamedQuery:
+    """Query registada com `register_query`: preparada (PREPARE) uma vez por ligação do
+    pool e depois executada com `EXECUTE`, sem reenviar nem replanear o SQL.
+
+    Usa os placeholders habituais do psycopg2: `%s` (parâmetros em tuplo) ou
+    `%(nome)s` (em dict; o mesmo nome pode aparecer várias vezes).
+    """
+
+    __slots__ = ("name", "sql", "statement", "prepare_sql", "execute_sql")
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        # O hash do SQL no nome evita colisões se a query mudar (ex: reload do módulo).
+        digest = hashlib.md5(sql.encode("utf-8")).hexdigest()[:8]
+        self.statement = f"fq_{re.sub(r'[^0-9a-zA-Z_]', '_', name)}_{digest}"
+
+        positional = 0
+        named: list = []
+
+        def _to_dollar(m) -> str:
+            nonlocal positional
+            if m.group(0) == "%%":
+                return "%"
+            if m.group(1) is None:
+                positional += 1
+                return f"${positional}"
+            if m.group(1) not in named:
+                named.append(m.group(1))
+            return f"${named.index(m.group(1)) + 1}"
+
+        body = _RE_PLACEHOLDER.sub(_to_dollar, sql)
+        if positional and named:
+            raise ValueError(f"Query '{name}': não misturar %s com %(nome)s")
+        self.prepare_sql = f"PREPARE {self.statement} AS {body}"
+        if named:
+            args = ", ".join(f"%({n})s" for n in named)
+        else:
+            args = ", ".join(["%s"] * positional)
+        self.execute_sql = f"EXECUTE {self.statement} ({args})" if args else f"EXECUTE {self.statement}"
+
+    def __repr__(self) -> str:
+        return f"NamedQuery({self.name!r})"
+
+
+_named_queries: dict = {}
+_named_queries_lock = threading.Lock()
+
+
+def register_query(name: str, sql: str) -> NamedQuery:
+    """Regista (ou devolve a já registada) a query `name`; usar com `Database.execute_query`.
+
+    Pode ser chamada dentro da própria função de relatório: com o mesmo SQL devolve
+    sempre o mesmo objeto.
+    """
+    nq = _named_queries.get(name)
+    if nq is not None and nq.sql == sql:
+        return nq
+    with _named_queries_lock:
+        nq = _named_queries.get(name)
+        if nq is None or nq.sql != sql:
+            nq = _named_queries[name] = NamedQuery(name, sql)
+    return nq
+
+
+def _statement_for(conn, query) -> str:
+    """SQL a executar em `conn`: para uma `NamedQuery`, prepara-a na ligação (1.ª vez) e devolve o EXECUTE."""
+    if not isinstance(query, NamedQuery):
+        return query
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None:
+        return query.sql
+    if query.statement not in prepared:
+        cursor = conn.cursor()
+        cursor.execute(query.prepare_sql)
+        cursor.close()
+        prepared.add(query.statement)
+    return query.execute_sql
+
+
+# --------------------------------------------
+# Paginação por chave (keyset)
+# --------------------------------------------
+
+
+class KeysetPage:
+    """Página de `Database.execute_page`: as linhas e o cursor da página seguinte (None = última)."""
+
+    __slots__ = ("rows", "next_cursor")
+
+    def __init__(self, rows: pd.DataFrame, next_cursor: Optional[tuple]):
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+
+def _cursor_value(value):
+    """Valor da chave em tipo Python (parâmetro do psycopg2 e guardável em `st.session_state`)."""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# --------------------------------------------
+# Timeouts: por query e orçamento por página
+# --------------------------------------------
+
+# Margem para o cancel() do lado do cliente, caso o servidor não corte a tempo
+_CANCEL_GRACE_S = 1.0
+
+
+class _Watchdog:
+    """Chama `conn.cancel()` nas queries que passam do seu limite sem o servidor as cortar.
+
+    Uma só thread vigia todas as queries registadas com `watch`; termina quando fica
+    `linger_s` segundos sem queries e volta a arrancar com a seguinte.
+    """
+
+    def __init__(self, linger_s: float = 5.0):
+        self.linger_s = float(linger_s)
+        self._cond = threading.Condition()
+        # id(conn) -> (conn, instante do cancel)
+        self._watched: dict = {}
+        self._cancelling: set = set()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def watch(self, conn, seconds: float):
+        key = id(conn)
+        with self._cond:
+            self._watched[key] = (conn, time.monotonic() + seconds)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="firma_db_watchdog", daemon=True)
+                self._thread.start()
+            else:
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._watched.pop(key, None)
+                # Um cancel() a caminho tem de chegar antes de a ligação voltar ao pool
+                while key in self._cancelling:
+                    self._cond.wait()
+
+    def _run(self) -> None:
+        idle_since = None
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                if not self._watched:
+                    idle_since = idle_since or now
+                    if now - idle_since >= self.linger_s:
+                        self._thread = None
+                        return
+                    self._cond.wait(self.linger_s - (now - idle_since))
+                    continue
+                idle_since = None
+                due = [(key, conn) for key, (conn, at) in self._watched.items() if at <= now]
+                if not due:
+                    self._cond.wait(min(at for _, at in self._watched.values()) - now)
+                    continue
+                for key, _ in due:
+                    del self._watched[key]
+                    self._cancelling.add(key)
+            for key, conn in due:
+                try:
+                    conn.cancel()
+                except Exception:
+                    pass
+            with self._cond:
+                self._cancelling.difference_update(key for key, _ in due)
+                self._cond.notify_all()
+
+
+# Queries com timeout fora de um orçamento de página (ex: agendador, scripts)
+_watchdog = _Watchdog()
+
+
+class PageBudget:
+    """Tempo total disponível para as queries de uma página (render do Streamlit).
+
+    Cada `execute_query` feita enquanto o orçamento está ativo recebe como timeout o
+    tempo que falta; quando se esgota, as queries seguintes nem são enviadas. As que
+    foram canceladas ficam em `timed_out`, para a página avisar que o resultado é parcial.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = float(seconds)
+        self.deadline = time.monotonic() + self.seconds
+        self._lock = threading.Lock()
+        self.timed_out: list = []
+        # Um watchdog para todas as queries da página (em vez de um timer por query)
+        self.watchdog = _Watchdog()
+
+    def remaining_ms(self) -> int:
+        return int((self.deadline - time.monotonic()) * 1000)
+
+    def record_timeout(self, what: str) -> None:
+        with self._lock:
+            self.timed_out.append(what)
+
+    @property
+    def exceeded(self) -> bool:
+        return bool(self.timed_out)
+
+
+# contextvar (e não threading.local) para que `run_concurrently` o passe às threads de trabalho
+_page_budget: contextvars.ContextVar = contextvars.ContextVar("firma_page_budget", default=None)
+
+
+def set_page_budget(seconds: Optional[float] = None) -> PageBudget:
+    """Ativa um orçamento novo no contexto atual (ex: no topo do script do Streamlit)."""
+    budget = PageBudget(DB_TIMEOUT_CONFIG["page_budget_s"] if seconds is None else seconds)
+    _page_budget.set(budget)
+    return budget
+
+
+@contextmanager
+def page_budget(seconds: Optional[float] = None):
+    """Como `set_page_budget`, limitado ao bloco `with`."""
+    budget = PageBudget(DB_TIMEOUT_CONFIG["page_budget_s"] if seconds is None else seconds)
+    token = _page_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _page_budget.reset(token)
+
+
+def _timeout_prefix(conn, timeout_ms: Optional[int]) -> str:
+    """`SET LOCAL statement_timeout` a enviar na mesma mensagem que a query (sem round-trip extra).
+
+    Em autocommit as instruções de uma mensagem correm numa só transação implícita: o
+    SET LOCAL acaba com ela e não fica nada na sessão. Dentro de uma transação ficaria
+    para as instruções seguintes (escritas incluídas), por isso não se envia; aí o
+    limite é o `cancel()` do watchdog.
+    """
+    if timeout_ms is None or not conn.autocommit:
+        return ""
+    return f"SET LOCAL statement_timeout = {int(timeout_ms)}; "
+
+
+@contextmanager
+def _watch(conn, timeout_ms: Optional[int]):
+    """Vigia a query em `conn`: cancela-a no cliente se passar de `timeout_ms` (+ margem)."""
+    if timeout_ms is None:
+        yield
+        return
+    budget = _page_budget.get()
+    watchdog = budget.watchdog if budget is not None else _watchdog
+    with watchdog.watch(conn, timeout_ms / 1000.0 + _CANCEL_GRACE_S):
+        yield
+
+
+# Parâmetros de ligação ao primário (DB_CONFIG sem as chaves de encaminhamento)
+PRIMARY_PARAMS = {k: v for k, v in DB_CONFIG.items() if k != "replica_dsn"}
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+# Nomes únicos para cursores do lado do servidor (`iter_query`)
+_cursor_ids = itertools.count(1)
+
+
+class _Transaction:
+    """Transação em curso na thread: ligação, nível de savepoints, estado de erro e tabelas escritas."""
+
+    __slots__ = ("pool", "conn", "depth", "failed", "written", "clear_cache")
+
+    def __init__(self, pool: "ConnectionPool", conn: _PooledConnection):
+        self.pool = pool
+        self.conn = conn
+        self.depth = 0
+        self.failed = False
+        # Invalidação do cache adiada para o commit
+        self.written: set = set()
+        self.clear_cache = False
+
+
+# Uma transação por thread; as threads de trabalho usam sempre ligações próprias.
+_tx_local = threading.local()
+
+
+# Último erro de BD visto em cada thread (qualquer instância de `Database`)
+_error_local = threading.local()
+
+
+def last_thread_error() -> Optional[str]:
+    """Mensagem do último erro de BD nesta thread (ex: para o agendador registar porque um job falhou)."""
+    return getattr(_error_local, "message", None)
+
+
+def clear_thread_error() -> None:
+    _error_local.message = None
+
+
+def _current_transaction(pool: "ConnectionPool") -> Optional[_Transaction]:
+    tx = getattr(_tx_local, "tx", None)
+    if tx is not None and tx.pool is pool:
+        return tx
+    return None
+
+
+def get_pool() -> ConnectionPool:
+    """Pool de ligações do processo (criado no primeiro uso)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(PRIMARY_PARAMS, **DB_POOL_CONFIG)
+                atexit.register(_pool.closeall)
+    return _pool
+
+
+def get_pool_stats() -> dict:
+    """Métricas do pool do processo (ver `ConnectionPool.stats`)."""
+    return get_pool().stats()
+
+
+def close_pool() -> None:
+    """Fecha o pool do processo; o próximo `get_database()` cria um novo."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+# --------------------------------------------
+# Réplica de leitura
+# --------------------------------------------
+
+class WriteSession:
+    """Hora (time.monotonic) da última escrita de uma sessão (ver `set_write_session`)."""
+
+    __slots__ = ("last_write",)
 
-class Database:
-    """Classe para gestão da conexão à base de dados PostgreSQL"""
-    
     def __init__(self):
+        self.last_write = 0.0
+
+
+# Janela de read-your-writes por sessão: durante `read_your_writes_s` depois de uma
+# escrita, só as leituras read-only da mesma sessão ficam no primário. As escritas de
+# outras sessões e processos não a abrem; para essas conta o `max_lag_s` da réplica.
+_write_session: contextvars.ContextVar = contextvars.ContextVar("firma_write_session", default=None)
+
+_REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp()))
+END
+"""
+
+
+def set_write_session(session: Optional[WriteSession] = None) -> WriteSession:
+    """Associa o contexto atual a uma sessão de escritas.
+
+    No dashboard a sessão fica em `st.session_state`, para a janela de read-your-writes
+    continuar no render seguinte ao de uma escrita. Sem sessão associada, cada contexto
+    (thread) tem a sua.
+    """
+    session = session or WriteSession()
+    _write_session.set(session)
+    return session
+
+
+def note_write() -> None:
+    """Regista uma escrita da sessão atual (abre a sua janela de read-your-writes)."""
+    session = _write_session.get()
+    if session is None:
+        session = set_write_session()
+    session.last_write = time.monotonic()
+
+
+def _recent_write(window_s: float) -> bool:
+    session = _write_session.get()
+    return session is not None and time.monotonic() - session.last_write < window_s
+
+
+class ReplicaRouter:
+    """Pool da réplica e decisão de encaminhamento (atraso medido + janela de read-your-writes)."""
+
+    def __init__(
+        self,
+        dsn: str,
+        max_lag_s: float = 30.0,
+        check_interval_s: float = 10.0,
+        read_your_writes_s: float = 5.0,
+        max_size: int = 5,
+    ):
+        # Timeout curto: se a réplica não responde, mais vale ir ao primário.
+        self.pool = ConnectionPool(
+            {"dsn": dsn},
+            min_size=0,
+            max_size=max_size,
+            timeout=min(2.0, DB_POOL_CONFIG["timeout"]),
+            health_check_after=DB_POOL_CONFIG["health_check_after"],
+            idle_timeout=DB_POOL_CONFIG["idle_timeout"],
+        )
+        self.max_lag_s = float(max_lag_s)
+        self.check_interval_s = float(check_interval_s)
+        self.read_your_writes_s = float(read_your_writes_s)
+        self._check_lock = threading.Lock()
+        self._checked_at: Optional[float] = None
+        self.healthy = False
+        self.lag_s: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.routed = 0
+        self.fallbacks = 0
+
+    def _check(self) -> None:
+        try:
+            conn = self.pool.getconn()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(_REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+                cursor.close()
+            finally:
+                self.pool.putconn(conn)
+            # NULL: réplica que ainda não aplicou nenhuma transação
+            self.lag_s = float(lag) if lag is not None else None
+            self.healthy = self.lag_s is not None and self.lag_s <= self.max_lag_s
+            if self.healthy:
+                self.last_error = None
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e)
+
+    def usable(self) -> bool:
+        if _recent_write(self.read_your_writes_s):
+            return False
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.check_interval_s:
+            # Só uma thread mede o atraso; as outras usam o último resultado.
+            if self._check_lock.acquire(blocking=False):
+                try:
+                    self._check()
+                    self._checked_at = time.monotonic()
+                finally:
+                    self._check_lock.release()
+        return self.healthy
+
+    def mark_down(self, error: Exception) -> None:
+        self.healthy = False
+        self._checked_at = time.monotonic()
+        self.last_error = str(error)
+        self.fallbacks += 1
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lag_s": self.lag_s,
+            "max_lag_s": self.max_lag_s,
+            "routed": self.routed,
+            "fallbacks": self.fallbacks,
+            "last_error": self.last_error,
+            "pool": self.pool.stats(),
+        }
+
+
+_replica: Optional[ReplicaRouter] = None
+
+
+def get_replica() -> Optional[ReplicaRouter]:
+    """Router da réplica do processo, ou None se `DB_REPLICA_DSN` não estiver definido."""
+    global _replica
+    if _replica is None and DB_CONFIG.get("replica_dsn"):
+        with _pool_lock:
+            if _replica is None:
+                _replica = ReplicaRouter(DB_CONFIG["replica_dsn"], **DB_REPLICA_CONFIG)
+                atexit.register(_replica.pool.closeall)
+    return _replica
+
+
+def get_replica_stats() -> Optional[dict]:
+    replica = get_replica()
+    return replica.stats() if replica is not None else None
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Deixa uma ligação livre para a thread que pede os relatórios.
+                workers = max(1, DB_POOL_CONFIG["max_size"] - 1)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firma_db")
+                atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def run_concurrently(tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+    """Executa funções de relatório independentes em paralelo, cada uma com a sua ligação do pool.
+
+    Devolve `{nome: resultado}` pela ordem de `tasks`; a latência passa a ser a da
+    função mais lenta em vez da soma. Se alguma falhar, a primeira exceção (pela
+    ordem de `tasks`) é relançada depois de todas terminarem.
+
+    Dentro de `Database.transaction()` corre tudo em série na própria thread, para
+    que as leituras vejam as escritas ainda não confirmadas.
+
+        dados = run_concurrently({
+            "rent": pricing.get_rentabilidade_produtos,
+            "timeline": lambda: delivery.get_timeline_entregas(30),
+        })
+    """
+    if len(tasks) <= 1 or getattr(_tx_local, "tx", None) is not None:
+        return {name: fn() for name, fn in tasks.items()}
+
+    executor = _get_executor()
+    # Cada tarefa corre com uma cópia do contexto (contextvars) de quem chama.
+    futures = {
+        name: executor.submit(contextvars.copy_context().run, fn)
+        for name, fn in tasks.items()
+    }
+    results = {}
+    first_error: Optional[BaseException] = None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+class Database:
+    """Classe para gestão da conexão à base de dados PostgreSQL.
+
+    As ligações vêm do pool partilhado pelo processo: cada operação empresta uma
+    ligação e devolve-a no fim, pelo que criar instâncias é barato.
+    """
+
+    def __init__(self, pool: Optional[ConnectionPool] = None):
         self.config = DB_CONFIG
+        self.pool = pool or get_pool()
         self.conn = None
         self.last_error: Optional[str] = None
-        
+
     def connect(self):
-        """Estabelece conexão com a base de dados"""
+        """Reserva uma ligação do pool para uso exclusivo desta instância"""
+        if self.conn is not None:
+            return True
         try:
-            self.conn = psycopg2.connect(**self.config)
+            self.conn = self.pool.getconn()
             self.last_error = None
             return True
         except Exception as e:
             self.last_error = str(e)
             print(f"Erro ao conectar à base de dados: {e}")
             return False
-    
+
     def disconnect(self):
-        """Fecha conexão com a base de dados"""
+        """Devolve a ligação reservada ao pool"""
         if self.conn:
-            self.conn.close()
+            self.pool.putconn(self.conn)
             self.conn = None
-    
-    def execute_query(self, query: str, params: Optional[tuple] = None) -> pd.DataFrame:
-        """Executa query e retorna DataFrame"""
-        if not self.conn:
-            self.connect()
-        
-        try:
-            df = pd.read_sql_query(query, self.conn, params=params)
+
+    @property
+    def in_transaction(self) -> bool:
+        return _current_transaction(self.pool) is not None
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma ligação do pool (ou usa a da transação em curso / a reservada com `connect()`)."""
+        tx = _current_transaction(self.pool)
+        if tx is not None:
+            yield tx.conn
+            return
+        if self.conn is not None:
+            yield self.conn
+            return
+
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Unidade de trabalho: tudo o que correr dentro do bloco usa a mesma ligação e um só commit.
+
+        As funções de `src/` que usam `get_database()` juntam-se automaticamente à
+        transação da thread. Dentro dela os erros das instruções são propagados (além
+        de ficarem em `last_error`) e nada é gravado; uma exceção no bloco faz rollback.
+        Transações aninhadas passam a savepoints.
+
+            with get_database().transaction():
+                orc_id = forms.inserir_orcamento_returning_id(...)
+                enc_id = forms.inserir_encomenda_returning_id(orc_id, ...)
+        """
+        tx = _current_transaction(self.pool)
+        if tx is not None:
+            tx.depth += 1
+            savepoint = f"firma_sp_{tx.depth}"
+            cursor = tx.conn.cursor()
+            try:
+                cursor.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield tx.conn
+                except BaseException:
+                    if not tx.conn.closed:
+                        cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                        tx.failed = False
+                    raise
+                if tx.failed:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    tx.failed = False
+                    raise TransactionAborted(self.last_error or "Transação abortada")
+                cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            finally:
+                tx.depth -= 1
+                if not cursor.closed and not tx.conn.closed:
+                    cursor.close()
+            return
+
+        # Leituras dentro da transação podem ver escritas por confirmar: não passam pelo cache.
+        with self.connection() as conn, cache.suspended():
+            tx = _Transaction(self.pool, conn)
+            conn.autocommit = False
+            _tx_local.tx = tx
+            try:
+                yield conn
+                if tx.failed:
+                    # Um erro foi apanhado dentro do bloco: a transação já está abortada no servidor.
+                    raise TransactionAborted(self.last_error or "Transação abortada")
+                conn.commit()
+                if tx.written or tx.clear_cache:
+                    note_write()
+                if tx.clear_cache:
+                    cache.clear()
+                else:
+                    cache.report_cache.invalidate(tx.written)
+            except BaseException:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                _tx_local.tx = None
+                if not conn.closed:
+                    conn.autocommit = True
+
+    def _error(self, e: Exception, message: str) -> None:
+        """Regista o erro; dentro de uma transação volta a lançá-lo."""
+        self.last_error = str(e)
+        _error_local.message = self.last_error
+        print(f"{message}: {e}")
+        cache.note_error()
+        tx = _current_transaction(self.pool)
+        if tx is not None:
+            tx.failed = True
+            raise e
+
+    def _invalidate(self, query: Optional[str] = None) -> None:
+        """Invalida o cache de relatórios para as tabelas escritas por `query` (None: tudo)."""
+        tx = _current_transaction(self.pool)
+        if query is None:
+            if tx is not None:
+                tx.clear_cache = True
+            else:
+                note_write()
+                cache.clear()
+            return
+        tables = cache.tables_written(query)
+        if not tables:
+            # Ex: controlo do agendador (`cache.BOOKKEEPING_TABLES`): não conta como escrita
+            return
+        if tx is not None:
+            tx.written |= tables
+        else:
+            note_write()
+            cache.report_cache.invalidate(tables)
+
+    @contextmanager
+    def _atomic(self):
+        """Ligação com autocommit desligado; commit no fim ou rollback em erro.
+
+        Dentro de `transaction()` usa a ligação da transação e não faz commit.
+        """
+        tx = _current_transaction(self.pool)
+        if tx is not None:
+            yield tx.conn
+            return
+
+        with self.connection() as conn:
+            conn.autocommit = False
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                # Inclui GeneratorExit (ex: `iter_query` fechado a meio): sem rollback o
+                # autocommit não pode ser reposto com a transação aberta.
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                if not conn.closed:
+                    conn.autocommit = True
+
+    @staticmethod
+    def _fetch_frame(conn, query, params, typed: bool, m, timeout_ms: Optional[int] = None) -> pd.DataFrame:
+        sql = _statement_for(conn, query)
+        prefix = _timeout_prefix(conn, timeout_ms)
+        # Se o servidor não cortar (ex: rede), o cliente pede o cancelamento.
+        with _watch(conn, timeout_ms):
+            if not typed:
+                df = pd.read_sql_query(prefix + sql, conn, params=params)
+            else:
+                cursor = conn.cursor()
+                psycopg2.extensions.register_type(_NUMERIC_AS_FLOAT, cursor)
+                cursor.execute(prefix + sql, params)
+                if cursor.description is None:
+                    df = pd.DataFrame()
+                else:
+                    df = typed_frame(cursor.description, cursor.fetchall())
+                cursor.close()
+        m.rows = len(df)
+        m.bytes = int(df.memory_usage(index=False).sum()) if len(df.columns) else 0
+        return df
+
+    def _query_replica(self, query, params, typed: bool, timeout_ms: Optional[int]) -> Optional[pd.DataFrame]:
+        """Tenta a query na réplica; None se não houver réplica utilizável (usa-se o primário)."""
+        if self.conn is not None or self.in_transaction:
+            return None
+        replica = get_replica()
+        if replica is None or not replica.usable():
+            return None
+        try:
+            conn = replica.pool.getconn()
+        except Exception as e:
+            replica.mark_down(e)
+            return None
+        try:
+            with query_stats.track("query@replica", getattr(query, "sql", query)) as m:
+                df = self._fetch_frame(conn, query, params, typed, m, timeout_ms)
+            replica.routed += 1
+            return df
+        except psycopg2.extensions.QueryCanceledError:
+            # Timeout: repetir no primário só agravaria a espera
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Ligação perdida ou query cancelada por conflito com a recuperação
+            replica.mark_down(e)
+            print(f"Réplica indisponível, a usar o primário: {e}")
+            return None
+        finally:
+            replica.pool.putconn(conn)
+
+    def execute_query(
+        self,
+        query: Union[str, NamedQuery],
+        params: Union[tuple, dict, None] = None,
+        typed: bool = True,
+        read_only: bool = False,
+        timeout_ms: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """Executa query e retorna DataFrame.
+
+        Por omissão as colunas vêm com dtypes nativos (ver `typed_frame`); com
+        `typed=False` mantém-se o comportamento do `pd.read_sql_query` (Decimal/object).
+
+        `query` pode ser uma `NamedQuery` (ver `register_query`), preparada uma vez
+        por ligação.
+
+        `read_only=True` (relatórios) permite ler da réplica, se configurada e com
+        atraso aceitável; fora de transações e depois da janela de read-your-writes.
+        Caso contrário, ou se a réplica falhar, lê do primário.
+
+        `timeout_ms` limita a execução no servidor (`statement_timeout`, com `cancel()`
+        do cliente como salvaguarda); com um orçamento de página ativo (`set_page_budget`)
+        usa-se o menor dos dois. Uma query cancelada devolve DataFrame vazio, como
+        qualquer outro erro.
+        """
+        budget = _page_budget.get()
+        try:
+            timeout_ms = self._effective_timeout(timeout_ms, budget)
+            if read_only:
+                df = self._query_replica(query, params, typed, timeout_ms)
+                if df is not None:
+                    self.last_error = None
+                    return df
+            with self.connection() as conn, query_stats.track("query", getattr(query, "sql", query)) as m:
+                df = self._fetch_frame(conn, query, params, typed, m, timeout_ms)
             self.last_error = None
             return df
         except Exception as e:
-            self.last_error = str(e)
-            print(f"Erro ao executar query: {e}")
+            if isinstance(e, psycopg2.extensions.QueryCanceledError) and budget is not None:
+                budget.record_timeout(getattr(query, "name", None) or query_stats.fingerprint(query)[:80])
+            self._error(e, "Erro ao executar query")
             return pd.DataFrame()
-    
+
+    @staticmethod
+    def _effective_timeout(timeout_ms: Optional[int], budget: Optional[PageBudget]) -> Optional[int]:
+        limits = [t for t in (timeout_ms, DB_TIMEOUT_CONFIG["statement_timeout_ms"]) if t]
+        if budget is not None:
+            remaining = budget.remaining_ms()
+            if remaining <= 0:
+                raise QueryTimeout("Orçamento de tempo da página esgotado; query não executada")
+            limits.append(remaining)
+        return min(limits) if limits else None
+
+    def execute_page(
+        self,
+        name: str,
+        query: str,
+        params: Optional[dict],
+        key: Tuple[str, ...],
+        cursor: Optional[tuple] = None,
+        page_size: int = 50,
+        read_only: bool = True,
+        timeout_ms: Optional[int] = None,
+    ) -> KeysetPage:
+        """Página de `page_size` linhas a seguir a `cursor` (paginação por chave, sem OFFSET).
+
+        `query` ordena por `key` descendente (ex: `e.data_pedido DESC, e.id DESC`), tem
+        `{keyset}` no WHERE e termina em `LIMIT %(limite)s`. A partir da 2.ª página o
+        `{keyset}` passa a `(e.data_pedido, e.id) < (cursor)`, que o índice composto resolve
+        sem ler as páginas anteriores. Com o mesmo `name` ficam registadas duas `NamedQuery`
+        (1.ª página e seguintes). Pede-se uma linha a mais para saber se há seguinte.
+        """
+        if cursor is None:
+            nq = register_query(name, query.replace("{keyset}", "TRUE"))
+            params = dict(params or {})
+        else:
+            cols = ", ".join(key)
+            marks = ", ".join(f"%(apos_{i})s" for i in range(len(key)))
+            nq = register_query(f"{name}.seguinte", query.replace("{keyset}", f"({cols}) < ({marks})"))
+            params = dict(params or {}, **{f"apos_{i}": v for i, v in enumerate(cursor)})
+        params["limite"] = int(page_size) + 1
+
+        df = self.execute_query(nq, params, read_only=read_only, timeout_ms=timeout_ms)
+        if len(df) <= page_size:
+            return KeysetPage(df, None)
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        return KeysetPage(df, tuple(_cursor_value(last[k.split(".")[-1]]) for k in key))
+
+    def estimate_count(self, query: str, params: Union[tuple, dict, None] = None) -> Optional[int]:
+        """Nº de linhas estimado pelo planner (`EXPLAIN`), sem executar a query.
+
+        Para mostrar "~N resultados" numa lista paginada: um `COUNT(*)` exato custa
+        tanto como ler a lista toda. Devolve None em caso de erro.
+        """
+        sql = getattr(query, "sql", query)
+        try:
+            with self.connection() as conn, query_stats.track("explain", sql):
+                cursor = conn.cursor()
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+                cursor.close()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            self.last_error = None
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except Exception as e:
+            self._error(e, "Erro ao estimar contagem")
+            return None
+
+    def iter_query(
+        self,
+        query: str,
+        params: Optional[tuple] = None,
+        chunk_size: int = 10_000,
+        as_frame: bool = True,
+        typed: bool = True,
+        on_columns: Optional[Callable[[list], None]] = None,
+    ) -> Iterator:
+        """Executa query com cursor do lado do servidor e devolve o resultado aos bocados.
+
+        Cada iteração produz um DataFrame (ou, com `as_frame=False`, uma lista de tuplos)
+        com no máximo `chunk_size` linhas, pelo que a memória usada não depende do
+        tamanho da tabela. A ligação fica emprestada até o iterador ser consumido ou
+        fechado.
+
+        Ao contrário de `execute_query`, os erros são propagados: um export truncado
+        em silêncio seria pior do que uma falha.
+
+        `on_columns`, se dado, recebe os nomes das colunas logo após o primeiro fetch,
+        mesmo que a query não devolva linhas.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size tem de ser >= 1")
+
+        # Só conta o tempo passado na BD (execute/fetch), não o de quem consome os chunks.
+        db_time = 0.0
+        total_rows = 0
+        total_bytes = 0
+        error = None
+        try:
+            with self._atomic() as conn:
+                cursor = conn.cursor(name=f"firma_stream_{next(_cursor_ids)}")
+                cursor.itersize = chunk_size
+                if typed:
+                    psycopg2.extensions.register_type(_NUMERIC_AS_FLOAT, cursor)
+                try:
+                    t = time.perf_counter()
+                    cursor.execute(query, params)
+                    db_time += time.perf_counter() - t
+                    columns = None
+                    while True:
+                        t = time.perf_counter()
+                        rows = cursor.fetchmany(chunk_size)
+                        db_time += time.perf_counter() - t
+                        if on_columns is not None:
+                            on_columns([d.name for d in cursor.description])
+                            on_columns = None
+                        if not rows:
+                            break
+                        total_rows += len(rows)
+                        if not as_frame:
+                            yield rows
+                            continue
+                        if typed:
+                            chunk = typed_frame(cursor.description, rows)
+                        else:
+                            if columns is None:
+                                columns = [d.name for d in cursor.description]
+                            chunk = pd.DataFrame.from_records(rows, columns=columns)
+                        total_bytes += int(chunk.memory_usage(index=False).sum())
+                        yield chunk
+                finally:
+                    if not cursor.closed and not conn.closed:
+                        cursor.close()
+            self.last_error = None
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            error = str(e)
+            self._error(e, "Erro ao executar query (streaming)")
+            raise
+        finally:
+            query_stats.stats.record("stream", query, db_time, total_rows, total_bytes, error=error)
+
+    def export_csv(
+        self,
+        query: str,
+        file_path: str,
+        params: Optional[tuple] = None,
+        chunk_size: int = 10_000,
+    ) -> int:
+        """Exporta o resultado de uma query para CSV em memória limitada. Devolve o nº de linhas."""
+        total = 0
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            # Cabeçalho a partir da descrição do cursor: sai mesmo sem linhas
+            header = csv.writer(f, lineterminator=os.linesep).writerow
+            for chunk in self.iter_query(query, params, chunk_size=chunk_size, on_columns=header):
+                chunk.to_csv(f, header=False, index=False)
+                total += len(chunk)
+        return total
+
     def execute_update(self, query: str, params: Optional[tuple] = None) -> bool:
         """Executa query de atualização (INSERT, UPDATE, DELETE)"""
-        if not self.conn:
-            self.connect()
-        
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query, params)
-            self.conn.commit()
-            cursor.close()
+            with self.connection() as conn, query_stats.track("update", query) as m:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                m.rows = cursor.rowcount
+                cursor.close()
+            self._invalidate(query)
             self.last_error = None
             return True
         except Exception as e:
-            self.last_error = str(e)
-            print(f"Erro ao executar atualização: {e}")
-            self.conn.rollback()
+            self._error(e, "Erro ao executar atualização")
             return False
 
     def execute_returning(self, query: str, params: Optional[tuple] = None):
         """Executa INSERT/UPDATE ... RETURNING e devolve o valor retornado (primeira coluna da primeira linha)."""
-        if not self.conn:
-            self.connect()
-
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(query, params)
-            row = cursor.fetchone()
-            self.conn.commit()
-            cursor.close()
+            with self.connection() as conn, query_stats.track("returning", query) as m:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                row = cursor.fetchone()
+                m.rows = cursor.rowcount
+                cursor.close()
+            self._invalidate(query)
             self.last_error = None
             if not row:
                 return None
             return row[0]
         except Exception as e:
-            self.last_error = str(e)
-            print(f"Erro ao executar returning: {e}")
-            self.conn.rollback()
+            self._error(e, "Erro ao executar returning")
             return None
 
-    def execute_many(self, statements: List[Tuple[str, Optional[tuple]]]) -> bool:
-        """Executa múltiplas queries numa transação."""
-        if not self.conn:
-            self.connect()
+    def execute_many(
+        self,
+        statements: List[Tuple[str, Optional[tuple]]],
+        page_size: Optional[int] = None,
+    ) -> bool:
+        """Executa múltiplas queries numa transação.
 
+        Instruções consecutivas com o mesmo SQL são enviadas em lotes de `page_size`
+        (`execute_batch`), i.e. um round-trip por lote em vez de um por instrução.
+        """
+        page_size = page_size or DB_BATCH_PAGE_SIZE
         try:
-            cursor = self.conn.cursor()
-            for query, params in statements:
-                cursor.execute(query, params)
-            self.conn.commit()
-            cursor.close()
+            with self._atomic() as conn:
+                cursor = conn.cursor()
+                for query, group in itertools.groupby(statements, key=lambda st: st[0]):
+                    params_list = [params for _, params in group]
+                    with query_stats.track("many", query) as m:
+                        if len(params_list) == 1:
+                            cursor.execute(query, params_list[0])
+                        else:
+                            psycopg2.extras.execute_batch(cursor, query, params_list, page_size=page_size)
+                        m.rows = len(params_list)
+                cursor.close()
+            for query in {query for query, _ in statements}:
+                self._invalidate(query)
             self.last_error = None
             return True
         except Exception as e:
-            self.last_error = str(e)
-            print(f"Erro ao executar transação: {e}")
-            self.conn.rollback()
+            self._error(e, "Erro ao executar transação")
+            return False
+
+    def execute_values(
+        self,
+        query: str,
+        rows: List[tuple],
+        template: Optional[str] = None,
+        page_size: Optional[int] = None,
+    ) -> bool:
+        """Insere várias linhas com `INSERT ... VALUES %s` multi-linha, numa transação.
+
+        `query` tem um único `%s` no lugar da lista VALUES; cada página de `page_size`
+        linhas segue num só statement (`psycopg2.extras.execute_values`).
+        """
+        if not rows:
+            return True
+        try:
+            with self._atomic() as conn:
+                cursor = conn.cursor()
+                with query_stats.track("many", query) as m:
+                    psycopg2.extras.execute_values(
+                        cursor, query, rows, template=template, page_size=page_size or DB_BATCH_PAGE_SIZE
+                    )
+                    m.rows = len(rows)
+                cursor.close()
+            self._invalidate(query)
+            self.last_error = None
+            return True
+        except Exception as e:
+            self._error(e, "Erro ao executar inserção em lote")
             return False
 
     def execute_sql_file(self, file_path: str) -> bool:
@@ -111,9 +1399,6 @@ class Database:
 
         Útil em Windows quando `psql` não está no PATH.
         """
-        if not self.conn:
-            self.connect()
-
         def _read_text(path: str) -> str:
             for enc in ("utf-8-sig", "utf-8", "cp1252", "latin-1"):
                 try:
@@ -126,19 +1411,18 @@ class Database:
 
         try:
             sql = _read_text(file_path)
-            cursor = self.conn.cursor()
-            cursor.execute(sql)
-            self.conn.commit()
-            cursor.close()
+            with self._atomic() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql)
+                cursor.close()
+            self._invalidate()
             self.last_error = None
             return True
         except Exception as e:
-            self.last_error = str(e)
-            print(f"Erro ao executar ficheiro SQL ({file_path}): {e}")
-            self.conn.rollback()
+            self._error(e, f"Erro ao executar ficheiro SQL ({file_path})")
             return False
 
 
 def get_database() -> Database:
-    """Retorna instância de Database"""
-    return Database()
\ No newline at end of file
+    """Retorna instância de Database ligada ao pool partilhado do processo"""
+    return Database()
@@ -1,7 +1,9 @@
 import pandas as pd
-from database import get_database
+from cache import cached_report
+from database import get_database, register_query
 
 
+@cached_report(ttl=60, tables=("encomendas", "orcamentos", "clientes", "produtos", "tipos_produto"))
 def get_entregas_pendentes() -> pd.DataFrame:
     """Retorna entregas pendentes"""
     db = get_database()
@@ -29,9 +31,10 @@ def get_entregas_pendentes() -> pd.DataFrame:
     ORDER BY e.data_entrega_prometida
     """
     
-    return db.execute_query(query)
+    return db.execute_query(register_query("delivery.entregas_pendentes", query), read_only=True)
 
 
+@cached_report(ttl=300, tables=("encomendas", "orcamentos", "produtos", "tipos_produto"))
 def get_performance_entregas() -> pd.DataFrame:
     """Análise de performance de entregas"""
     db = get_database()
@@ -55,14 +58,15 @@ def get_performance_entregas() -> pd.DataFrame:
     ORDER BY total_entregas DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
 
 
 def get_entregas_por_regiao() -> pd.DataFrame:
     """(Legacy) Entregas por região.
 
     Nota: historicamente esta função usava `c.morada` inteira como 'regiao'.
-    Mantemos por compatibilidade, mas o recomendado é usar `get_entregas_por_cidade()`.
+    Mantemos por compatibilidade (agora pela coluna `clientes.cidade`), mas o
+    recomendado é usar `get_entregas_por_cidade()`.
     """
     df = get_entregas_por_cidade()
     if not df.empty and "cidade" in df.columns:
@@ -70,69 +74,39 @@ def get_entregas_por_regiao() -> pd.DataFrame:
     return df
 
 
+@cached_report(ttl=300, tables=("encomendas", "orcamentos", "clientes"))
 def get_entregas_por_cidade() -> pd.DataFrame:
-    """Entregas agrupadas por cidade (extraída da morada do cliente).
+    """Entregas agrupadas por cidade do cliente.
 
-    Heurística: usa o último segmento da morada (separado por vírgula/linha) e remove
-    um possível código postal no início (ex: '4800-000 Guimarães' -> 'Guimarães').
+    `clientes.cidade` é extraída da morada na escrita (coluna gerada, ver sql/schema.sql),
+    pelo que aqui é um simples GROUP BY.
     """
     db = get_database()
 
     query = """
-    WITH base AS (
-        SELECT
-            e.id AS encomenda_id,
-            e.status,
-            e.data_entrega_prometida,
-            e.data_entrega_real,
-            e.valor_total,
-            c.morada,
-            regexp_split_to_array(COALESCE(c.morada, ''), E'[,\\n]+') AS parts
-        FROM encomendas e
-        JOIN orcamentos o ON e.orcamento_id = o.id
-        JOIN clientes c ON o.cliente_id = c.id
-    ), norm AS (
-        SELECT
-            encomenda_id,
-            status,
-            data_entrega_prometida,
-            data_entrega_real,
-            valor_total,
-            COALESCE(
-                NULLIF(
-                    btrim(
-                        regexp_replace(
-                            parts[array_length(parts, 1)],
-                            '^[0-9]{4}-[0-9]{3}\\s*',
-                            ''
-                        )
-                    ),
-                    ''
-                ),
-                'Sem cidade'
-            ) AS cidade
-        FROM base
-    )
     SELECT
-        cidade,
+        COALESCE(c.cidade, 'Sem cidade') AS cidade,
         COUNT(*) AS num_entregas,
-        COUNT(CASE WHEN status = 'concluido' THEN 1 END) AS concluidas,
-        ROUND(AVG(CASE WHEN data_entrega_real IS NOT NULL
-                       THEN data_entrega_real - data_entrega_prometida END), 1) AS atraso_medio_dias,
-        ROUND(AVG(valor_total), 2) AS custo_medio_entrega
-    FROM norm
-    GROUP BY cidade
+        COUNT(CASE WHEN e.status = 'concluido' THEN 1 END) AS concluidas,
+        ROUND(AVG(CASE WHEN e.data_entrega_real IS NOT NULL
+                       THEN e.data_entrega_real - e.data_entrega_prometida END), 1) AS atraso_medio_dias,
+        ROUND(AVG(e.valor_total), 2) AS custo_medio_entrega
+    FROM encomendas e
+    JOIN orcamentos o ON e.orcamento_id = o.id
+    JOIN clientes c ON o.cliente_id = c.id
+    GROUP BY COALESCE(c.cidade, 'Sem cidade')
     ORDER BY num_entregas DESC
     """
 
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
 
 
+@cached_report(ttl=60, tables=("encomendas", "orcamentos", "clientes", "produtos", "tipos_produto"))
 def get_timeline_entregas(dias: int = 30) -> pd.DataFrame:
     """Timeline de entregas próximas"""
     db = get_database()
     
-    query = f"""
+    query = """
     SELECT 
         e.data_entrega_prometida AS data_prevista,
         c.nome AS cliente,
@@ -145,14 +119,15 @@ def get_timeline_entregas(dias: int = 30) -> pd.DataFrame:
     JOIN clientes c ON o.cliente_id = c.id
     JOIN produtos p ON o.produto_id = p.id
     JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
-    WHERE e.data_entrega_prometida BETWEEN CURRENT_DATE AND CURRENT_DATE + INTERVAL '{dias} days'
+    WHERE e.data_entrega_prometida BETWEEN CURRENT_DATE AND CURRENT_DATE + make_interval(days => %s)
         AND e.status != 'concluido'
     ORDER BY e.data_entrega_prometida
     """
     
-    return db.execute_query(query)
+    return db.execute_query(register_query("delivery.timeline_entregas", query), (int(dias),), read_only=True)
 
 
+@cached_report(ttl=300, tables=("encomendas", "orcamentos", "produtos", "tipos_produto"))
 def get_custos_logistica() -> pd.DataFrame:
     """Análise de custos de logística"""
     db = get_database()
@@ -173,4 +148,4 @@ def get_custos_logistica() -> pd.DataFrame:
     ORDER BY custo_total DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
@@ -0,0 +1,274 @@
+import pandas as pd
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+from cache import cached_report
+from database import KeysetPage, get_database, register_query
+
+
+LISTA_TIMEOUT_MS = 5_000
+
+_FROM_LISTA = """
+    FROM encomendas e
+    JOIN clientes c ON e.cliente_id = c.id
+    JOIN produtos p ON e.produto_id = p.id
+    JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
+"""
+
+# Condição de cada filtro; só entram na query os filtros definidos (ver `_where_lista`)
+_CONDICOES_LISTA = {
+    "status": "e.status = ANY(%(status)s::text[])",
+    "data_de": "e.data_pedido >= %(data_de)s::date",
+    "data_ate": "e.data_pedido <= %(data_ate)s::date",
+    "busca": "(c.nome ILIKE %(busca)s::text OR tp.nome ILIKE %(busca)s::text)",
+}
+
+_COLUNAS_LISTA = """
+    SELECT
+        e.id,
+        c.nome AS cliente,
+        tp.nome AS produto,
+        e.data_pedido,
+        e.data_entrega_prometida,
+        e.status,
+        e.prioridade,
+        e.valor_total
+"""
+
+
+def _filtros(status, data_de, data_ate, busca) -> dict:
+    """Parâmetros dos filtros definidos (os vazios ficam de fora)."""
+    filtros = {
+        "status": list(status) if status else None,
+        "data_de": data_de,
+        "data_ate": data_ate,
+        "busca": f"%{busca}%" if busca else None,
+    }
+    return {k: v for k, v in filtros.items() if v is not None}
+
+
+def _where_lista(filtros: dict) -> str:
+    """WHERE só com os filtros definidos.
+
+    Uma instrução por combinação de filtros, em vez de `(%(x)s IS NULL OR ...)`: o plano
+    genérico de uma query preparada com esses predicados não usaria os índices de
+    estado/data, e as páginas filtradas passariam a ler a tabela toda.
+    """
+    condicoes = [_CONDICOES_LISTA[k] for k in _CONDICOES_LISTA if k in filtros]
+    return "    WHERE " + "\n      AND ".join(condicoes or ["TRUE"]) + "\n"
+
+
+def pagina_encomendas(
+    status: Optional[list[str]] = None,
+    data_de: Optional[date] = None,
+    data_ate: Optional[date] = None,
+    busca: Optional[str] = None,
+    cursor: Optional[tuple] = None,
+    por_pagina: int = 50,
+) -> KeysetPage:
+    """Uma página da lista de encomendas (mais recentes primeiro), a seguir a `cursor`.
+
+    Paginação por (data_pedido, id) sobre `idx_encomendas_data_id`: cada página custa
+    o mesmo, qualquer que seja a posição na lista. `cursor` é o `next_cursor` da página
+    anterior (None = primeira página).
+    """
+    db = get_database()
+    filtros = _filtros(status, data_de, data_ate, busca)
+    query = (
+        _COLUNAS_LISTA + _FROM_LISTA + _where_lista(filtros)
+        + "      AND {keyset}\n    ORDER BY e.data_pedido DESC, e.id DESC\n    LIMIT %(limite)s\n"
+    )
+    return db.execute_page(
+        # Nome por combinação de filtros: cada uma é uma instrução preparada distinta
+        "encomendas.pagina[" + ",".join(filtros) + "]",
+        query,
+        filtros,
+        key=("e.data_pedido", "e.id"),
+        cursor=cursor,
+        page_size=por_pagina,
+        read_only=False,
+        timeout_ms=LISTA_TIMEOUT_MS,
+    )
+
+
+@cached_report(ttl=60, tables=("encomendas", "clientes", "produtos", "tipos_produto"))
+def estimar_encomendas(
+    status: Optional[tuple] = None,
+    data_de: Optional[date] = None,
+    data_ate: Optional[date] = None,
+    busca: Optional[str] = None,
+) -> Optional[int]:
+    """Nº aproximado de encomendas que passam os filtros (estimativa do planner, sem COUNT)."""
+    db = get_database()
+    filtros = _filtros(status, data_de, data_ate, busca)
+    return db.estimate_count("SELECT 1" + _FROM_LISTA + _where_lista(filtros), filtros)
+
+
+ESTADOS = ("pendente", "em_producao", "aguarda_material", "concluido", "entregue", "cancelado")
+KANBAN_ESTADOS = ("pendente", "aguarda_material", "em_producao", "concluido", "entregue")
+KANBAN_POR_COLUNA = 25
+
+
+@cached_report(ttl=30, tables=("encomendas", "clientes"))
+def get_kanban(estados: tuple = KANBAN_ESTADOS, por_coluna: int = KANBAN_POR_COLUNA) -> pd.DataFrame:
+    """Cartões do Kanban: as `por_coluna` encomendas mais recentes de cada estado.
+
+    Uma linha por cartão, com `total` = nº de encomendas nesse estado (para o cabeçalho
+    da coluna). Cada coluna é um `LATERAL ... LIMIT` sobre `idx_encomendas_status_data`,
+    pelo que o resultado tem no máximo `len(estados) * por_coluna` linhas e não depende
+    do histórico. Estados sem encomendas não aparecem.
+    """
+    db = get_database()
+    query = """
+    WITH contagem AS (
+        SELECT status, COUNT(*) AS total
+        FROM encomendas
+        WHERE status = ANY(%(estados)s::text[])
+        GROUP BY status
+    )
+    SELECT k.status, k.total, card.id, card.cliente, card.data_pedido, card.prioridade, card.valor_total
+    FROM contagem k
+    CROSS JOIN LATERAL (
+        SELECT e.id, c.nome AS cliente, e.data_pedido, e.prioridade, e.valor_total
+        FROM encomendas e
+        JOIN clientes c ON e.cliente_id = c.id
+        WHERE e.status = k.status
+        ORDER BY e.data_pedido DESC, e.id DESC
+        LIMIT %(por_coluna)s
+    ) card
+    ORDER BY k.status, card.data_pedido DESC, card.id DESC
+    """
+    params = {"estados": list(estados), "por_coluna": int(por_coluna)}
+    return db.execute_query(register_query("encomendas.kanban", query), params, read_only=True)
+
+
+def mover_encomendas(ids: list[int], novo_status: str) -> bool:
+    """Muda o estado de várias encomendas numa só instrução (o trigger regista um evento por encomenda)."""
+    if novo_status not in ESTADOS:
+        raise ValueError(f"Estado inválido: {novo_status}")
+    if not ids:
+        return True
+    db = get_database()
+    return db.execute_update(
+        "UPDATE encomendas SET status = %s WHERE id = ANY(%s) AND status <> %s",
+        (novo_status, [int(i) for i in ids], novo_status),
+    )
+
+
+@dataclass
+class EncomendaDetail:
+    """Dados da secção Detalhe de uma encomenda (ver `get_encomenda_detail`)."""
+
+    id: int
+    cabecalho: dict
+    materiais: pd.DataFrame
+    etapas: pd.DataFrame
+    gantt: pd.DataFrame
+    faturas: pd.DataFrame
+    documentos: pd.DataFrame
+    eventos: pd.DataFrame
+
+    @property
+    def status(self) -> str:
+        return self.cabecalho["status"]
+
+
+# secção -> (colunas, colunas de data/hora); as datas chegam do JSON como texto ISO
+_SECOES_DETALHE = {
+    "materiais": (
+        ["encomenda_id", "material", "tipo", "unidade", "qtd_planeada", "qtd_real", "variacao", "variacao_pct", "custo_real"],
+        [],
+    ),
+    "etapas": (
+        ["etapa_id", "tipo_etapa", "tempo_estimado", "tempo_real", "responsavel", "status", "data_inicio", "data_fim", "eficiencia_pct"],
+        ["data_inicio", "data_fim"],
+    ),
+    "gantt": (["etapa_id", "tipo_etapa", "responsavel", "start", "finish", "status"], ["start", "finish"]),
+    "faturas": (["id", "num_fatura", "status", "valor_total", "valor_pago", "saldo"], []),
+    "documentos": (["id", "tipo", "nome_arquivo", "caminho_arquivo", "criado_em"], ["criado_em"]),
+    "eventos": (["criado_em", "tipo_evento", "descricao", "usuario"], ["criado_em"]),
+}
+
+
+def _secao(registos: Optional[list], colunas: list, datas: list) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(registos or [], columns=colunas)
+    for col in datas:
+        df[col] = pd.to_datetime(df[col], format="ISO8601")
+    return df
+
+
+def get_encomenda_detail(encomenda_id: int) -> Optional[EncomendaDetail]:
+    """Carrega todas as secções do Detalhe de uma encomenda numa só instrução.
+
+    Cada secção é uma CTE agregada com `json_agg`, pelo que cabeçalho, materiais,
+    etapas, faturas, documentos e eventos chegam num único round-trip (e numa única
+    ligação do pool). Devolve None se a encomenda não existir ou em caso de erro.
+    """
+    db = get_database()
+    query = """
+    WITH cab AS (
+        SELECT
+            e.*, c.nome AS cliente_nome, c.email AS cliente_email, c.contacto AS cliente_contacto,
+            tp.nome AS produto_tipo, p.codigo AS produto_codigo
+        FROM encomendas e
+        JOIN clientes c ON e.cliente_id = c.id
+        JOIN produtos p ON e.produto_id = p.id
+        JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
+        WHERE e.id = %(id)s
+    ),
+    mat AS (
+        SELECT encomenda_id, material, tipo, unidade, qtd_planeada, qtd_real, variacao, variacao_pct, custo_real
+        FROM vw_consumo_vs_planeado
+        WHERE encomenda_id = %(id)s
+    ),
+    etp AS (
+        SELECT
+            id AS etapa_id,
+            tipo_etapa,
+            tempo_estimado,
+            tempo_real,
+            responsavel,
+            status,
+            data_inicio,
+            data_fim,
+            ROUND((tempo_real / NULLIF(tempo_estimado, 0)) * 100, 1) AS eficiencia_pct,
+            COALESCE(data_inicio, CURRENT_TIMESTAMP) AS start,
+            COALESCE(data_fim, CURRENT_TIMESTAMP) AS finish
+        FROM etapas_producao
+        WHERE encomenda_id = %(id)s
+    ),
+    fat AS (
+        SELECT id, num_fatura, status, valor_total, valor_pago, saldo
+        FROM faturas
+        WHERE encomenda_id = %(id)s
+    ),
+    docs AS (
+        SELECT id, tipo, nome_arquivo, caminho_arquivo, criado_em
+        FROM encomenda_documentos
+        WHERE encomenda_id = %(id)s
+    ),
+    evt AS (
+        SELECT criado_em, tipo_evento, descricao, usuario
+        FROM encomenda_eventos
+        WHERE encomenda_id = %(id)s
+    )
+    SELECT
+        (SELECT row_to_json(cab) FROM cab) AS cabecalho,
+        (SELECT json_agg(mat ORDER BY mat.custo_real DESC) FROM mat) AS materiais,
+        (SELECT json_agg(etp ORDER BY etp.etapa_id) FROM etp) AS etapas,
+        (SELECT json_agg(json_build_object(
+            'etapa_id', etapa_id, 'tipo_etapa', tipo_etapa, 'responsavel', responsavel,
+            'start', start, 'finish', finish, 'status', status
+        ) ORDER BY etapa_id) FROM etp) AS gantt,
+        (SELECT json_agg(fat ORDER BY fat.id DESC) FROM fat) AS faturas,
+        (SELECT json_agg(docs ORDER BY docs.criado_em DESC) FROM docs) AS documentos,
+        (SELECT json_agg(evt ORDER BY evt.criado_em DESC) FROM evt) AS eventos
+    """
+    df = db.execute_query(register_query("encomendas.detalhe", query), {"id": int(encomenda_id)})
+    if df.empty or df.iloc[0]["cabecalho"] is None:
+        return None
+
+    row = df.iloc[0]
+    secoes = {nome: _secao(row[nome], colunas, datas) for nome, (colunas, datas) in _SECOES_DETALHE.items()}
+    return EncomendaDetail(id=int(encomenda_id), cabecalho=row["cabecalho"], **secoes)
@@ -0,0 +1,203 @@
+"""Previsão de consumo de materiais a partir do histórico diário de saídas.
+
+O consumo diário de todos os materiais vem numa só query (`movimentos_stock_diario`)
+e é posto numa matriz materiais × dias. Os modelos são ajustados para todos os
+materiais ao mesmo tempo com operações NumPy sobre a matriz (o único ciclo Python é
+sobre os dias):
+
+- suavização exponencial simples (SES) para consumo regular;
+- Croston para consumo intermitente (muitos dias sem saídas), escolhido pelo
+  intervalo médio entre consumos (ADI > 1,32).
+
+O alfa de cada material é o da grelha `ALFAS` com menor erro quadrático das previsões
+a um dia. Com o desvio desses erros calcula-se o stock de segurança para o nível de
+serviço pedido e o ponto de encomenda (consumo previsto durante o lead time + stock
+de segurança).
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import FORECAST_CONFIG
+
+try:
+    from cache import cached_report
+    from database import get_database
+except ModuleNotFoundError:
+    from src.cache import cached_report
+    from src.database import get_database
+
+
+ALFAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+# Intervalo médio entre consumos acima do qual o consumo é tratado como intermitente
+ADI_INTERMITENTE = 1.32
+# Dias usados para o nível inicial da SES
+_DIAS_INICIO = 7
+
+
+@dataclass
+class Ajuste:
+    """Resultado de `ajustar`, um valor por material (linha da matriz)."""
+
+    modelo: np.ndarray  # 'ses', 'croston' ou 'sem_historico'
+    alfa: np.ndarray
+    previsao_diaria: np.ndarray
+    desvio_diario: np.ndarray
+    stock_seguranca: np.ndarray
+    ponto_encomenda: np.ndarray
+
+
+def _ses(y: np.ndarray, alfas: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """SES para todos os alfas e materiais: (nível final (A, N), SSE a um dia (A, N))."""
+    a = alfas[:, None]
+    nivel = np.broadcast_to(y[:, :_DIAS_INICIO].mean(axis=1), (len(alfas), y.shape[0])).copy()
+    sse = np.zeros_like(nivel)
+    for t in range(y.shape[1]):
+        erro = y[:, t] - nivel
+        sse += erro * erro
+        nivel += a * erro
+    return nivel, sse
+
+
+def _croston(y: np.ndarray, alfas: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Croston para todos os alfas e materiais: (previsão final (A, N), SSE a um dia (A, N)).
+
+    Tamanho dos consumos (z) e intervalo entre eles (p) só são atualizados nos dias com
+    consumo. Começa no primeiro consumo de cada material; os erros contam a partir daí.
+    """
+    a = alfas[:, None]
+    n, dias = y.shape
+    com_consumo = y > 0
+    primeiro = np.where(com_consumo.any(axis=1), com_consumo.argmax(axis=1), dias)
+    linhas = np.arange(n)
+    z0 = np.where(primeiro < dias, y[linhas, np.minimum(primeiro, dias - 1)], 0.0)
+
+    z = np.broadcast_to(z0, (len(alfas), n)).copy()
+    p = np.broadcast_to(primeiro + 1.0, (len(alfas), n)).copy()
+    desde_ultimo = np.ones(n)
+    sse = np.zeros_like(z)
+    for t in range(dias):
+        nz = com_consumo[:, t]
+        erro = np.where(t > primeiro, y[:, t] - z / p, 0.0)
+        sse += erro * erro
+        z = np.where(nz, z + a * (y[:, t] - z), z)
+        p = np.where(nz, p + a * (desde_ultimo - p), p)
+        desde_ultimo = np.where(nz, 1.0, desde_ultimo + 1.0)
+    return z / p, sse
+
+
+def ajustar(y: np.ndarray, lead_time_dias: np.ndarray, nivel_servico: float = 0.95) -> Ajuste:
+    """Ajusta SES/Croston a cada linha de `y` (consumo diário, materiais × dias, do mais antigo)."""
+    y = np.asarray(y, dtype=float)
+    n, dias = y.shape
+    lead = np.asarray(lead_time_dias, dtype=float)
+    if dias == 0:
+        # Sem dias de histórico: nada a ajustar, todos os materiais ficam sem previsão
+        zeros = np.zeros(n)
+        return Ajuste(
+            modelo=np.full(n, "sem_historico"),
+            alfa=np.full(n, np.nan),
+            previsao_diaria=zeros,
+            desvio_diario=zeros,
+            stock_seguranca=zeros,
+            ponto_encomenda=zeros,
+        )
+
+    nivel_ses, sse_ses = _ses(y, ALFAS)
+    prev_cro, sse_cro = _croston(y, ALFAS)
+
+    consumos = (y > 0).sum(axis=1)
+    primeiro = np.where(consumos > 0, (y > 0).argmax(axis=1), dias)
+    adi = (dias - primeiro) / np.maximum(consumos, 1)
+    intermitente = adi > ADI_INTERMITENTE
+
+    i_ses = sse_ses.argmin(axis=0)
+    i_cro = sse_cro.argmin(axis=0)
+    linhas = np.arange(n)
+    previsao = np.where(intermitente, prev_cro[i_cro, linhas], nivel_ses[i_ses, linhas])
+    sse = np.where(intermitente, sse_cro[i_cro, linhas], sse_ses[i_ses, linhas])
+    erros = np.where(intermitente, np.maximum(dias - primeiro - 1, 1), max(dias, 1))
+    desvio = np.sqrt(sse / erros)
+
+    sem_historico = consumos == 0
+    previsao = np.where(sem_historico, 0.0, np.maximum(previsao, 0.0))
+    desvio = np.where(sem_historico, 0.0, desvio)
+
+    z = NormalDist().inv_cdf(nivel_servico)
+    stock_seguranca = z * desvio * np.sqrt(lead)
+    return Ajuste(
+        modelo=np.where(sem_historico, "sem_historico", np.where(intermitente, "croston", "ses")),
+        alfa=np.where(sem_historico, np.nan, np.where(intermitente, ALFAS[i_cro], ALFAS[i_ses])),
+        previsao_diaria=previsao,
+        desvio_diario=desvio,
+        stock_seguranca=stock_seguranca,
+        ponto_encomenda=previsao * lead + stock_seguranca,
+    )
+
+
+def get_consumo_diario(inicio: date, fim: date) -> pd.DataFrame:
+    """Saídas por material e dia entre `inicio` e `fim` (só os dias com movimentos)."""
+    db = get_database()
+    q = """
+    SELECT material_id, dia, saidas
+    FROM movimentos_stock_diario
+    WHERE dia BETWEEN %s AND %s
+    """
+    return db.execute_query(q, (inicio, fim), read_only=True)
+
+
+def matriz_consumo(df: pd.DataFrame, material_ids: np.ndarray, inicio: date, dias: int) -> np.ndarray:
+    """Matriz densa materiais × dias (zeros nos dias sem saídas) a partir de `get_consumo_diario`."""
+    y = np.zeros((len(material_ids), dias))
+    if df.empty:
+        return y
+    ordem = np.argsort(material_ids)
+    pos = np.searchsorted(material_ids, df["material_id"].to_numpy(), sorter=ordem)
+    pos = np.minimum(pos, len(material_ids) - 1)
+    linha = ordem[pos]
+    coluna = (pd.to_datetime(df["dia"]) - pd.Timestamp(inicio)).dt.days.to_numpy()
+    conhecido = (material_ids[linha] == df["material_id"].to_numpy()) & (coluna >= 0) & (coluna < dias)
+    y[linha[conhecido], coluna[conhecido]] = df["saidas"].to_numpy(dtype=float)[conhecido]
+    return y
+
+
+@cached_report(ttl=900, tables=("materiais", "movimentos_stock_diario"))
+def get_previsao_consumo(horizonte_dias: int = 30, historico_dias: int | None = None) -> pd.DataFrame:
+    """Previsão de consumo, stock de segurança e ponto de encomenda de cada material."""
+    historico_dias = int(historico_dias or FORECAST_CONFIG["historico_dias"])
+    if historico_dias < 1:
+        raise ValueError(f"historico_dias tem de ser >= 1 (recebido {historico_dias})")
+    db = get_database()
+    materiais = db.execute_query(
+        "SELECT id, nome, tipo, unidade, stock_atual, lead_time_dias FROM materiais ORDER BY id",
+        read_only=True,
+    )
+    if materiais.empty:
+        return pd.DataFrame()
+
+    # Até ontem: o dia de hoje ainda está incompleto
+    fim = date.today() - timedelta(days=1)
+    inicio = fim - timedelta(days=historico_dias - 1)
+    ids = materiais["id"].to_numpy()
+    y = matriz_consumo(get_consumo_diario(inicio, fim), ids, inicio, historico_dias)
+    aj = ajustar(y, materiais["lead_time_dias"].to_numpy(), FORECAST_CONFIG["nivel_servico"])
+
+    df = materiais.rename(columns={"id": "material_id"})
+    df["modelo"] = aj.modelo
+    df["alfa"] = aj.alfa
+    df["previsao_diaria"] = aj.previsao_diaria.round(3)
+    df["previsao_horizonte"] = (aj.previsao_diaria * horizonte_dias).round(2)
+    df["desvio_diario"] = aj.desvio_diario.round(3)
+    df["stock_seguranca"] = aj.stock_seguranca.round(2)
+    df["ponto_encomenda"] = aj.ponto_encomenda.round(2)
+    df["status"] = np.where(df["stock_atual"].to_numpy(dtype=float) <= aj.ponto_encomenda, "REPOR", "OK")
+    return df.sort_values(["status", "previsao_horizonte"], ascending=[False, False]).reset_index(drop=True)
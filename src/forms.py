@@ -110,21 +110,17 @@ def registar_movimento_stock(
     VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
     """
     
-    success = db.execute_update(
-        query,
-        (material_id, tipo_movimento, quantidade, motivo, encomenda_id, usuario),
-    )
-    
-    if success:
-        # Atualizar stock atual do material
-        if tipo_movimento == 'entrada':
-            update_query = "UPDATE materiais SET stock_atual = stock_atual + %s WHERE id = %s"
-        else:  # saída
-            update_query = "UPDATE materiais SET stock_atual = stock_atual - %s WHERE id = %s"
-        
-        db.execute_update(update_query, (quantidade, material_id))
+    # Atualizar stock atual do material
+    if tipo_movimento == 'entrada':
+        update_query = "UPDATE materiais SET stock_atual = stock_atual + %s WHERE id = %s"
+    else:  # saída
+        update_query = "UPDATE materiais SET stock_atual = stock_atual - %s WHERE id = %s"
     
-    return success
+    # Movimento e stock atual numa só transação: nunca fica um sem o outro
+    return db.execute_many([
+        (query, (material_id, tipo_movimento, quantidade, motivo, encomenda_id, usuario)),
+        (update_query, (quantidade, material_id)),
+    ])
 
 
 def get_lista_clientes() -> pd.DataFrame:
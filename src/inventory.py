@@ -1,7 +1,11 @@
+from datetime import date, datetime, time, timedelta
+
 import pandas as pd
-from database import get_database
+from cache import cached_report
+from database import get_database, register_query
 
 
+@cached_report(ttl=60, tables=("materiais", "fornecedores"))
 def get_stock_critico() -> pd.DataFrame:
     """Retorna materiais com stock crítico que precisam de reposição"""
     db = get_database()
@@ -24,56 +28,128 @@ def get_stock_critico() -> pd.DataFrame:
     ORDER BY custo_reposicao DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
+
+
+def _stock_sql(data_ref: date | None) -> tuple[str, dict]:
+    """SELECT (material_id, stock) atual ou no fim do dia `data_ref` (ver `fn_stock_em`)."""
+    if data_ref is None:
+        return "SELECT id AS material_id, stock_atual AS stock FROM materiais", {}
+    fim_do_dia = datetime.combine(data_ref + timedelta(days=1), time.min)
+    return "SELECT material_id, stock FROM fn_stock_em(%(em)s)", {"em": fim_do_dia}
 
 
-def get_valor_stock() -> pd.DataFrame:
-    """Calcula valor total de stock por tipo de material"""
+@cached_report(ttl=120, tables=("materiais", "movimentos_stock", "stock_snapshots"))
+def get_valor_stock(data_ref: date | None = None) -> pd.DataFrame:
+    """Calcula valor total de stock por tipo de material (atual, ou no fim do dia `data_ref`)
+
+    O valor à data usa o preço atual de cada material.
+    """
     db = get_database()
+    stock, params = _stock_sql(data_ref)
     
-    query = """
+    query = f"""
+    WITH s AS ({stock})
     SELECT 
         m.tipo,
         COUNT(*) AS num_materiais,
-        ROUND(SUM(m.stock_atual), 2) AS quantidade_total,
-        ROUND(SUM(m.stock_atual * m.preco_por_unidade), 2) AS valor_stock,
-        ROUND(AVG(m.stock_atual / NULLIF(m.stock_minimo, 0) * 100), 2) AS taxa_ocupacao_pct
+        ROUND(SUM(s.stock), 2) AS quantidade_total,
+        ROUND(SUM(s.stock * m.preco_por_unidade), 2) AS valor_stock,
+        ROUND(AVG(s.stock / NULLIF(m.stock_minimo, 0) * 100), 2) AS taxa_ocupacao_pct
     FROM materiais m
+    JOIN s ON s.material_id = m.id
     GROUP BY m.tipo
     ORDER BY valor_stock DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, params or None, read_only=True)
+
+
+@cached_report(ttl=120, tables=("materiais", "movimentos_stock", "stock_snapshots"))
+def get_stock_materiais(data_ref: date | None = None) -> pd.DataFrame:
+    """Stock e valor de cada material (atual, ou no fim do dia `data_ref`)"""
+    db = get_database()
+    stock, params = _stock_sql(data_ref)
+    
+    query = f"""
+    WITH s AS ({stock})
+    SELECT 
+        m.id,
+        m.nome,
+        m.tipo,
+        m.unidade,
+        ROUND(s.stock, 2) AS stock,
+        ROUND(s.stock * m.preco_por_unidade, 2) AS valor_stock
+    FROM materiais m
+    JOIN s ON s.material_id = m.id
+    ORDER BY m.tipo, m.nome
+    """
+    
+    return db.execute_query(query, params or None, read_only=True)
+
 
+def registar_snapshot_stock() -> bool:
+    """Regista o stock atual de todos os materiais (job `stock.snapshot`; ver `fn_stock_em`)"""
+    db = get_database()
+    return db.execute_update("SELECT fn_stock_snapshot()")
 
+
+@cached_report(ttl=300, tables=("materiais", "movimentos_stock_diario"))
 def get_rotatividade_materiais() -> pd.DataFrame:
-    """Análise de rotatividade de materiais"""
+    """Análise de rotatividade de materiais (últimos 3 meses), do resumo diário"""
     db = get_database()
     
     query = """
     SELECT 
         m.nome,
         m.tipo,
-        COUNT(ms.id) AS num_movimentos,
-        ROUND(SUM(CASE WHEN ms.tipo_movimento = 'saida' THEN ms.quantidade ELSE 0 END), 2) AS total_saidas,
-        ROUND(SUM(CASE WHEN ms.tipo_movimento = 'entrada' THEN ms.quantidade ELSE 0 END), 2) AS total_entradas,
+        COALESCE(SUM(d.num_movimentos), 0) AS num_movimentos,
+        ROUND(COALESCE(SUM(d.saidas), 0), 2) AS total_saidas,
+        ROUND(COALESCE(SUM(d.entradas), 0), 2) AS total_entradas,
         ROUND(m.stock_atual, 2) AS stock_atual,
         ROUND(m.stock_atual * m.preco_por_unidade, 2) AS valor_stock
     FROM materiais m
-    LEFT JOIN movimentos_stock ms ON m.id = ms.material_id
-        AND ms.data_movimento >= CURRENT_DATE - INTERVAL '3 months'
+    LEFT JOIN movimentos_stock_diario d ON m.id = d.material_id
+        -- Mesma janela de sempre: movimentos desde a meia-noite de há 3 meses
+        AND d.dia >= (CURRENT_DATE - INTERVAL '3 months')::date
     GROUP BY m.id, m.nome, m.tipo, m.stock_atual, m.preco_por_unidade
     ORDER BY total_saidas DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
+
+
+@cached_report(ttl=300, tables=("materiais", "movimentos_stock_diario"))
+def get_consumo_materiais(dias: int = 60) -> pd.DataFrame:
+    """Consumo médio diário (saídas) nos últimos `dias` dias e dias de cobertura do stock atual"""
+    db = get_database()
+    
+    query = """
+    SELECT 
+        m.nome,
+        m.tipo,
+        SUM(d.num_movimentos) AS num_movimentos,
+        ROUND(SUM(d.saidas), 2) AS total_consumido,
+        ROUND(SUM(d.saidas) / %(dias)s, 2) AS consumo_medio_diario,
+        ROUND(m.stock_atual, 2) AS stock_atual,
+        ROUND(m.stock_atual / NULLIF(SUM(d.saidas) / %(dias)s, 0), 1) AS dias_cobertura
+    FROM materiais m
+    JOIN movimentos_stock_diario d ON m.id = d.material_id
+    WHERE d.dia > CURRENT_DATE - %(dias)s
+    GROUP BY m.id, m.nome, m.tipo, m.stock_atual
+    HAVING SUM(d.saidas) > 0
+    ORDER BY dias_cobertura ASC
+    """
+    
+    return db.execute_query(query, {"dias": int(dias)}, read_only=True)
 
 
+@cached_report(ttl=300, tables=("materiais", "produtos_materiais", "produtos", "orcamentos"))
 def get_previsao_necessidades(dias: int = 30) -> pd.DataFrame:
     """Previsão de necessidades de materiais baseado em projetos futuros"""
     db = get_database()
     
-    query = f"""
+    query = """
     SELECT 
         m.nome AS material,
         m.tipo,
@@ -90,14 +166,15 @@ def get_previsao_necessidades(dias: int = 30) -> pd.DataFrame:
     JOIN produtos p ON pm.tipo_produto_id = p.tipo_produto_id
     JOIN orcamentos o ON p.id = o.produto_id
     WHERE o.status IN ('pendente', 'aprovado')
-        AND o.data_orcamento <= CURRENT_DATE + INTERVAL '{dias} days'
+        AND o.data_orcamento <= CURRENT_DATE + make_interval(days => %s)
     GROUP BY m.id, m.nome, m.tipo, m.stock_atual, m.stock_minimo
     ORDER BY saldo_previsto
     """
     
-    return db.execute_query(query)
+    return db.execute_query(register_query("inventory.previsao_necessidades", query), (int(dias),), read_only=True)
 
 
+@cached_report(ttl=300, tables=("fornecedores", "materiais"))
 def get_fornecedores_performance() -> pd.DataFrame:
     """Performance dos fornecedores"""
     db = get_database()
@@ -116,4 +193,4 @@ def get_fornecedores_performance() -> pd.DataFrame:
     ORDER BY valor_stock_fornecido DESC
     """
     
-    return db.execute_query(query)
\ No newline at end of file
+    return db.execute_query(query, read_only=True)
\ No newline at end of file
@@ -6,10 +6,14 @@ from typing import Optional
 
 import pandas as pd
 
+# Importar como `database` (e não `src.database`) para partilhar o mesmo pool de ligações
+# que os restantes módulos.
 try:
-    from src.database import get_database
+    from cache import cached_report
+    from database import KeysetPage, get_database
 except ModuleNotFoundError:
-    from database import get_database
+    from src.cache import cached_report
+    from src.database import KeysetPage, get_database
 
 
 DEFAULT_IVA = 23.00
@@ -23,9 +27,14 @@ def _has_table(table_name: str) -> bool:
     return df.iloc[0]["reg"] is not None
 
 
-def list_faturas(limit: int = 200) -> pd.DataFrame:
+def pagina_faturas(cursor: Optional[tuple] = None, por_pagina: int = 50) -> KeysetPage:
+    """Uma página da lista de faturas (mais recentes primeiro), a seguir a `cursor`.
+
+    Paginação por (data_emissao, id) sobre `idx_faturas_emissao_id`; `cursor` é o
+    `next_cursor` da página anterior (None = primeira página).
+    """
     db = get_database()
-    q = f"""
+    q = """
     SELECT
         f.id,
         f.num_fatura,
@@ -40,25 +49,39 @@ def list_faturas(limit: int = 200) -> pd.DataFrame:
         f.encomenda_id
     FROM faturas f
     JOIN clientes c ON f.cliente_id = c.id
+    WHERE {keyset}
     ORDER BY f.data_emissao DESC, f.id DESC
-    LIMIT {int(limit)}
+    LIMIT %(limite)s
     """
-    return db.execute_query(q)
+    return db.execute_page(
+        "invoicing.pagina_faturas", q, None, key=("f.data_emissao", "f.id"), cursor=cursor, page_size=por_pagina
+    )
 
 
+@cached_report(ttl=60, tables=("faturas",))
+def estimar_faturas() -> Optional[int]:
+    """Nº aproximado de faturas (estimativa do planner, sem COUNT)."""
+    db = get_database()
+    return db.estimate_count("SELECT 1 FROM faturas")
+
+
+# Relatórios de faturação: leem as vistas materializadas (ver `materialized_views`)
+@cached_report(ttl=60, tables=("mv_aging_report",))
 def get_aging_report() -> pd.DataFrame:
     db = get_database()
-    return db.execute_query("SELECT * FROM vw_aging_report")
+    return db.execute_query("SELECT * FROM mv_aging_report ORDER BY dias_em_divida DESC", read_only=True)
 
 
+@cached_report(ttl=300, tables=("mv_receita_faturada_vs_recebida",))
 def get_receita_faturada_vs_recebida() -> pd.DataFrame:
     db = get_database()
-    return db.execute_query("SELECT * FROM vw_receita_faturada_vs_recebida")
+    return db.execute_query("SELECT * FROM mv_receita_faturada_vs_recebida ORDER BY mes DESC", read_only=True)
 
 
+@cached_report(ttl=300, tables=("mv_cash_flow",))
 def get_cash_flow() -> pd.DataFrame:
     db = get_database()
-    return db.execute_query("SELECT * FROM vw_cash_flow")
+    return db.execute_query("SELECT * FROM mv_cash_flow ORDER BY mes DESC", read_only=True)
 
 
 def refresh_vencidas() -> bool:
@@ -106,12 +129,24 @@ def add_item(
     preco_unitario: float,
     taxa_iva: float = DEFAULT_IVA,
 ) -> bool:
+    return add_items(fatura_id, [(descricao, quantidade, preco_unitario, taxa_iva)])
+
+
+def add_items(
+    fatura_id: int,
+    itens: list[tuple[str, float, float, float]],
+) -> bool:
+    """Insere as linhas (descricao, quantidade, preco_unitario, taxa_iva) num único INSERT multi-linha."""
     db = get_database()
     q = """
     INSERT INTO itens_fatura (fatura_id, descricao, quantidade, preco_unitario, taxa_iva)
-    VALUES (%s, %s, %s, %s, %s)
+    VALUES %s
     """
-    return db.execute_update(q, (fatura_id, descricao, quantidade, preco_unitario, taxa_iva))
+    rows = [
+        (fatura_id, descricao, quantidade, preco_unitario, taxa_iva)
+        for descricao, quantidade, preco_unitario, taxa_iva in itens
+    ]
+    return db.execute_values(q, rows)
 
 
 def get_fatura_detail(fatura_id: int) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -260,26 +295,18 @@ def gerar_fatura_de_encomenda(
     cliente_id = int(row["cliente_id"])
     valor_total = float(row["valor_total"])
 
-    fatura_id = create_fatura(
-        cliente_id=cliente_id,
-        encomenda_id=int(row["encomenda_id"]),
-        vencimento=vencimento,
-        metodo_pagamento=metodo_pagamento,
-        status=status,
-    )
-
     preco_base = valor_total / (1.0 + (taxa_iva / 100.0))
     descricao = f"{row['tipo_produto']} ({row['codigo']}) - Encomenda #{encomenda_id}"
 
-    ok = add_item(
-        fatura_id=fatura_id,
-        descricao=descricao,
-        quantidade=1,
-        preco_unitario=round(preco_base, 2),
-        taxa_iva=taxa_iva,
-    )
-
-    if not ok:
-        raise RuntimeError("Falha ao inserir itens da fatura")
+    # Fatura e linhas numa só transação: nunca fica uma fatura sem itens.
+    with db.transaction():
+        fatura_id = create_fatura(
+            cliente_id=cliente_id,
+            encomenda_id=int(row["encomenda_id"]),
+            vencimento=vencimento,
+            metodo_pagamento=metodo_pagamento,
+            status=status,
+        )
+        add_items(fatura_id, [(descricao, 1, round(preco_base, 2), taxa_iva)])
 
     return fatura_id
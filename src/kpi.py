@@ -0,0 +1,42 @@
+"""KPIs da página inicial, pré-calculados em `kpi_snapshot` (um registo por dia).
+
+O job `kpi.snapshot` do agendador recalcula o registo do dia (`fn_kpi_snapshot_atualizar`,
+sql/schema.sql); a página só lê os últimos dias pela chave primária, sem correr os
+relatórios completos. Os dias anteriores ficam como histórico para as tendências.
+"""
+
+import pandas as pd
+
+try:
+    import cache
+    from cache import cached_report
+    from database import get_database
+except ModuleNotFoundError:
+    from src import cache
+    from src.cache import cached_report
+    from src.database import get_database
+
+
+KPIS = ("receita_total", "margem_media_pct", "materiais_criticos", "entregas_pendentes", "saldo_receber")
+
+
+def atualizar_snapshot() -> bool:
+    """Recalcula os KPIs de hoje (upsert no registo do dia)."""
+    db = get_database()
+    ok = db.execute_update("SELECT fn_kpi_snapshot_atualizar()")
+    # A função notifica os outros processos; neste basta invalidar diretamente.
+    cache.invalidate(["kpi_snapshot"])
+    return ok
+
+
+@cached_report(ttl=60, tables=("kpi_snapshot",))
+def get_kpi_historico(dias: int = 30) -> pd.DataFrame:
+    """KPIs dos últimos `dias` dias (por ordem de data); a última linha é o valor atual."""
+    db = get_database()
+    q = """
+    SELECT dia, receita_total, margem_media_pct, materiais_criticos, entregas_pendentes, saldo_receber, atualizado_em
+    FROM kpi_snapshot
+    WHERE dia > CURRENT_DATE - %s
+    ORDER BY dia
+    """
+    return db.execute_query(q, (int(dias),), read_only=True)
@@ -1,12 +1,14 @@
 import pandas as pd
 
+from cache import cached_report
 from database import get_database
 
 
+@cached_report(ttl=120, tables=("consumo_materiais", "materiais"))
 def get_consumo_vs_planeado(encomenda_id: int | None = None) -> pd.DataFrame:
     db = get_database()
     if encomenda_id is None:
-        return db.execute_query("SELECT * FROM vw_consumo_vs_planeado ORDER BY encomenda_id, material")
+        return db.execute_query("SELECT * FROM vw_consumo_vs_planeado ORDER BY encomenda_id, material", read_only=True)
 
     q = """
     SELECT *
@@ -14,17 +16,23 @@ def get_consumo_vs_planeado(encomenda_id: int | None = None) -> pd.DataFrame:
     WHERE encomenda_id = %s
     ORDER BY custo_real DESC
     """
-    return db.execute_query(q, (encomenda_id,))
+    return db.execute_query(q, (encomenda_id,), read_only=True)
 
 
+@cached_report(ttl=300, tables=("mv_desperdicio_mensal",))
 def get_desperdicio_mensal() -> pd.DataFrame:
+    """Desperdício por mês/material (vista materializada; ver `materialized_views`)."""
     db = get_database()
-    return db.execute_query("SELECT * FROM vw_desperdicio_mensal")
+    return db.execute_query(
+        "SELECT * FROM mv_desperdicio_mensal ORDER BY mes DESC, desperdicio_valor DESC",
+        read_only=True,
+    )
 
 
+@cached_report(ttl=300, tables=("mv_eficiencia_material",))
 def get_eficiencia_material() -> pd.DataFrame:
     db = get_database()
-    return db.execute_query("SELECT * FROM vw_eficiencia_material")
+    return db.execute_query("SELECT * FROM mv_eficiencia_material ORDER BY custo_desperdicio DESC", read_only=True)
 
 
 def initialize_planeado_for_encomenda(encomenda_id: int) -> bool:
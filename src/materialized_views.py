@@ -0,0 +1,123 @@
+"""Vistas materializadas de análise (`mv_*`, sql/schema.sql) e o seu refresh.
+
+Os relatórios agregados leem das `mv_*` em vez de recalcular as vistas sobre as
+tabelas inteiras a cada página. O refresh é feito pelo job `mv.refresh` do
+agendador, segundo a política de cada vista em `mv_refresh_policy` (periódico, ou
+quando está suja: os triggers registam as alterações em `mv_alteracoes` e o job
+passa-as para `suja`), com `REFRESH ... CONCURRENTLY` para não bloquear leituras. Depois de cada refresh é enviada uma notificação no canal do
+cache, para os outros processos descartarem os resultados antigos.
+"""
+
+from __future__ import annotations
+
+import time
+
+import pandas as pd
+
+try:
+    import cache
+    from cache import cached_report
+    from database import get_database
+except ModuleNotFoundError:
+    from src import cache
+    from src.cache import cached_report
+    from src.database import get_database
+
+
+# Vistas conhecidas (os nomes entram diretamente no SQL do refresh)
+MVIEWS = (
+    "mv_desperdicio_mensal",
+    "mv_eficiencia_material",
+    "mv_aging_report",
+    "mv_receita_faturada_vs_recebida",
+    "mv_cash_flow",
+    "mv_tempo_medio_real_vs_estimado",
+    "mv_produtividade_operario",
+)
+
+
+def refresh(nome: str) -> bool:
+    """Refresh (CONCURRENTLY) de uma vista e registo na política."""
+    if nome not in MVIEWS:
+        raise ValueError(f"Vista materializada desconhecida: {nome}")
+    db = get_database()
+    t = time.perf_counter()
+    # Limpar a marca antes do refresh: escritas feitas entretanto voltam a marcá-la.
+    ok = db.execute_update("UPDATE mv_refresh_policy SET suja = FALSE WHERE mv_nome = %s", (nome,))
+    ok = ok and db.execute_update(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {nome}")
+    duracao_ms = round((time.perf_counter() - t) * 1000.0, 1)
+
+    if ok:
+        db.execute_update(
+            """
+            UPDATE mv_refresh_policy
+            SET atualizada_em = CURRENT_TIMESTAMP, duracao_ms = %s, ultimo_erro = NULL
+            WHERE mv_nome = %s;
+            SELECT pg_notify('firma_cache', %s)
+            """,
+            (duracao_ms, nome, nome),
+        )
+    else:
+        erro = db.last_error
+        db.execute_update(
+            "UPDATE mv_refresh_policy SET suja = TRUE, ultimo_erro = %s WHERE mv_nome = %s",
+            (erro, nome),
+        )
+    cache.invalidate([nome, "mv_refresh_policy"])
+    return ok
+
+
+def refresh_due() -> bool:
+    """Faz refresh das vistas devidas segundo `mv_refresh_policy`. False se algum falhar."""
+    db = get_database()
+    if not db.execute_update("SELECT fn_mv_aplicar_alteracoes()"):
+        return False
+    q = """
+    SELECT mv_nome
+    FROM mv_refresh_policy
+    WHERE mv_nome = ANY(%s)
+      AND (
+        atualizada_em IS NULL
+        OR (modo = 'agendado' AND atualizada_em <= CURRENT_TIMESTAMP - make_interval(secs => intervalo_s))
+        OR (modo = 'alteracao' AND (
+                (suja AND atualizada_em <= CURRENT_TIMESTAMP - make_interval(secs => intervalo_s))
+                OR atualizada_em::date < CURRENT_DATE
+           ))
+      )
+    ORDER BY mv_nome
+    """
+    df = db.execute_query(q, (list(MVIEWS),))
+    if db.last_error:
+        return False
+    if df.empty:
+        return True
+    resultados = [refresh(nome) for nome in df["mv_nome"].tolist()]
+    return all(resultados)
+
+
+@cached_report(ttl=30, tables=("mv_refresh_policy",) + MVIEWS)
+def get_refresh_status() -> pd.DataFrame:
+    """Estado de cada vista: última atualização, se há alterações por refletir, duração e erro."""
+    db = get_database()
+    q = """
+    SELECT
+        p.mv_nome, p.modo, p.intervalo_s,
+        p.suja OR EXISTS (SELECT 1 FROM mv_alteracoes a WHERE a.tabela = ANY(p.tabelas)) AS suja,
+        p.atualizada_em, p.duracao_ms, p.ultimo_erro
+    FROM mv_refresh_policy p
+    ORDER BY p.mv_nome
+    """
+    return db.execute_query(q)
+
+
+def get_frescura(nome: str) -> dict:
+    """{'atualizada_em': Timestamp|None, 'suja': bool} de uma vista (para mostrar junto ao relatório)."""
+    df = get_refresh_status()
+    linha = df[df["mv_nome"] == nome] if not df.empty else df
+    if linha.empty:
+        return {"atualizada_em": None, "suja": False}
+    r = linha.iloc[0]
+    return {
+        "atualizada_em": None if pd.isna(r["atualizada_em"]) else r["atualizada_em"],
+        "suja": bool(r["suja"]),
+    }
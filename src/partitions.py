@@ -0,0 +1,79 @@
+"""Manutenção das partições mensais de `movimentos_stock` (sql/schema.sql, secção 11).
+
+O job `movimentos.particoes` do agendador cria as partições dos próximos meses antes
+de serem precisas e, com `MOVIMENTOS_RETENCAO_MESES` > 0, arquiva (desliga e move
+para o schema `arquivo`) as partições mais antigas do que a retenção.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import MOVIMENTOS_CONFIG
+
+try:
+    import cache
+    from cache import cached_report
+    from database import get_database
+except ModuleNotFoundError:
+    from src import cache
+    from src.cache import cached_report
+    from src.database import get_database
+
+
+def criar_particoes(meses_a_frente: int | None = None) -> int | None:
+    """Cria as partições em falta (e move as linhas da default). Devolve quantas criou; None = erro."""
+    if meses_a_frente is None:
+        meses_a_frente = MOVIMENTOS_CONFIG["meses_a_frente"]
+    db = get_database()
+    criadas = db.execute_returning("SELECT fn_movimentos_criar_particoes(%s)", (int(meses_a_frente),))
+    if criadas is None:
+        return None
+    cache.invalidate(["movimentos_stock"])
+    return int(criadas)
+
+
+def arquivar(antes_de: date) -> list[str] | None:
+    """Arquiva as partições de meses anteriores a `antes_de`. Devolve os nomes; None = erro."""
+    db = get_database()
+    df = db.execute_query("SELECT fn_movimentos_arquivar(%s) AS particao", (antes_de,), read_only=False)
+    if db.last_error:
+        return None
+    if not df.empty:
+        cache.invalidate(["movimentos_stock"])
+    return df["particao"].tolist() if not df.empty else []
+
+
+def manter_particoes() -> bool:
+    """Job do agendador: cria as próximas partições e aplica a retenção configurada."""
+    if criar_particoes() is None:
+        return False
+    meses = MOVIMENTOS_CONFIG["retencao_meses"]
+    if meses <= 0:
+        return True
+    hoje = date.today()
+    total = hoje.year * 12 + hoje.month - 1 - meses
+    return arquivar(date(total // 12, total % 12 + 1, 1)) is not None
+
+
+@cached_report(ttl=300, tables=("movimentos_stock",))
+def get_particoes() -> pd.DataFrame:
+    """Partições ligadas à tabela: limites, linhas (estimativa do planner) e tamanho."""
+    db = get_database()
+    q = """
+    SELECT
+        c.relname AS particao,
+        pg_get_expr(c.relpartbound, c.oid) AS limites,
+        GREATEST(c.reltuples, 0)::bigint AS linhas_estimadas,
+        pg_size_pretty(pg_total_relation_size(c.oid)) AS tamanho
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'movimentos_stock'::regclass
+    ORDER BY c.relname
+    """
+    return db.execute_query(q, read_only=True)
@@ -14,10 +14,12 @@ except ModuleNotFoundError as e:
 else:
     _PDF_IMPORT_ERROR = None
 
+# Importar como `database` (e não `src.database`) para partilhar o mesmo pool de ligações
+# que os restantes módulos.
 try:
-    from src.database import get_database
+    from database import get_database, register_query
 except ModuleNotFoundError:
-    from database import get_database
+    from src.database import get_database, register_query
 
 
 _PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -137,6 +139,13 @@ def _money(value: float) -> str:
     return f"€{value:,.2f}"
 
 
+def _date(value) -> str:
+    """Data em AAAA-MM-DD (as colunas DATE chegam como Timestamp do pandas)."""
+    if value is None or pd.isna(value):
+        return ""
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
 def _get_invoice_data(fatura_id: int):
     db = get_database()
 
@@ -177,8 +186,8 @@ def _get_invoice_data(fatura_id: int):
     ORDER BY id
     """
 
-    header = db.execute_query(header_q, (fatura_id,))
-    itens = db.execute_query(itens_q, (fatura_id,))
+    header = db.execute_query(register_query("pdf.fatura_header", header_q), (int(fatura_id),))
+    itens = db.execute_query(register_query("pdf.fatura_itens", itens_q), (int(fatura_id),))
 
     if header.empty:
         raise ValueError("Fatura não encontrada")
@@ -203,9 +212,9 @@ def generate_invoice_pdf(fatura_id: int, output_dir: str = "data/pdfs") -> str:
 
     pdf.set_font_regular(10)
     pdf.cell(0, 6, f"Nº: {header['num_fatura']}", ln=True)
-    pdf.cell(0, 6, f"Data emissão: {header['data_emissao']}", ln=True)
-    if header.get("vencimento") is not None:
-        pdf.cell(0, 6, f"Vencimento: {header['vencimento']}", ln=True)
+    pdf.cell(0, 6, f"Data emissão: {_date(header['data_emissao'])}", ln=True)
+    if _date(header.get("vencimento")):
+        pdf.cell(0, 6, f"Vencimento: {_date(header['vencimento'])}", ln=True)
     pdf.ln(2)
 
     pdf.set_font_bold(11)
@@ -312,7 +321,7 @@ def generate_orcamento_pdf(orcamento_id: int, output_dir: str = "data/pdfs") ->
 
     pdf.set_font_regular(10)
     pdf.cell(0, 6, f"ID: {r['id']}", ln=True)
-    pdf.cell(0, 6, f"Data: {r['data_orcamento']}", ln=True)
+    pdf.cell(0, 6, f"Data: {_date(r['data_orcamento'])}", ln=True)
     pdf.ln(2)
 
     pdf.set_font_bold(11)
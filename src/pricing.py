@@ -1,12 +1,14 @@
 import pandas as pd
-from database import get_database
+from cache import cached_report
+from database import get_database, register_query
 
 
+@cached_report(ttl=300, tables=("orcamentos", "produtos", "tipos_produto"))
 def get_rentabilidade_produtos(meses: int = 6) -> pd.DataFrame:
     """Retorna análise de rentabilidade por produto"""
     db = get_database()
     
-    query = f"""
+    query = """
     SELECT 
         tp.nome AS produto,
         COUNT(o.id) AS num_orcamentos,
@@ -19,14 +21,15 @@ def get_rentabilidade_produtos(meses: int = 6) -> pd.DataFrame:
     FROM orcamentos o
     JOIN produtos p ON o.produto_id = p.id
     JOIN tipos_produto tp ON p.tipo_produto_id = tp.id
-    WHERE o.data_orcamento >= CURRENT_DATE - INTERVAL '{meses} months'
+    WHERE o.data_orcamento >= CURRENT_DATE - make_interval(months => %s)
     GROUP BY tp.nome
     ORDER BY receita_total DESC
     """
     
-    return db.execute_query(query)
+    return db.execute_query(register_query("pricing.rentabilidade_produtos", query), (int(meses),), read_only=True)
 
 
+@cached_report(ttl=300, tables=("orcamentos", "produtos", "tipos_produto"))
 def get_precos_vs_mercado() -> pd.DataFrame:
     """Compara preços praticados vs custo médio (proxy de mercado)"""
     db = get_database()
@@ -46,14 +49,15 @@ def get_precos_vs_mercado() -> pd.DataFrame:
     ORDER BY diferenca_percentual
     """
     
-    return db.execute_query(query)
+    return db.execute_query(query, read_only=True)
 
 
+@cached_report(ttl=300, tables=("clientes", "orcamentos"))
 def get_top_clientes(limite: int = 10) -> pd.DataFrame:
     """Retorna top clientes por valor de negócio"""
     db = get_database()
     
-    query = f"""
+    query = """
     SELECT 
         c.nome AS cliente,
         c.morada AS localizacao,
@@ -65,12 +69,13 @@ def get_top_clientes(limite: int = 10) -> pd.DataFrame:
     JOIN orcamentos o ON c.id = o.cliente_id
     GROUP BY c.id, c.nome, c.morada
     ORDER BY valor_total DESC
-    LIMIT {limite}
+    LIMIT %s
     """
     
-    return db.execute_query(query)
+    return db.execute_query(register_query("pricing.top_clientes", query), (int(limite),), read_only=True)
 
 
+@cached_report(ttl=300, tables=("orcamentos", "produtos", "tipos_produto"))
 def get_margem_por_categoria() -> pd.DataFrame:
     """Análise de margem por categoria de produto"""
     db = get_database()
@@ -89,4 +94,4 @@ def get_margem_por_categoria() -> pd.DataFrame:
     ORDER BY receita_total DESC
     """
     
-    return db.execute_query(query)
\ No newline at end of file
+    return db.execute_query(query, read_only=True)
\ No newline at end of file
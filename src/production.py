@@ -1,8 +1,10 @@
 import pandas as pd
 
-from database import get_database
+from cache import cached_report
+from database import get_database, register_query
 
 
+@cached_report(ttl=30, tables=("etapas_producao",))
 def get_etapas_ativas() -> pd.DataFrame:
     """Etapas em andamento/pausadas com indicador de atraso."""
     db = get_database()
@@ -29,22 +31,27 @@ def get_etapas_ativas() -> pd.DataFrame:
     WHERE e.status IN ('em_andamento', 'pausado')
     ORDER BY em_atraso DESC, e.data_inicio ASC NULLS LAST
     """
-    return db.execute_query(q)
+    return db.execute_query(register_query("production.etapas_ativas", q), read_only=True)
 
 
+@cached_report(ttl=120, tables=("etapas_producao",))
 def get_gargalos() -> pd.DataFrame:
     db = get_database()
-    return db.execute_query("SELECT * FROM gargalos_producao")
+    return db.execute_query("SELECT * FROM gargalos_producao", read_only=True)
 
 
+@cached_report(ttl=300, tables=("mv_produtividade_operario",))
 def get_produtividade_operario() -> pd.DataFrame:
+    """Produtividade por operário (vista materializada; ver `materialized_views`)."""
     db = get_database()
-    return db.execute_query("SELECT * FROM produtividade_operario")
+    return db.execute_query("SELECT * FROM mv_produtividade_operario ORDER BY eficiencia_media_pct DESC", read_only=True)
 
 
+@cached_report(ttl=300, tables=("mv_tempo_medio_real_vs_estimado",))
 def get_tempo_medio_real_vs_estimado() -> pd.DataFrame:
+    """Tempo médio real vs estimado por tipo de etapa (vista materializada)."""
     db = get_database()
-    return db.execute_query("SELECT * FROM tempo_medio_real_vs_estimado")
+    return db.execute_query("SELECT * FROM mv_tempo_medio_real_vs_estimado ORDER BY desvio_medio_min DESC", read_only=True)
 
 
 def get_gantt_encomenda(encomenda_id: int) -> pd.DataFrame:
@@ -79,6 +86,23 @@ def create_etapa(
     return db.execute_update(q, (encomenda_id, tipo_etapa, int(tempo_estimado_min), responsavel))
 
 
+def create_etapas(
+    encomenda_id: int,
+    etapas: list[tuple[str, int, str | None]],
+) -> bool:
+    """Cria várias etapas (tipo_etapa, tempo_estimado_min, responsavel) num único INSERT."""
+    db = get_database()
+    q = """
+    INSERT INTO etapas_producao (encomenda_id, tipo_etapa, tempo_estimado, responsavel)
+    VALUES %s
+    """
+    rows = [
+        (int(encomenda_id), tipo_etapa, int(tempo_estimado_min), responsavel)
+        for tipo_etapa, tempo_estimado_min, responsavel in etapas
+    ]
+    return db.execute_values(q, rows)
+
+
 def _insert_event(etapa_id: int, evento: str, observacoes: str | None = None) -> bool:
     db = get_database()
     q = """
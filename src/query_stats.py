@@ -0,0 +1,231 @@
+"""Instrumentação das queries executadas através de `Database`.
+
+Para cada execução regista-se a função chamadora, o fingerprint normalizado da
+instrução (literais e parâmetros substituídos por `?`), a duração, as linhas e o
+tamanho aproximado do resultado. Execuções acima de `QUERY_LOG_CONFIG['slow_ms']`
+vão para um log rotativo; o agregado em memória (contagem, p50/p95 por
+fingerprint) alimenta a página de diagnóstico do dashboard.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import logging.handlers
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import QUERY_LOG_CONFIG
+
+
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+_INTERNAL_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.py"),
+}
+
+_RE_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """Forma normalizada da instrução: sem comentários, literais/parâmetros como `?`."""
+    s = _RE_COMMENT.sub(" ", sql)
+    s = _RE_STRING.sub("?", s)
+    s = _RE_PARAM.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("(?)", s)
+    return _RE_SPACES.sub(" ", s).strip().lower()
+
+
+def fingerprint_id(fp: str) -> str:
+    return hashlib.md5(fp.encode("utf-8")).hexdigest()[:10]
+
+
+def _caller() -> str:
+    """Primeira função fora da camada de BD na stack (ex: `inventory.get_stock_critico`)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES and not filename.endswith("contextlib.py"):
+            module = os.path.splitext(os.path.relpath(filename, _PROJECT_ROOT))[0]
+            module = module.replace(os.sep, ".")
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+@dataclass
+class _Aggregate:
+    fingerprint: str
+    kind: str
+    count: int = 0
+    errors: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+    callers: set = field(default_factory=set)
+    samples: deque = field(default_factory=deque)
+
+
+class QueryStats:
+    """Agregado em memória (por processo) das execuções por fingerprint."""
+
+    def __init__(self, samples_per_query: int = 500):
+        self._samples = int(samples_per_query)
+        self._lock = threading.Lock()
+        self._by_fp: dict[str, _Aggregate] = {}
+
+    def record(
+        self,
+        kind: str,
+        sql: str,
+        duration_s: float,
+        rows: int = 0,
+        bytes_: int = 0,
+        error: Optional[str] = None,
+        caller: Optional[str] = None,
+    ) -> None:
+        fp = fingerprint(sql)
+        with self._lock:
+            agg = self._by_fp.get(fp)
+            if agg is None:
+                agg = self._by_fp[fp] = _Aggregate(fp, kind, samples=deque(maxlen=self._samples))
+            agg.count += 1
+            agg.total_s += duration_s
+            agg.max_s = max(agg.max_s, duration_s)
+            agg.rows += int(rows or 0)
+            agg.bytes += int(bytes_ or 0)
+            agg.samples.append(duration_s)
+            if error:
+                agg.errors += 1
+            if caller and len(agg.callers) < 10:
+                agg.callers.add(caller)
+
+        duration_ms = duration_s * 1000.0
+        if error or duration_ms >= QUERY_LOG_CONFIG["slow_ms"]:
+            _log_slow(kind, fp, duration_ms, rows, bytes_, caller, error)
+
+    def snapshot(self) -> pd.DataFrame:
+        """Tabela com contagem e percentis (ms) por fingerprint, ordenada por tempo total."""
+        with self._lock:
+            aggs = [
+                (a.fingerprint, a.kind, a.count, a.errors, a.total_s, a.max_s, a.rows, a.bytes,
+                 sorted(a.callers), np.fromiter(a.samples, dtype=np.float64))
+                for a in self._by_fp.values()
+            ]
+
+        records = []
+        for fp, kind, count, errors, total_s, max_s, rows, bytes_, callers, samples in aggs:
+            p50, p95 = (np.percentile(samples, [50, 95]) * 1000.0) if samples.size else (0.0, 0.0)
+            records.append({
+                "id": fingerprint_id(fp),
+                "tipo": kind,
+                "chamadores": ", ".join(callers),
+                "execucoes": count,
+                "erros": errors,
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "max_ms": round(max_s * 1000.0, 2),
+                "total_ms": round(total_s * 1000.0, 2),
+                "linhas": rows,
+                "bytes": bytes_,
+                "fingerprint": fp,
+            })
+
+        df = pd.DataFrame.from_records(records)
+        if not df.empty:
+            df = df.sort_values("total_ms", ascending=False, ignore_index=True)
+        return df
+
+    def reset(self) -> None:
+        with self._lock:
+            self._by_fp.clear()
+
+
+stats = QueryStats(QUERY_LOG_CONFIG["samples_per_query"])
+
+
+class _Measurement:
+    __slots__ = ("rows", "bytes")
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+
+@contextmanager
+def track(kind: str, sql: str):
+    """Mede uma execução; quem chama preenche `rows`/`bytes` no objeto devolvido."""
+    m = _Measurement()
+    caller = _caller()
+    started = time.perf_counter()
+    try:
+        yield m
+    except BaseException as e:
+        stats.record(kind, sql, time.perf_counter() - started, m.rows, m.bytes, error=str(e) or type(e).__name__, caller=caller)
+        raise
+    stats.record(kind, sql, time.perf_counter() - started, m.rows, m.bytes, caller=caller)
+
+
+# --------------------------------------------
+# Log de queries lentas (ficheiro rotativo)
+# --------------------------------------------
+
+_slow_logger: Optional[logging.Logger] = None
+_slow_logger_lock = threading.Lock()
+
+
+def _get_slow_logger() -> logging.Logger:
+    global _slow_logger
+    if _slow_logger is None:
+        with _slow_logger_lock:
+            if _slow_logger is None:
+                logger = logging.getLogger("firma.slow_queries")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                path = QUERY_LOG_CONFIG["path"]
+                if not os.path.isabs(path):
+                    path = os.path.join(_PROJECT_ROOT, path)
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    handler: logging.Handler = logging.handlers.RotatingFileHandler(
+                        path,
+                        maxBytes=QUERY_LOG_CONFIG["max_bytes"],
+                        backupCount=QUERY_LOG_CONFIG["backup_count"],
+                        encoding="utf-8",
+                    )
+                except OSError:
+                    handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+                logger.addHandler(handler)
+                _slow_logger = logger
+    return _slow_logger
+
+
+def _log_slow(kind, fp, duration_ms, rows, bytes_, caller, error) -> None:
+    logger = _get_slow_logger()
+    msg = (
+        f"{kind} {duration_ms:.1f}ms rows={rows} bytes={bytes_} caller={caller} "
+        f"id={fingerprint_id(fp)} sql={fp[:500]}"
+    )
+    if error:
+        logger.error(f"{msg} error={error}")
+    else:
+        logger.warning(msg)
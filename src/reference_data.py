@@ -0,0 +1,59 @@
+"""Listas de referência (dropdowns) com versão e mapas label→id já construídos.
+
+A versão de cada lista vem de `cache.table_versions` sobre as tabelas de onde é
+lida: muda quando a própria app escreve nessas tabelas (ou quando chega uma
+notificação de outro processo), pelo que pode ser usada como chave de cache
+(ex: `st.cache_data`) sem TTL curtos.
+"""
+
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import forms
+from cache import table_versions
+
+
+@dataclass
+class ListaReferencia:
+    nome: str
+    df: pd.DataFrame
+    # label mostrado no selectbox -> id
+    opcoes: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def labels(self) -> list[str]:
+        return list(self.opcoes)
+
+    @property
+    def vazia(self) -> bool:
+        return not self.opcoes
+
+
+# nome -> (função que lê a lista, tabelas de onde é lida, coluna extra no label)
+LISTAS = {
+    "clientes": (forms.get_lista_clientes, ("clientes",), None),
+    "produtos": (forms.get_lista_produtos, ("produtos", "tipos_produto"), None),
+    "tipos_produto": (forms.get_lista_tipos_produto, ("tipos_produto",), None),
+    "fornecedores": (forms.get_lista_fornecedores, ("fornecedores",), None),
+    "materiais": (forms.get_lista_materiais, ("materiais",), "unidade"),
+}
+
+
+def versao(nome: str) -> tuple:
+    """Versão atual da lista `nome` (muda quando as tabelas de origem são escritas)."""
+    _, tabelas, _ = LISTAS[nome]
+    return table_versions(tabelas)
+
+
+def carregar(nome: str) -> ListaReferencia:
+    """Lê a lista da BD e constrói o mapa label→id (ex: '12 - Tubo inox (metro)' -> 12)."""
+    loader, _, extra = LISTAS[nome]
+    df = loader()
+    if df.empty:
+        return ListaReferencia(nome, df)
+
+    labels = df["id"].astype(str) + " - " + df["nome"].astype(str)
+    if extra is not None:
+        labels = labels + " (" + df[extra].astype(str) + ")"
+    return ListaReferencia(nome, df, dict(zip(labels, df["id"].astype(int).tolist())))
@@ -0,0 +1,202 @@
+"""Jobs periódicos de manutenção (fora do caminho de render das páginas).
+
+Jobs: faturas vencidas, refresh das vistas materializadas, KPIs do dia, partições de
+`movimentos_stock`, snapshot diário do stock e aquecimento do cache.
+
+Cada job tem uma linha em `jobs_agendados` (sql/schema.sql) com a próxima execução
+e o resultado da última. Os jobs globais (ex: marcar faturas vencidas) são
+reclamados com um `UPDATE ... WHERE proxima_execucao <= agora`, pelo que com vários
+processos (app + `scripts/run_scheduler.py`) cada execução corre num só. Os jobs
+por processo (ex: aquecer o cache em memória) correm em todos.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import SCHEDULER_CONFIG
+
+try:
+    import cache
+    import inventory
+    import invoicing
+    import kpi
+    import materialized_views
+    import partitions
+    from database import clear_thread_error, get_database, last_thread_error
+except ModuleNotFoundError:
+    from src import cache, inventory, invoicing, kpi, materialized_views, partitions
+    from src.database import clear_thread_error, get_database, last_thread_error
+
+
+@dataclass
+class Job:
+    nome: str
+    intervalo_s: int
+    # Devolve False (ou levanta exceção) em caso de falha
+    fn: Callable[[], object]
+    por_processo: bool = False
+
+
+def _aquecer_cache() -> int:
+    # Recalcula o que expira antes da próxima execução do job
+    return cache.warm_up(within_s=2 * SCHEDULER_CONFIG["cache_warmup_s"])
+
+
+def default_jobs() -> list[Job]:
+    return [
+        Job("faturas.vencidas", SCHEDULER_CONFIG["faturas_vencidas_s"], invoicing.refresh_vencidas),
+        Job("mv.refresh", SCHEDULER_CONFIG["mv_refresh_s"], materialized_views.refresh_due),
+        Job("kpi.snapshot", SCHEDULER_CONFIG["kpi_snapshot_s"], kpi.atualizar_snapshot),
+        Job("movimentos.particoes", SCHEDULER_CONFIG["movimentos_particoes_s"], partitions.manter_particoes),
+        Job("stock.snapshot", SCHEDULER_CONFIG["stock_snapshot_s"], inventory.registar_snapshot_stock),
+        Job("cache.aquecer", SCHEDULER_CONFIG["cache_warmup_s"], _aquecer_cache, por_processo=True),
+    ]
+
+
+class Scheduler(threading.Thread):
+    """Thread que corre os jobs devidos a cada `poll_s` segundos."""
+
+    def __init__(self, jobs: list[Job], poll_s: float = 15.0):
+        super().__init__(name="firma_scheduler", daemon=True)
+        self.jobs = list(jobs)
+        self.poll_s = poll_s
+        self._stop_event = threading.Event()
+        self.registered = False
+        # Jobs por processo: próxima execução (time.monotonic)
+        self._local_due: dict[str, float] = {}
+        self.last_error: Optional[str] = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def register(self) -> bool:
+        db = get_database()
+        q = """
+        INSERT INTO jobs_agendados (nome, intervalo_s, por_processo)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (nome) DO UPDATE
+        SET intervalo_s = EXCLUDED.intervalo_s, por_processo = EXCLUDED.por_processo
+        """
+        for job in self.jobs:
+            if not db.execute_update(q, (job.nome, int(job.intervalo_s), job.por_processo)):
+                self.last_error = db.last_error
+                return False
+        return True
+
+    def _claim(self, job: Job) -> bool:
+        """True se este processo deve correr o job agora."""
+        if job.por_processo:
+            now = time.monotonic()
+            if self._local_due.get(job.nome, 0.0) > now:
+                return False
+            self._local_due[job.nome] = now + job.intervalo_s
+            return True
+
+        db = get_database()
+        q = """
+        UPDATE jobs_agendados
+        SET proxima_execucao = CURRENT_TIMESTAMP + make_interval(secs => intervalo_s),
+            ultima_execucao = CURRENT_TIMESTAMP
+        WHERE nome = %s AND proxima_execucao <= CURRENT_TIMESTAMP
+        RETURNING nome
+        """
+        return db.execute_returning(q, (job.nome,)) is not None
+
+    def _record(self, job: Job, erro: Optional[str], duracao_ms: float) -> None:
+        db = get_database()
+        q = """
+        UPDATE jobs_agendados
+        SET ultima_execucao = CASE WHEN por_processo THEN CURRENT_TIMESTAMP ELSE ultima_execucao END,
+            ultimo_fim = CURRENT_TIMESTAMP,
+            ultimo_estado = %s,
+            ultimo_erro = %s,
+            duracao_ms = %s,
+            execucoes = execucoes + 1
+        WHERE nome = %s
+        """
+        db.execute_update(q, ("erro" if erro else "ok", erro, round(duracao_ms, 1), job.nome))
+
+    def run_job(self, job: Job) -> Optional[str]:
+        """Corre o job e regista o resultado. Devolve a mensagem de erro (None = ok)."""
+        t = time.perf_counter()
+        erro = None
+        # Os jobs usam as suas próprias instâncias de Database: o detalhe vem do erro da thread.
+        clear_thread_error()
+        try:
+            if job.fn() is False:
+                erro = last_thread_error() or "falhou"
+        except Exception as e:
+            erro = str(e) or type(e).__name__
+        if erro:
+            print(f"Job {job.nome} falhou: {erro}")
+        self._record(job, erro, (time.perf_counter() - t) * 1000.0)
+        return erro
+
+    def run_pending(self) -> int:
+        """Corre os jobs devidos (uma passagem). Devolve quantos correram."""
+        if not self.registered:
+            self.registered = self.register()
+            if not self.registered:
+                return 0
+        ran = 0
+        for job in self.jobs:
+            if self._stop_event.is_set():
+                break
+            if self._claim(job):
+                self.run_job(job)
+                ran += 1
+        return ran
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Erro no agendador: {e}")
+            self._stop_event.wait(self.poll_s)
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler() -> Optional[Scheduler]:
+    """Arranca o agendador do processo (idempotente). Devolve None se estiver desativado."""
+    global _scheduler
+    if not SCHEDULER_CONFIG["in_app"]:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = Scheduler(default_jobs(), SCHEDULER_CONFIG["poll_s"])
+            _scheduler.start()
+    return _scheduler
+
+
+def stop_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
+
+
+def get_jobs_status() -> pd.DataFrame:
+    """Estado dos jobs (última execução, resultado, próxima execução) para a página de diagnóstico."""
+    db = get_database()
+    q = """
+    SELECT nome, por_processo, intervalo_s, ultima_execucao, ultimo_fim, ultimo_estado,
+           duracao_ms, execucoes, proxima_execucao, ultimo_erro
+    FROM jobs_agendados
+    ORDER BY nome
+    """
+    return db.execute_query(q)
@@ -25,6 +25,15 @@ def create_line_chart(df: pd.DataFrame, x: str, y: str, title: str, color: str =
     return fig
 
 
+def create_sparkline(df: pd.DataFrame, x: str, y: str):
+    """Mini gráfico de tendência (sem eixos), para mostrar por baixo de um KPI"""
+    fig = px.line(df, x=x, y=y)
+    fig.update_layout(height=70, margin=dict(l=0, r=0, t=0, b=0), showlegend=False)
+    fig.update_xaxes(visible=False)
+    fig.update_yaxes(visible=False)
+    return fig
+
+
 def create_scatter_chart(df: pd.DataFrame, x: str, y: str, title: str, 
                         color: str = None, size: str = None):
     """Cria gráfico de dispersão"""
@@ -0,0 +1,33 @@
+import pytest
+
+import bulk_import
+
+
+class CopyCursor:
+    def __init__(self):
+        self.dados = []
+
+    def copy_expert(self, sql, ficheiro):
+        conteudo = ficheiro.read()
+        self.dados.append(conteudo.decode("utf-8") if isinstance(conteudo, bytes) else conteudo)
+
+
+def test_parquet_inteiro_com_nulos_continua_inteiro(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    caminho = tmp_path / "movimentos.parquet"
+    tabela = pa.table({
+        "material_id": pa.array([3, 7], type=pa.int64()),
+        "encomenda_id": pa.array([None, 12], type=pa.int64()),
+        "quantidade": pa.array([1.5, 2.0]),
+    })
+    pq.write_table(tabela, caminho)
+
+    cursor = CopyCursor()
+    bulk_import._copy_parquet(
+        cursor, "_stg_movimentos_stock", tabela.column_names, bulk_import._abrir_parquet(str(caminho)), 1000
+    )
+
+    linhas = "".join(cursor.dados).splitlines()
+    assert linhas == ["3,,1.5", "7,12,2"]
@@ -0,0 +1,266 @@
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+import database
+from database import Database
+
+
+class FakeCursor:
+    def __init__(self, conn, batches, columns):
+        self.conn = conn
+        self.batches = list(batches)
+        self.columns = columns
+        self.description = None
+        self.closed = False
+        self.itersize = None
+
+    def execute(self, query, params=None):
+        if not self.conn.autocommit:
+            self.conn.in_transaction = True
+
+    def fetchmany(self, size):
+        # Como num cursor do servidor: a descrição só chega com o primeiro FETCH
+        self.description = [SimpleNamespace(name=n, type_code=oid) for n, oid in self.columns]
+        return self.batches.pop(0) if self.batches else []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, batches, columns):
+        self.batches = batches
+        self.columns = columns
+        self._autocommit = True
+        self.in_transaction = False
+        self.closed = False
+        self.rollbacks = 0
+        self.commits = 0
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        if value and self.in_transaction:
+            raise psycopg2.ProgrammingError("set_session cannot be used inside a transaction")
+        self._autocommit = value
+
+    def cursor(self, name=None):
+        return FakeCursor(self, self.batches, self.columns)
+
+    def commit(self):
+        self.commits += 1
+        self.in_transaction = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned = []
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, discard=False):
+        self.returned.append(conn)
+
+
+@pytest.fixture(autouse=True)
+def _sem_register_type(monkeypatch):
+    monkeypatch.setattr(database.psycopg2.extensions, "register_type", lambda *args: None)
+
+
+def test_iter_query_fechado_a_meio_faz_rollback_e_devolve_a_ligacao():
+    conn = FakeConnection([[(1,), (2,)], [(3,)]], [("id", 23)])
+    pool = FakePool(conn)
+    it = Database(pool).iter_query("SELECT id FROM t", chunk_size=2)
+
+    primeiro = next(it)
+    assert primeiro["id"].tolist() == [1, 2]
+    it.close()
+
+    assert conn.rollbacks == 1
+    assert conn.autocommit is True
+    assert pool.returned == [conn]
+
+
+def test_export_csv_sem_linhas_escreve_cabecalho(tmp_path):
+    conn = FakeConnection([], [("id", 23), ("nome", 25)])
+    destino = tmp_path / "vazio.csv"
+
+    total = Database(FakePool(conn)).export_csv("SELECT id, nome FROM t", str(destino))
+
+    assert total == 0
+    assert destino.read_text(encoding="utf-8").splitlines() == ["id,nome"]
+
+
+def test_export_csv_cabecalho_uma_vez(tmp_path):
+    conn = FakeConnection([[(1, "a"), (2, "b")], [(3, "c")]], [("id", 23), ("nome", 25)])
+    destino = tmp_path / "dados.csv"
+
+    total = Database(FakePool(conn)).export_csv("SELECT id, nome FROM t", str(destino), chunk_size=2)
+
+    assert total == 3
+    assert destino.read_text(encoding="utf-8").splitlines() == ["id,nome", "1,a", "2,b", "3,c"]
+
+
+class FakePooledConnection:
+    def __init__(self):
+        self.info = SimpleNamespace(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.autocommit = True
+        self.closed = False
+        self.executed = []
+        self.cancels = 0
+
+    def cursor(self):
+        conn = self
+
+        class _Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=None):
+                conn.executed.append(sql)
+
+        return _Cursor()
+
+    def cancel(self):
+        self.cancels += 1
+
+
+def test_timeout_vai_na_mesma_mensagem_e_nao_fica_na_sessao():
+    conn = FakePooledConnection()
+    pool = database.ConnectionPool({}, min_size=0)
+
+    assert database._timeout_prefix(conn, 250) == "SET LOCAL statement_timeout = 250; "
+    assert database._timeout_prefix(conn, None) == ""
+    conn.autocommit = False
+    assert database._timeout_prefix(conn, 250) == ""
+    conn.autocommit = True
+
+    # Nada a repor na devolução ao pool
+    pool.putconn(conn)
+    assert conn.executed == []
+    assert pool.stats()["idle"] == 1
+
+
+def test_watchdog_cancela_so_as_queries_que_passam_do_limite():
+    import time
+
+    watchdog = database._Watchdog(linger_s=1.0)
+    rapida, lenta = FakePooledConnection(), FakePooledConnection()
+
+    with watchdog.watch(rapida, 0.5):
+        pass
+    thread = watchdog._thread
+    with watchdog.watch(lenta, 0.05):
+        time.sleep(0.3)
+
+    assert rapida.cancels == 0
+    assert lenta.cancels == 1
+    # A mesma thread serviu as duas queries
+    assert watchdog._thread is thread
+
+
+def test_typed_frame_datas_fora_do_intervalo_do_pandas_nao_viram_nat():
+    from datetime import date, datetime
+
+    description = [SimpleNamespace(name="dia", type_code=1082), SimpleNamespace(name="em", type_code=1114)]
+    rows = [(date(9999, 12, 31), datetime(2026, 1, 1, 8, 0)), (None, None)]
+
+    df = database.typed_frame(description, rows)
+
+    # pandas 2 não representa o ano 9999 em ns (fica object); o pandas 3 usa outra resolução
+    assert str(df["dia"].iloc[0]).startswith("9999-12-31")
+    assert df["dia"].isna().tolist() == [False, True]
+    assert df["em"].dtype.kind == "M"
+
+
+def test_typed_frame_data_que_o_pandas_nao_converte_fica_object(monkeypatch):
+    from datetime import date
+
+    # Comportamento do pandas 2 (requirements.txt): fora de 1677–2262 o coerce dá NaT
+    to_datetime = database.pd.to_datetime
+
+    def to_datetime_ns(values, **kwargs):
+        values = values.where(values.map(lambda v: v is None or v.year < 2262), None)
+        return to_datetime(values, **kwargs)
+
+    monkeypatch.setattr(database.pd, "to_datetime", to_datetime_ns)
+    description = [SimpleNamespace(name="dia", type_code=1082)]
+
+    df = database.typed_frame(description, [(date(9999, 12, 31),), (date(2026, 1, 1),), (None,)])
+
+    assert df["dia"].dtype == object
+    assert df["dia"].tolist()[:2] == [date(9999, 12, 31), date(2026, 1, 1)]
+    assert df["dia"].isna().tolist() == [False, False, True]
+
+
+def _router_saudavel(monkeypatch):
+    router = database.ReplicaRouter("host=replica", read_your_writes_s=5.0)
+
+    def check():
+        router.healthy = True
+
+    monkeypatch.setattr(router, "_check", check)
+    return router
+
+
+def test_janela_read_your_writes_e_so_da_sessao_que_escreveu(monkeypatch):
+    import contextvars
+
+    router = _router_saudavel(monkeypatch)
+    escritor, leitor = contextvars.Context(), contextvars.Context()
+
+    escritor.run(database.set_write_session)
+    leitor.run(database.set_write_session)
+    escritor.run(database.note_write)
+
+    assert escritor.run(router.usable) is False
+    assert leitor.run(router.usable) is True
+    # Contexto sem sessão associada (ex: outra thread) também continua na réplica
+    assert contextvars.Context().run(router.usable) is True
+
+
+def test_sessao_de_escritas_partilhada_entre_contextos(monkeypatch):
+    import contextvars
+
+    router = _router_saudavel(monkeypatch)
+    sessao = database.WriteSession()
+
+    def render(fn):
+        # Ex: cada render do dashboard associa a sessão guardada em `st.session_state`
+        database.set_write_session(sessao)
+        return fn()
+
+    contextvars.Context().run(render, database.note_write)
+
+    assert contextvars.Context().run(render, router.usable) is False
+
+
+def test_typed_frame_inteiros_e_booleanos_com_nulls_continuam_inteiros_e_booleanos():
+    description = [
+        SimpleNamespace(name="encomenda_id", type_code=23),
+        SimpleNamespace(name="paga", type_code=16),
+        SimpleNamespace(name="id", type_code=20),
+    ]
+    rows = [(12, True, 1), (None, None, 2)]
+
+    df = database.typed_frame(description, rows)
+
+    assert str(df["encomenda_id"].dtype) == "Int64"
+    assert df["encomenda_id"].iloc[0] == 12 and df["encomenda_id"].isna().tolist() == [False, True]
+    assert str(df["paga"].dtype) == "boolean"
+    assert df["paga"].isna().tolist() == [False, True]
+    assert df["id"].dtype == "int64"
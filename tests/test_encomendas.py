@@ -0,0 +1,32 @@
+from datetime import date
+
+import encomendas
+
+
+class DbPaginas:
+    def __init__(self):
+        self.chamadas = []
+
+    def execute_page(self, name, query, params, **kwargs):
+        self.chamadas.append((name, query, params))
+
+
+def test_pagina_encomendas_uma_instrucao_por_combinacao_de_filtros(monkeypatch):
+    db = DbPaginas()
+    monkeypatch.setattr(encomendas, "get_database", lambda: db)
+
+    encomendas.pagina_encomendas(status=["pendente"])
+    encomendas.pagina_encomendas(status=["pendente"], data_de=date(2026, 1, 1))
+    encomendas.pagina_encomendas()
+
+    nomes = [nome for nome, _, _ in db.chamadas]
+    assert len(set(nomes)) == 3
+    for _, query, params in db.chamadas:
+        # Só predicados dos filtros definidos, sem `IS NULL OR` que estraga o plano genérico
+        assert "IS NULL" not in query
+        assert set(params) <= {"status", "data_de", "data_ate", "busca"}
+
+    _, query, params = db.chamadas[0]
+    assert "e.status = ANY(%(status)s::text[])" in query
+    assert "data_pedido >=" not in query
+    assert params == {"status": ["pendente"]}
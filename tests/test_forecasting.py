@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import forecasting
+
+
+def test_ajustar_consumo_constante_usa_ses_com_a_mesma_previsao():
+    y = np.full((2, 120), 5.0)
+
+    aj = forecasting.ajustar(y, [10, 10])
+
+    assert aj.modelo.tolist() == ["ses", "ses"]
+    np.testing.assert_allclose(aj.previsao_diaria, 5.0)
+    np.testing.assert_allclose(aj.desvio_diario, 0.0)
+    np.testing.assert_allclose(aj.ponto_encomenda, 50.0)
+
+
+def test_ajustar_consumo_intermitente_usa_croston():
+    y = np.zeros((1, 140))
+    y[0, ::7] = 14.0  # 14 unidades de 7 em 7 dias
+
+    aj = forecasting.ajustar(y, [5])
+
+    assert aj.modelo.tolist() == ["croston"]
+    np.testing.assert_allclose(aj.previsao_diaria, 2.0, rtol=1e-3)
+
+
+def test_ajustar_sem_consumo_fica_sem_historico():
+    y = np.zeros((1, 30))
+
+    aj = forecasting.ajustar(y, [5])
+
+    assert aj.modelo.tolist() == ["sem_historico"]
+    assert aj.previsao_diaria.tolist() == [0.0]
+    assert aj.ponto_encomenda.tolist() == [0.0]
+
+
+def test_ajustar_sem_dias_de_historico_nao_falha():
+    aj = forecasting.ajustar(np.zeros((3, 0)), [5, 5, 5])
+
+    assert aj.modelo.tolist() == ["sem_historico"] * 3
+    assert not np.isnan(aj.previsao_diaria).any()
+    assert not np.isnan(aj.ponto_encomenda).any()
+
+
+def test_get_previsao_consumo_rejeita_historico_negativo():
+    with pytest.raises(ValueError):
+        forecasting.get_previsao_consumo.__wrapped__(30, -1)
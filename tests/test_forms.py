@@ -0,0 +1,24 @@
+import forms
+
+
+class DatabaseFalsa:
+    def __init__(self):
+        self.lotes = []
+
+    def execute_many(self, statements):
+        self.lotes.append(statements)
+        return True
+
+    def execute_update(self, query, params=None):
+        raise AssertionError("movimento e stock têm de ir na mesma transação")
+
+
+def test_registar_movimento_stock_grava_movimento_e_stock_na_mesma_transacao(monkeypatch):
+    db = DatabaseFalsa()
+    monkeypatch.setattr(forms, "get_database", lambda: db)
+
+    assert forms.registar_movimento_stock(7, "saida", 2.5, motivo="obra") is True
+
+    [lote] = db.lotes
+    assert "INSERT INTO movimentos_stock" in lote[0][0]
+    assert lote[1] == ("UPDATE materiais SET stock_atual = stock_atual - %s WHERE id = %s", (2.5, 7))
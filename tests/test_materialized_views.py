@@ -0,0 +1,28 @@
+import pandas as pd
+
+import materialized_views
+
+
+class DatabaseFalsa:
+    def __init__(self):
+        self.last_error = None
+        self.updates = []
+        self.queries = []
+
+    def execute_update(self, query, params=None):
+        self.updates.append(query)
+        return True
+
+    def execute_query(self, query, params=None):
+        self.queries.append(query)
+        return pd.DataFrame({"mv_nome": []})
+
+
+def test_refresh_due_aplica_as_alteracoes_antes_de_escolher_as_vistas(monkeypatch):
+    db = DatabaseFalsa()
+    monkeypatch.setattr(materialized_views, "get_database", lambda: db)
+
+    assert materialized_views.refresh_due() is True
+
+    assert db.updates == ["SELECT fn_mv_aplicar_alteracoes()"]
+    assert len(db.queries) == 1
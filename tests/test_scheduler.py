@@ -0,0 +1,70 @@
+import cache
+import database
+import scheduler
+from database import Database
+
+
+class PoolSemLigacao:
+    def getconn(self):
+        raise RuntimeError("ligação recusada")
+
+    def putconn(self, conn, discard=False):
+        pass
+
+
+class CursorSemLinhas:
+    rowcount = 0
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class PoolComLigacao:
+    def getconn(self):
+        return type("Ligacao", (), {"cursor": lambda self: CursorSemLinhas()})()
+
+    def putconn(self, conn, discard=False):
+        pass
+
+
+def test_controlo_do_agendador_nao_conta_como_escrita(monkeypatch):
+    escritas, invalidadas = [], []
+    monkeypatch.setattr(database, "note_write", lambda: escritas.append(1))
+    monkeypatch.setattr(cache.report_cache, "invalidate", lambda tables: invalidadas.append(tables))
+    monkeypatch.setattr(scheduler, "get_database", lambda: Database(PoolComLigacao()))
+
+    s = scheduler.Scheduler([])
+    job = scheduler.Job("teste", 60, lambda: True)
+    assert s._claim(job) is False
+    s._record(job, None, 1.0)
+
+    assert cache.tables_written("UPDATE jobs_agendados SET execucoes = 0") == set()
+    assert escritas == [] and invalidadas == []
+
+
+def test_run_job_regista_o_erro_da_instancia_usada_pelo_job(monkeypatch):
+    registos = []
+    monkeypatch.setattr(scheduler.Scheduler, "_record", lambda self, job, erro, ms: registos.append(erro))
+
+    def job_que_falha():
+        return Database(PoolSemLigacao()).execute_update("UPDATE faturas SET status = 'vencida'")
+
+    s = scheduler.Scheduler([])
+    erro = s.run_job(scheduler.Job("teste", 60, job_que_falha))
+
+    assert erro == "ligação recusada"
+    assert registos == ["ligação recusada"]
+
+
+def test_run_job_sem_detalhe_usa_mensagem_generica(monkeypatch):
+    monkeypatch.setattr(scheduler.Scheduler, "_record", lambda self, job, erro, ms: None)
+
+    s = scheduler.Scheduler([])
+    assert s.run_job(scheduler.Job("teste", 60, lambda: False)) == "falhou"
+    assert s.run_job(scheduler.Job("teste", 60, lambda: True)) is None